@@ -1,7 +1,12 @@
 from modules.PoolManager import PoolManager
 from modules.Server import Server
-from modules.comms import TCPServers
-from modules.comms.TCPQueueCommunicator import TCPQueueCommunicator
+from modules.Scheduler import Scheduler
+from modules.ControlPlane import ControlPlane
+from modules.Router import Router
+from modules.Placement import PlacementStrategy, parse_anti_affinity
+from modules.Consolidation import plan_consolidation
+from modules.Scaling import DemandTracker, ScalingController, make_policy
+from modules.comms.AsyncLobbyServer import AsyncLobbyServer, LobbyRequest
 from modules.comms.LoadBalancerToMCMain import LBFormattedMsg
 import queue
 import threading
@@ -10,7 +15,6 @@ import sys
 from enum import Enum
 import json
 from json import JSONDecodeError
-import datetime
 from root import *
 import re
 from main.MCServerMain import CommandSet as MCCommands
@@ -26,52 +30,105 @@ class CommandSet(Enum):
     LISTSERVERS = 'list_all'
     QUERYMC = 'poll_mc'
     STATE = "status"
+    SCALINGLOG = 'scaling_log'
 
 
 class LoadBalancerMain:
 
+    JOB_POOL_POLL = 'pool_poll'
+    JOB_SERVER_POLL = 'server_poll'
+    JOB_SCALING = 'scaling_check'
+    JOB_TEAMS_REFRESH = 'teams_refresh'
+    JOB_HEARTBEATS = 'heartbeats'
+
     def __init__(self, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'),
-                 credentials=os.path.join(ROOT_DIR, 'configs/SECRET_paleast_credentials.cfg')):
-        self.pool = PoolManager(config=config)
+                 credentials=os.path.join(ROOT_DIR, 'configs/SECRET_paleast_credentials.cfg'),
+                 clock=time.monotonic, pool=None):
+        """
+        :param config: config file
+        :param clock: time source of the scheduler, the scaling controller and the pool, for tests and simulation
+        :param pool: PoolManager to balance. Defaults to a new one on config
+        """
+        self.clock = clock
+        self.pool = pool if pool is not None else PoolManager(config=config, clock=clock)
         self.config = self.pool.config
         self.lobbyThread = None
         self.lobbyPort = int(self.config.get('POOL', 'lobby_port'))
-        self.msgs_from_lobby = queue.Queue()
-        self.replies_to_lobby = queue.Queue()
+        self.lobbyReplyTimeout = int(self.config.get('POOL', 'lobby_reply_timeout', fallback=30))
+        self.lobbyPipelineDepth = int(self.config.get('POOL', 'lobby_pipeline_depth', fallback=64))
+        self.events = queue.Queue()         # LobbyRequests from the lobby thread + callbacks posted by other threads
+        self.scheduler = Scheduler(clock=clock)
+        self.control = ControlPlane(self.pool, self.scheduler)     # runs the scheduled jobs + slow commands
+        self.router = Router(self.pool, int(self.config.get('SERVER', 'maxTeamsPerServer')),
+                             int(self.config.get('SERVER', 'maxPlayersOverall')),
+                             strategy=PlacementStrategy(self.config.get('SERVER', 'placementStrategy',
+                                                                        fallback=PlacementStrategy.WORST_FIT.value)),
+                             team_size=int(self.config.get('SERVER', 'maxPlayersPerTeam', fallback=0)),
+                             anti_affinity=parse_anti_affinity(self.config.get('SERVER', 'antiAffinityGroups',
+                                                                               fallback='')))
         self.state = LoadBalancerMain.State.STARTING
-        self.target_deallocation_server = None
+        self.deallocation_targets = []     # servers being drained by the current consolidation round
+        self.demand = DemandTracker(alpha=float(self.config.get('LOAD', 'forecastAlpha', fallback=0.3)),
+                                    beta=float(self.config.get('LOAD', 'forecastBeta', fallback=0.1)),
+                                    clock=clock)
+        self.scaling_policy = make_policy(self.config)     # [LOAD] scalingPolicy
+        self.scaling = ScalingController.from_config(self.config, self.scaling_policy, clock=clock)
 
     def _launch_lobby_thread(self):
-        # in_queue = Queue()
-        # out_queue = Queue()
-        lock = threading.Lock()
-        self.lobbyThread = TCPQueueCommunicator(in_queue=self.msgs_from_lobby,
-                                                out_queue=self.replies_to_lobby,
-                                                tm_lock=lock,
-                                                port=self.lobbyPort)
+        self.lobbyThread = AsyncLobbyServer(in_queue=self.events,
+                                            port=self.lobbyPort,
+                                            reply_timeout=self.lobbyReplyTimeout,
+                                            pipeline_depth=self.lobbyPipelineDepth)
         self.lobbyThread.start()
         print(f"Lobby thread launched: {self.lobbyPort}")
 
-    def _check_queues(self):
+    def post_event(self, callback):
         """
-        Check the STDOUT queues in both the PAL and Agent threads, logging the responses appropriately
-        :return: next_line containing the STDOUT of the PAL process only:
-                    used to determine game ending conditions and update the score_dict{}
+        Wake the main loop from another thread and run callback() on the main thread.
+        :param callback: function taking no arguments
         """
-        next_line = b''
+        self.events.put(callback)
 
-        # # write output from procedure A (if there is any)
-        # DN: Remove "blockInFront" data from PAL, as it just gunks up our PAL logs for no good reason.
+    def _check_queues(self, timeout=None):
+        """
+        Block until the lobby sends a request or another thread posts an event.
+        Posted events are run here, on the main thread.
+        :param timeout: max seconds to wait. None waits forever.
+        :return: the next LobbyRequest to answer, or None if the wait timed out or an event was handled.
+                 Answer it with request.reply() - the reply goes back to the connection that sent it.
+        """
         try:
-            next_line = self.msgs_from_lobby.get(False, timeout=0.025)
-            print(f"input: {next_line}")
-            # self.PAL_log.message_strip(str(next_line))
+            event = self.events.get(True, timeout)
+        except queue.Empty:
+            return None
+
+        if isinstance(event, LobbyRequest):
+            print(f"input: {event}")
             sys.stdout.flush()
             sys.stderr.flush()
-        except queue.Empty:
-            pass
+            return event
+
+        event()
+        return None
 
-        return str(next_line, TCPServers.ENCODING, 'ignore')
+    def _schedule_jobs(self):
+        """
+        Register the periodic jobs. Intervals come from the [LOAD] section of the config.
+        The jobs run on the control plane thread.
+        """
+        jitter = float(self.config.get('LOAD', 'pollJitter', fallback=0))
+        server_poll = int(self.config.get('LOAD', 'secondsBetweenMCPoll'))
+        pool_poll = int(self.config.get('LOAD', 'secondsBetweenPoolPoll', fallback=server_poll))
+        scaling = int(self.config.get('LOAD', 'secondsBetweenScaleCheck', fallback=server_poll))
+        teams = int(self.config.get('LOAD', 'secondsBetweenTeamsRefresh', fallback=300))
+
+        self.scheduler.add_job(LoadBalancerMain.JOB_POOL_POLL, pool_poll, self.pool.poll_pool_state, jitter)
+        self.scheduler.add_job(LoadBalancerMain.JOB_SERVER_POLL, server_poll, self.pool.poll_servers, jitter)
+        self.scheduler.add_job(LoadBalancerMain.JOB_SCALING, scaling, self.handle_active_state, jitter)
+        self.scheduler.add_job(LoadBalancerMain.JOB_TEAMS_REFRESH, teams, self.pool.refresh_teams, jitter)
+        if self.pool.heartbeat_port > 0:
+            heartbeats = float(self.config.get('LOAD', 'secondsBetweenHeartbeatIngest', fallback=2))
+            self.scheduler.add_job(LoadBalancerMain.JOB_HEARTBEATS, heartbeats, self.pool.apply_heartbeats)
 
     def _serverResponseBuilder(self, server: Server = None, msg: str = ""):
         if server is None:
@@ -80,8 +137,12 @@ class LoadBalancerMain:
         print('server Response: {' + val + '}\n')
         return '{' + val + '}\n'
 
-    def main(self):
-
+    def initialize(self, sleep=time.sleep):
+        """
+        Connect to (or create) the pool, wait for it to become steady and register the periodic jobs.
+        :param sleep: function that waits some seconds between checks (a simulation passes its virtual clock's)
+        :return: False if the pool did not become steady
+        """
         max_retry_initialize = 10
         id = self.config.get('POOL', 'id')
         is_new_pool = self.pool.initializeManager(id)
@@ -93,7 +154,7 @@ class LoadBalancerMain:
                 print("waiting for initialization...")
             else:
                 print("Existing Pool Detected. Reconnecting to: " + id)
-            time.sleep(60)
+            sleep(60)
             counter += 1
             self.pool.poll_servers_and_update()
             initialized = self.pool.check_is_pool_steady()
@@ -102,241 +163,280 @@ class LoadBalancerMain:
 
         if should_continue:
             self.pool.update_server_list()
-            self._launch_lobby_thread()
+            self.pool.publish_snapshot()
+            self._schedule_jobs()
+        return should_continue
 
-        ct = 0
-        seconds_ticker = 1
-        modifier = 0
-
-        while should_continue:
+    def main(self):
+        should_continue = self.initialize()
 
-            seconds_ticker = datetime.datetime.now().second
+        if should_continue:
+            self.pool.start_heartbeat_listener()
+            self.control.start()
+            self._launch_lobby_thread()
 
-            # Case A: Waiting for the MC Servers to spin up on each Node
-            if self.state == LoadBalancerMain.State.STARTING:
+        # From here on this thread is the data plane: it only answers the lobby, reading the pool snapshot.
+        # Polling, Azure calls and the scaling state machine all run on the control plane thread.
+        while should_continue:
 
-                next_line = self._check_queues().lower()
-                if next_line is None or next_line == '':
-                    time.sleep(0.05)
-                    pass
+            # Sleep until the lobby sends something or another thread posts an event.
+            request = self._check_queues()
 
-                else:
+            if request is not None:
+                # Case A: Waiting for the MC Servers to spin up on each Node
+                if self.state == LoadBalancerMain.State.STARTING:
                     print("Load Balancer Still Initializing.")
-                    self.replies_to_lobby.put("Err: Load Balancer Connecting to Servers.")
-
-                if self.poll_servers(seconds_ticker, modifier):
-                    print(f"attempt: {ct} - are MC servers online?")
-                    ct += 1
-                    all_ready = self.pool.check_is_pool_steady()    # Ensure that the pool is stable, too!
-                    for server in self.pool.servers:
-                        if server.state < Server.State.STABLE:
-                            all_ready = False
-                    if all_ready:
-                        self.state = LoadBalancerMain.State.STABLE
-                        print("Servers Online!")
-
-            #  Case B: All Servers are stable - we can begin handling commands sent to us from the Polycraft Lobby
-            else:
+                    request.reply("Err: Load Balancer Connecting to Servers.")
 
-                # Check for Commands sent to the Listener port
-                next_line = self._check_queues().lower()
-                if next_line is None or next_line == '':
-                    time.sleep(0.05)
-
-
-                elif CommandSet.STATE.value in next_line:
-                    print("requested status...")
-                    self.replies_to_lobby.put(f"State: {self.state.name}")
-
-                elif CommandSet.HELLO.value in next_line:
-                    print("SUCCESS")
-                    self.replies_to_lobby.put("SUCCESS")
-
-                # Debug #
-                elif CommandSet.QUERYMC.value in next_line:
-                    print("sending msg to MCServer...")
-                    valid = False
-                    for server in self.pool.servers:
-                        if str(server.port) in next_line:
-                            msg = re.sub(rf"{CommandSet.QUERYMC.value}|{server.port}", "", next_line).strip()
-                            msg = LBFormattedMsg(MCCommands.PASSMSG, msg)
-                            server.send_msg_threaded_to_server(msg)
-                            self.replies_to_lobby.put("Sent to Server!")
-                            valid = True
-                            break
-
-                    if not valid:
-                        self.replies_to_lobby.put("Err: Invalid Server addr.")
-
-                # Debug #
-                elif CommandSet.LISTSERVERS.value in next_line:
-                    print("Listing all servers")
-                    result = "{"
-                    for server in self.pool.servers:
-                        result += f'"{server.id}":{{"api_port":{server.api}, "players":{server.playercount}, "state":"{server.state.name}"}}, "team_map":{{'
-                    for team, server in self.pool.teams_to_servers.items():
-                        result += f'"{team}":"{server.id}",'
-                    result += "}"
-                    self.replies_to_lobby.put(result)
-
-                elif CommandSet.SERVERFORTEAM.value in next_line:
-                    try:
-                        command = json.loads(next_line)
-                        uid = command['playeruuid']
-                        team = command['playerteam']
-                        server = self.pool.getServerForTeam(team)
-                        server.add_player(uid, team)
-                        self.replies_to_lobby.put(self._serverResponseBuilder(server))
-                        modifier += 1  # TODO: does this modifier crap even work? Should we add a skip counter instead?
-                    except JSONDecodeError as e:
-                        print(f"Error! BAD Json From Minecraft {e}")
-                        self.replies_to_lobby.put(self._serverResponseBuilder(None))
-                    except TypeError as e:
-                        print(f"Error! Type Error in Json Response: {e}")
-                        self.replies_to_lobby.put(self._serverResponseBuilder(None, "Error! Bad Input"))
-                    except Exception as e:
-                        print(f"Error! Unknown Problem {e}")
-                        self.replies_to_lobby.put(self._serverResponseBuilder(None, "Error! Unknown Problem"))
-
-                elif CommandSet.ADDNEW.value in next_line:
-                    print(f"Adding one server to the pool")
-                    if self.__add_server():
-                        self.replies_to_lobby.put("Adding new server!")
-                    else:
-                        self.replies_to_lobby.put("Error - unable to add new server")
-
-                elif CommandSet.REMOVE.value in next_line:
-                    print(f"Removing One Server")
-                    if self.__find_and_remove_server():
-                        self.replies_to_lobby.put(f"Deallocating a server! {self.target_deallocation_server.id}")
-                    else:
-                        self.replies_to_lobby.put("Error - unable to remove a server")
+                #  Case B: All Servers are stable - we can begin handling commands sent to us from the Polycraft Lobby
+                else:
+                    self.handle_lobby_request(request)
 
+    def handle_lobby_request(self, request: LobbyRequest):
+        """
+        Answer a single command sent to us from the Polycraft Lobby.
+        :param request: the LobbyRequest to answer
+        """
+        next_line = request.command.lower()
+
+        if CommandSet.STATE.value in next_line:
+            print("requested status...")
+            request.reply(f"State: {self.state.name}")
+
+        elif CommandSet.HELLO.value in next_line:
+            print("SUCCESS")
+            request.reply("SUCCESS")
+
+        # Debug #
+        elif CommandSet.SCALINGLOG.value in next_line:
+            request.reply(json.dumps([decision.to_dict() for decision in self.scaling.decisions()]))
+
+        elif CommandSet.QUERYMC.value in next_line:
+            print("sending msg to MCServer...")
+            valid = False
+            for server in self.pool.snapshot.servers:
+                if str(server.port) in next_line:
+                    msg = re.sub(rf"{CommandSet.QUERYMC.value}|{server.port}", "", next_line).strip()
+                    msg = LBFormattedMsg(MCCommands.PASSMSG, msg)
+                    self.control.submit(self.__send_msg_to_server, server.id, msg)
+                    request.reply("Sent to Server!")
+                    valid = True
+                    break
+
+            if not valid:
+                request.reply("Err: Invalid Server addr.")
+
+        # Debug #
+        elif CommandSet.LISTSERVERS.value in next_line:
+            print("Listing all servers")
+            snapshot = self.pool.snapshot
+            result = "{"
+            for server in snapshot.servers:
+                result += f'"{server.id}":{{"api_port":{server.api}, "players":{server.playercount}, "state":"{server.state.name}"}}, "team_map":{{'
+            for team, server in snapshot.teams_to_servers.items():
+                result += f'"{team}":"{server.id}",'
+            result += "}"
+            request.reply(result)
+
+        elif CommandSet.SERVERFORPLAYER.value in next_line:
+            try:
+                command = json.loads(next_line)
+                uid = command['playeruuid']
+                server = self.router.get_server_for_player(uid)
+                if server is None and 'playerteam' in command:
+                    # Unknown (or their server went away) - fall back to the team path
+                    team = command['playerteam']
+                    server = self.router.route_player(uid, team)
+                    if server is not None:
+                        self.control.submit(self.pool.assign_player, uid, team, server.id)
+                if server is None:
+                    request.reply(self._serverResponseBuilder(None, "Error! Unknown Player"))
                 else:
-                    print(f"Error! Unknown command!")
-                    self.replies_to_lobby.put(self._serverResponseBuilder(None, "Error! Unknown Command"))
+                    request.reply(self._serverResponseBuilder(server))
+            except JSONDecodeError as e:
+                print(f"Error! BAD Json From Minecraft {e}")
+                request.reply(self._serverResponseBuilder(None))
+            except TypeError as e:
+                print(f"Error! Type Error in Json Response: {e}")
+                request.reply(self._serverResponseBuilder(None, "Error! Bad Input"))
+            except Exception as e:
+                print(f"Error! Unknown Problem {e}")
+                request.reply(self._serverResponseBuilder(None, "Error! Unknown Problem"))
+
+        elif CommandSet.SERVERFORTEAM.value in next_line:
+            try:
+                command = json.loads(next_line)
+                uid = command['playeruuid']
+                team = command['playerteam']
+                server = self.router.route_player(uid, team)
+                if server is None:
+                    request.reply(self._serverResponseBuilder(None, "Error! No Server Capacity"))
+                else:
+                    self.control.submit(self.pool.assign_player, uid, team, server.id)
+                    request.reply(self._serverResponseBuilder(server))
+            except JSONDecodeError as e:
+                print(f"Error! BAD Json From Minecraft {e}")
+                request.reply(self._serverResponseBuilder(None))
+            except TypeError as e:
+                print(f"Error! Type Error in Json Response: {e}")
+                request.reply(self._serverResponseBuilder(None, "Error! Bad Input"))
+            except Exception as e:
+                print(f"Error! Unknown Problem {e}")
+                request.reply(self._serverResponseBuilder(None, "Error! Unknown Problem"))
+
+        elif CommandSet.ADDNEW.value in next_line:
+            print(f"Adding one server to the pool")
+            self._reply_when_done(request, self.control.submit(self.__add_server),
+                                  lambda added: "Adding new server!" if added
+                                  else "Error - unable to add new server")
+
+        elif CommandSet.REMOVE.value in next_line:
+            print(f"Removing One Server")
+            self._reply_when_done(request, self.control.submit(self.__find_and_remove_server),
+                                  lambda removed: f"Deallocating a server! {[srv.id for srv in self.deallocation_targets]}" if removed
+                                  else "Error - unable to remove a server")
+
+        else:
+            print(f"Error! Unknown command!")
+            request.reply(self._serverResponseBuilder(None, "Error! Unknown Command"))
+
+    def _reply_when_done(self, request: LobbyRequest, future, response_for):
+        """
+        Reply to a lobby request once a command submitted to the control plane has finished.
+        :param request: the LobbyRequest to answer
+        :param future: Future returned by ControlPlane.submit
+        :param response_for: function mapping the command's result to the reply string
+        """
+        def done(f):
+            if f.exception() is not None:
+                request.reply(f"Error - {f.exception()}")
+            else:
+                request.reply(response_for(f.result()))
+        future.add_done_callback(done)
 
-                modifier = self.handle_active_state(seconds_ticker, modifier)
+    def __send_msg_to_server(self, server_id, msg: LBFormattedMsg):
+        server = self.pool.find_server(server_id)
+        if server is not None:
+            server.send_msg_threaded_to_server(msg)
 
-    def poll_servers(self, seconds_ticker, modifier=0):
+    def handle_active_state(self):
         """
-        Periodically poll servers and update the PoolManager state
-        :param seconds_ticker: current seconds
-        :param modifier: iterations of polling to skip
-        :return: True if the servers were polled and updated this tick.
+        Scaling check: runs the load balancer state machine against the latest poll results.
+        Scheduled as JOB_SCALING - polling itself happens in the JOB_POOL_POLL and JOB_SERVER_POLL jobs.
         """
-
-        if (seconds_ticker % int(self.config.get('LOAD', 'secondsBetweenMCPoll'))) == 0:
-            if modifier > 0:
-                modifier -= 1
-                return False, modifier
-            self.pool.poll_servers_and_update()
-            return True, modifier
-        return False, modifier
-
-    def handle_active_state(self, seconds_ticker, modifier):
-
-        is_time, modifier = self.poll_servers(seconds_ticker, modifier)
-        if is_time:
-
-            # Case 1: Pool is steady.
-            # state = STABLE - check all nodes and see if any crashed
-            if self.state == LoadBalancerMain.State.STABLE:
-                crashList = []          # Cases where the server itself crashed
-                restartAPIlist = []     # Cases where the mainTask ended
-
-                for server in self.pool.servers:
-                    #         server.poll()
-                    if server.state == Server.State.CRASHED:
-                        crashList.append(server)
-                    if server.state == Server.State.STABLE_BUT_TASK_FAILED:
-                        restartAPIlist.append(server)
-
-                if len(crashList) > 0:
-                    pass    # TODO: Confirm that the pool's state changes to TRANSITIONING
-                    # self.pool.flag_transition = True
-                for server in crashList:
-                    self.__remove_specific_server(server)
-
-                for server in restartAPIlist:
-                    self.pool.batchclient.add_task_to_start_server()
-                    self.state = LoadBalancerMain.State.RESTARTING_TASK
-
-                if self.pool.check_is_pool_steady():
-                    self.should_add_server_check()
-                    self.should_merge_servers_check()
-
-            # Case 2: Listener Script failed on the Node.
-            # state = RESTARTING_TASK   - a new tasks need to be added to the pool. Don't allow auto-balancing here.
-            elif self.state == LoadBalancerMain.State.RESTARTING_TASK:
-                # if self.poll_servers(seconds_ticker, modifier):
-                all_nodes_stable = True
-                # Continue monitoring for crashes
-                crashList = []
-                for server in self.pool.servers:
-                    if server.state == Server.State.CRASHED:
-                        crashList.append(server)
-                    if server.state == Server.State.STABLE_BUT_TASK_FAILED:
-                        all_nodes_stable = False
-
-                if all_nodes_stable:
-                    self.state = LoadBalancerMain.State.STABLE
-
-                for server in crashList:
-                    self.__remove_specific_server(server)   # Confirmed - pool changes immediately!
-
-            # Case 3:   Request has been made for the Pool to increase in size. Poll to see if this has changed.
-            #           detect when the new server has MC up and running and shift back to STABLE after that.
-            elif self.state == LoadBalancerMain.State.INCREASING:
-                # if self.poll_servers(seconds_ticker, modifier):
-                initialized = self.pool.check_is_pool_steady()
-                if initialized:
-                    self.pool.update_server_list()
-                    self.state = LoadBalancerMain.State.WAITING_FOR_NEW_SERVERS
-
-            # Case 3a:      The Pool is Steady, but the MC Server hasn't started yet. Poll occasionally until
-            #               its online!
-            elif self.state == LoadBalancerMain.State.WAITING_FOR_NEW_SERVERS:
-                all_ready = True
-                for server in self.pool.servers:
-                    if server.state < Server.State.STABLE:
-                        all_ready = False
-                if all_ready:
-                    self.state = LoadBalancerMain.State.STABLE
-                    # self.pool.flag_transition = False
-                    self.pool.update_server_list()
-
-            # Case 4:   Load Balancer has requested a decrease in Nodes.
-            #           Detect if the decrease is happening or not.
-            elif self.state == LoadBalancerMain.State.DECREASING:
-                # Case 1: Waiting for a server to get de-initialized
-                if self.target_deallocation_server is not None:
-                    # if self.poll_servers(seconds_ticker, modifier):
-                    if self.target_deallocation_server.state == Server.State.DEACTIVATED:
-                        self.state = LoadBalancerMain.State.TRIGGER_REMOVAL
-                else:
-                    raise Exception("Hmm... How'd I get here?")
-
-            # Case 4a:  Manual Removal or Crash will automatically switch State to here
-            #           Or this comes after the autobalanced server has moved players out of its server
-            elif self.state == LoadBalancerMain.State.TRIGGER_REMOVAL:
-                if self.target_deallocation_server is not None:
-                    if self.pool.actual_remove_server(self.target_deallocation_server):
-                        # self.pool.update_server_list()
-                        self.state = LoadBalancerMain.State.WAIT_FOR_REMOVAL
-                        self.target_deallocation_server = None
-                        modifier += 2
-
-            # Case 5:   Remove node from pool - the server has shut down - wait for Pool to Stabilize.
-            #           #TODO: Should the pool be allowed to also increase? Probably not. Also, wait to handle crashes.
-            elif self.state == LoadBalancerMain.State.WAIT_FOR_REMOVAL:
-                # else:   # Case 3 - crash triggered emergency removal
-                # if self.poll_servers(seconds_ticker, modifier):
-                if self.pool.check_is_pool_steady():
-                    self.pool.update_server_list()
-                    self.state = LoadBalancerMain.State.STABLE
-
-        return modifier
+        self.demand.observe(teams=len(self.pool.teams_to_servers),
+                            players=sum([serv.playercount for serv in self.pool.servers]),
+                            arrivals=self.pool.team_map.arrivals,
+                            departures=self.pool.team_map.departures)
+
+        # Case 0: Waiting for the MC Servers to spin up on each Node
+        if self.state == LoadBalancerMain.State.STARTING:
+            all_ready = self.pool.check_is_pool_steady()    # Ensure that the pool is stable, too!
+            for server in self.pool.servers:
+                if server.state < Server.State.STABLE:
+                    all_ready = False
+            if all_ready:
+                self.state = LoadBalancerMain.State.STABLE
+                print("Servers Online!")
+            else:
+                print("are MC servers online? Not yet.")
+
+        # Case 1: Pool is steady.
+        # state = STABLE - check all nodes and see if any crashed
+        elif self.state == LoadBalancerMain.State.STABLE:
+            crashList = []          # Cases where the server itself crashed
+            restartAPIlist = []     # Cases where the mainTask ended
+
+            for server in self.pool.servers:
+                #         server.poll()
+                if server.state == Server.State.CRASHED:
+                    crashList.append(server)
+                if server.state == Server.State.STABLE_BUT_TASK_FAILED:
+                    restartAPIlist.append(server)
+
+            if len(crashList) > 0:
+                pass    # TODO: Confirm that the pool's state changes to TRANSITIONING
+                # self.pool.flag_transition = True
+            for server in crashList:
+                self.__remove_specific_server(server)
+
+            for server in restartAPIlist:
+                self.pool.batchclient.add_task_to_start_server()
+                self.state = LoadBalancerMain.State.RESTARTING_TASK
+
+            if self.pool.check_is_pool_steady():
+                delta = self.scaling.evaluate(self.demand, len(self.pool.servers))
+                self.should_add_server_check(delta)
+                self.should_merge_servers_check(delta)
+
+        # Case 2: Listener Script failed on the Node.
+        # state = RESTARTING_TASK   - a new tasks need to be added to the pool. Don't allow auto-balancing here.
+        elif self.state == LoadBalancerMain.State.RESTARTING_TASK:
+            all_nodes_stable = True
+            # Continue monitoring for crashes
+            crashList = []
+            for server in self.pool.servers:
+                if server.state == Server.State.CRASHED:
+                    crashList.append(server)
+                if server.state == Server.State.STABLE_BUT_TASK_FAILED:
+                    all_nodes_stable = False
+
+            if all_nodes_stable:
+                self.state = LoadBalancerMain.State.STABLE
+
+            for server in crashList:
+                self.__remove_specific_server(server)   # Confirmed - pool changes immediately!
+
+        # Case 3:   Request has been made for the Pool to increase in size. Poll to see if this has changed.
+        #           detect when the new server has MC up and running and shift back to STABLE after that.
+        elif self.state == LoadBalancerMain.State.INCREASING:
+            initialized = self.pool.check_is_pool_steady()
+            if initialized:
+                self.pool.update_server_list()
+                self.state = LoadBalancerMain.State.WAITING_FOR_NEW_SERVERS
+
+        # Case 3a:      The Pool is Steady, but the MC Server hasn't started yet. Poll occasionally until
+        #               its online!
+        elif self.state == LoadBalancerMain.State.WAITING_FOR_NEW_SERVERS:
+            all_ready = True
+            for server in self.pool.servers:
+                if server.state < Server.State.STABLE:
+                    all_ready = False
+            if all_ready:
+                self.state = LoadBalancerMain.State.STABLE
+                # self.pool.flag_transition = False
+                self.pool.update_server_list()
+
+        # Case 4:   Load Balancer has requested a decrease in Nodes.
+        #           Detect if the decrease is happening or not.
+        elif self.state == LoadBalancerMain.State.DECREASING:
+            # Case 1: Waiting for the servers to get de-initialized
+            if len(self.deallocation_targets) > 0:
+                if all(server.state in [Server.State.DEACTIVATED, Server.State.CRASHED]
+                       for server in self.deallocation_targets):
+                    self.state = LoadBalancerMain.State.TRIGGER_REMOVAL
+            else:
+                raise Exception("Hmm... How'd I get here?")
+
+        # Case 4a:  Manual Removal or Crash will automatically switch State to here
+        #           Or this comes after the autobalanced servers have moved players out of their servers
+        elif self.state == LoadBalancerMain.State.TRIGGER_REMOVAL:
+            if len(self.deallocation_targets) > 0:
+                if len(self.pool.actual_remove_servers(self.deallocation_targets)) > 0:
+                    # self.pool.update_server_list()
+                    self.state = LoadBalancerMain.State.WAIT_FOR_REMOVAL
+                    self.deallocation_targets = []
+                    # Give Azure a couple of pool polls to report the resize before we check for steady again.
+                    self.scheduler.delay(LoadBalancerMain.JOB_SCALING,
+                                         2 * self.scheduler.interval(LoadBalancerMain.JOB_POOL_POLL))
+
+        # Case 5:   Remove node from pool - the server has shut down - wait for Pool to Stabilize.
+        #           #TODO: Should the pool be allowed to also increase? Probably not. Also, wait to handle crashes.
+        elif self.state == LoadBalancerMain.State.WAIT_FOR_REMOVAL:
+            # else:   # Case 3 - crash triggered emergency removal
+            if self.pool.check_is_pool_steady():
+                self.pool.update_server_list()
+                self.state = LoadBalancerMain.State.STABLE
 
     class State(Enum):
         STARTING = -2
@@ -349,48 +449,47 @@ class LoadBalancerMain:
         INCREASING = 5
         WAITING_FOR_NEW_SERVERS = 6
 
-    def should_add_server_check(self):
+    def should_add_server_check(self, delta):
         """
-        Load Balancing Algorithm that checks whether conditions are right for the load balancer to add a
-        new node to the server. Current algorithm:
-        Always maintain available team capacity of 5 teams. This is a hardcoded number. This can be changed in
+        Load Balancing Algorithm that checks whether conditions are right for the load balancer to add
+        new nodes to the server. The decision comes from the configured scaling policy (see modules/Scaling.py),
+        damped by the ScalingController's stabilization windows and cooldowns.
+        The default policy, threshold, always maintains available team capacity of 5 teams. This can be changed in
         ~config.azurebatch
+        All the nodes the policy asks for are requested in a single resize.
 
+        :param delta: the controller's decision for this check (see ScalingController.evaluate)
         """
         if self.pool.check_is_pool_steady() and self.state in [LoadBalancerMain.State.STABLE,
                                                                LoadBalancerMain.State.RESTARTING_TASK]:
             if len(self.pool.servers) < int(self.config.get("POOL", "maxcount")):
-                count_teams = len(self.pool.teams_to_servers.keys())
-                # count_players = sum([serv.playercount for serv in self.pool.servers])
-                count_team_capacity = len(self.pool.servers) * int(self.config.get("SERVER", "maxTeamsPerServer"))
-                # Linear scale - threshold is a function of the number of teams available - we want room for
-                # at least 3? 5? 7? teams to join at any time.
-                if (count_team_capacity - count_teams < int(self.config.get("LOAD", "thresholdTeamsAvailable"))) or len(self.pool.servers) < int(self.config.get("POOL", "mincount")):   # What is this threshold?
-                    self.__add_server()
+                if delta > 0:
+                    print(f"Scaling out ({self.scaling_policy.name}): {self.demand.teams} teams, "
+                          f"forecast {self.scaling_policy.forecast_teams(self.demand):.1f}, "
+                          f"on {len(self.pool.servers)} servers - adding {delta} nodes")
+                    self.__add_server(delta)
                     return
 
-    def should_merge_servers_check(self):
+    def should_merge_servers_check(self, delta):
         """
-        Server merging algorithm that removes extra servers if they are unused, leaving a 5-team overhead.
+        Server merging algorithm that removes extra servers if the scaling policy finds them unused. The default
+        policy leaves a 5-team overhead; the predictive ones also keep the capacity their forecast needs.
 
+        :param delta: the controller's decision for this check (see ScalingController.evaluate)
         :return:
         """
         if self.pool.check_is_pool_steady() and self.state in [LoadBalancerMain.State.STABLE,
                                                                LoadBalancerMain.State.RESTARTING_TASK]:
             if len(self.pool.servers) > int(self.config.get("POOL", "mincount")):
-                count_teams = len(self.pool.teams_to_servers.keys())
-                # count_players = sum([serv.playercount for serv in self.pool.servers])
-                count_team_capacity = len(self.pool.servers) * int(self.config.get("SERVER", "maxTeamsPerServer"))
-                # Linear scale - threshold is a function of the number of teams available - we want room for
-                # at least 3? 5? 7? teams to join at any time.
-                if count_team_capacity - count_teams > int(self.config.get("LOAD", "thresholdTeamsAvailable"))+int(self.config.get("SERVER", "maxTeamsPerServer")):   # What is this threshold?
-                    self.__find_and_remove_server()
+                if delta < 0:
+                    self.__find_and_remove_server(-delta)
                     return
 
-    def __add_server(self):
+    def __add_server(self, count=1):
         if self.pool.check_is_pool_steady() and self.state in [LoadBalancerMain.State.STABLE, LoadBalancerMain.State.RESTARTING_TASK]:
-            if self.pool.expand_pool_add_server(1):                 # CONFIRMED: this changes the pool.allocation_state
+            if self.pool.expand_pool_add_server(count):                # CONFIRMED: this changes the pool.allocation_state
                 self.state = LoadBalancerMain.State.INCREASING
+                self.scaling.record_action(count)
                 # self.pool.poll_servers_and_update()
                 return True
         return False
@@ -401,9 +500,12 @@ class LoadBalancerMain:
             self.state = LoadBalancerMain.State.WAIT_FOR_REMOVAL
             self.pool.update_server_list()
 
-    def __find_and_remove_server(self):
+    def __find_and_remove_server(self, count=1):
         """
-        Load Balancer Auto-trigger to remove a node. Can also be manually fired.
+        Load Balancer Auto-trigger to remove nodes. Can also be manually fired.
+        Plans a consolidation round (see Consolidation.plan_consolidation): up to count of the least loaded servers
+        are emptied or merged into servers that have room for them, all at the same time.
+        :param count: max servers to retire in this round
         :return: False if a pool cannot be removed right now.
         """
         # self.pool.poll_servers_and_update()
@@ -411,26 +513,22 @@ class LoadBalancerMain:
             print("Err: LoadBalancer is not in a steady state for removal.")
             return False
 
-        list_of_empty_servers = [srv for srv in self.pool.servers if srv.playercount == 0]
-
-        # Case A: we can try to remove an empty server
-        if len(list_of_empty_servers) > 0:
-            if self.pool.signal_remove_server(list_of_empty_servers[0]):
-                self.target_deallocation_server = list_of_empty_servers[0]
-                self.state = LoadBalancerMain.State.DECREASING
-                return True
-
-        # Case B: We need to merge two servers together - pick the least two filled and merge the smaller with the larger
-        # Sort our server pool by playercount:
-        self.pool.servers.sort()
+        candidates = [srv for srv in self.pool.servers if srv.state == Server.State.STABLE]
+        plan = plan_consolidation(candidates,
+                                  max_teams=int(self.config.get("SERVER", "maxTeamsPerServer")),
+                                  max_players=int(self.config.get("SERVER", "maxPlayersOverall")),
+                                  max_removals=count)
+        if len(plan) == 0:
+            print("No server can be retired: the others don't have room for its players")
+            return False
 
-        # merge [0] with [1]
-        if len(self.pool.servers) > 1:
-            # TODO: check to see if [1] has room
-            if self.pool.signal_remove_server(self.pool.servers[0], self.pool.servers[1]):
-                self.target_deallocation_server = self.pool.servers[0]
-                self.state = LoadBalancerMain.State.DECREASING
-                return True
+        signalled = self.pool.signal_remove_servers(plan)
+        if len(signalled) > 0:
+            print(f"Consolidating: retiring {[srv.id for srv in signalled]}")
+            self.deallocation_targets = signalled
+            self.state = LoadBalancerMain.State.DECREASING
+            self.scaling.record_action(-len(signalled))
+            return True
 
         return False
 
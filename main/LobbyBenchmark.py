@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import configparser
+import json
+import socket
+import sys
+import tempfile
+import threading
+import time
+from modules.LobbyLoad import TraceShape, make_trace, run_trace, format_report, find_regressions
+from modules.comms.TCPServers import ENCODING
+from root import *
+
+"""
+Lobby benchmark: replays an arrival trace against the lobby port and reports throughput and p50/p95/p99 latency of
+get_server_for_team, list_all and status.
+Without --target it brings up its own load balancer on a fake pool: [POOL] backend=simulated with instant boots, and
+a StubFleet answering for the simulated nodes - so it measures the lobby path alone, with no Azure and no Minecraft.
+    python -m main.LobbyBenchmark --trace bursts --duration 120 --rate 50 --connections 64
+    python -m main.LobbyBenchmark --json run.json                    # save the results...
+    python -m main.LobbyBenchmark --baseline run.json --tolerance 0.2  # ...and fail if a later run is slower
+"""
+
+FAKE_POOL = {
+    'POOL': {'backend': 'simulated'},
+    'SIMULATED': {'bootLatency': '0', 'bootJitter': '0', 'resizeLatency': '0', 'serverStartLatency': '0',
+                  'bootFailureRate': '0', 'apiErrorRate': '0'},
+    'LOAD': {'secondsBetweenMCPoll': '5', 'secondsBetweenPoolPoll': '5', 'secondsBetweenScaleCheck': '5'},
+}
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _ask(host, port, command, timeout=5):
+    with socket.create_connection((host, port), timeout) as sock:
+        sock.sendall(bytes(command + "\n", ENCODING))
+        data = b''
+        while True:
+            part = sock.recv(4096)
+            if not part:
+                return str(data, ENCODING)
+            data += part
+
+
+def start_fake_pool(config_file, ready_timeout=300):
+    """
+    Run a LoadBalancerMain on a simulated pool whose nodes are a StubFleet, all in this process.
+    :return: (host, lobby port) once the load balancer is STABLE
+    """
+    # Imported here: --target runs don't need the load balancer's dependencies
+    from main.LoadBalancerMain import LoadBalancerMain
+    from modules.comms.StubFleet import StubFleet
+
+    config = configparser.ConfigParser()
+    config.optionxform = str        # Keep the keys' case in the copy
+    config.read(config_file)
+    for section, values in FAKE_POOL.items():
+        for key, value in values.items():
+            config.set(section, key, value)
+    lobby_port = _free_port()
+    config.set('POOL', 'lobby_port', str(lobby_port))
+    config.set('POOL', 'heartbeat_port', str(_free_port()))
+    fake_config = tempfile.NamedTemporaryFile('w', suffix='.cfg', delete=False)
+    config.write(fake_config)
+    fake_config.close()
+
+    fleet = StubFleet(StubFleet.on_ports(int(config.get('POOL', 'maxcount')),
+                                         int(config.get('SIMULATED', 'mcPortStart', fallback=44000)),
+                                         int(config.get('SIMULATED', 'apiPortStart', fallback=44500)),
+                                         prefix='sim'),
+                      host=config.get('SIMULATED', 'host', fallback='127.0.0.1'))
+    fleet.start()
+    fleet.ready.wait()
+
+    lb = LoadBalancerMain(config=fake_config.name)
+    threading.Thread(target=lb.main, daemon=True, name='LoadBalancerMain').start()
+    deadline = time.monotonic() + ready_timeout
+    while time.monotonic() < deadline:
+        try:
+            if "STABLE" in _ask("127.0.0.1", lobby_port, "status"):
+                return "127.0.0.1", lobby_port
+        except OSError:
+            pass        # Lobby not listening yet
+        time.sleep(1)
+    raise TimeoutError(f"load balancer not STABLE after {ready_timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a lobby arrival trace and report latency percentiles")
+    parser.add_argument('--trace', default=TraceShape.STEADY.value, choices=[shape.value for shape in TraceShape])
+    parser.add_argument('--duration', type=float, default=60, help="seconds")
+    parser.add_argument('--rate', type=float, default=20, help="mean requests per second")
+    parser.add_argument('--teams', type=int, default=24)
+    parser.add_argument('--list-ratio', type=float, default=0.02, help="fraction of requests that are list_all")
+    parser.add_argument('--status-ratio', type=float, default=0.02, help="fraction of requests that are status")
+    parser.add_argument('--burst-every', type=float, default=60)
+    parser.add_argument('--burst-length', type=float, default=5)
+    parser.add_argument('--burst-factor', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--one-shot', action='store_true', help="a connection per request instead of sessions")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds to wait for a reply")
+    parser.add_argument('--target', help="host:port of a running lobby (default: start a load balancer on a fake pool)")
+    parser.add_argument('--config', default=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'))
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results of an earlier run: exit 1 if this run is slower")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against --baseline")
+    args = parser.parse_args()
+
+    shape_args = {}
+    if args.trace == TraceShape.BURSTS.value:
+        shape_args = dict(burst_every=args.burst_every, burst_length=args.burst_length,
+                          burst_factor=args.burst_factor)
+    trace = make_trace(TraceShape(args.trace), args.duration, args.rate, teams=args.teams,
+                       list_ratio=args.list_ratio, status_ratio=args.status_ratio, seed=args.seed, **shape_args)
+
+    if args.target:
+        host, port = args.target.rsplit(':', 1)
+        port = int(port)
+    else:
+        host, port = start_fake_pool(args.config)
+
+    print(f"Replaying {len(trace)} requests ({args.trace}, {args.duration:.0f}s) against {host}:{port} "
+          f"over {args.connections} {'one-shot' if args.one_shot else 'session'} connections")
+    stats = asyncio.run(run_trace(trace, host, port, connections=args.connections, session=not args.one_shot,
+                                  timeout=args.timeout))
+    summary = stats.summary()
+    print(format_report(summary))
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(summary, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(summary, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
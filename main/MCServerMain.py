@@ -1,5 +1,6 @@
-from modules.comms import TCPServers
-from modules.comms.TCPQueueCommunicator import TCPQueueCommunicator
+from modules.comms.AsyncLobbyServer import AsyncLobbyServer
+from modules.comms.Heartbeat import HeartbeatSender
+from modules.Roster import UserCache, merge_roster
 import mcstatus
 from queue import Queue, Empty
 import threading
@@ -28,6 +29,8 @@ class CommandSet(Enum):
     ABORT = 'abort'
     REQUESTSTATE = 'request_state'
     PASSMSG = 'pass_msg'
+    SUBSCRIBE = 'heartbeat_to'
+    PLAYERS = 'players'
 
 
 class MCServer:
@@ -38,11 +41,18 @@ class MCServer:
         self.api_port = int(self.config.get('POOL', 'api_port'))
         self.minecraft_api_port = int(self.config.get('POOL', 'mc_api_port'))
         self.comms = None
-        self.in_queue = Queue()
-        self.out_queue = Queue()
+        self.in_queue = Queue()             # LobbyRequests from the load balancer
+        self.current_request = None         # the request being handled - answer it with _reply()
         self.minecraftserver = None
         self.has_rest = kwargs.get('pp', True)     # By Default - run polycraft with Private Properties
         self.state = MCServer.State.STARTING
+        # Query lists every player online by name; usercache.json turns the names into uuids (see modules/Roster.py)
+        self.user_cache = UserCache(self.config.get('SERVER', 'userCacheFile',
+                                                    fallback='/home/polycraft/oxygen/usercache.json'))
+        # Pushes this node's status to the load balancer once it subscribes (CommandSet.SUBSCRIBE)
+        self.heartbeat = HeartbeatSender(self._heartbeat_status,
+                                         check_interval=float(self.config.get('LOAD', 'heartbeatCheckInterval', fallback=2)),
+                                         keepalive=float(self.config.get('LOAD', 'heartbeatKeepalive', fallback=15)))
 
     @total_ordering
     class State(Enum):
@@ -59,39 +69,39 @@ class MCServer:
 
 
     def _launch_comms(self):
-        # in_queue = Queue()
-        # out_queue = Queue()
+        # The load balancer keeps persistent (session) connections open to this listener - see NodeClient.
         print("launching comms")
-        lock = threading.Lock()
-        self.comms = TCPQueueCommunicator(  in_queue=self.in_queue,
-                                            out_queue=self.out_queue,
-                                            tm_lock=lock,
-                                            port=self.api_port)
-
-        self.comms.setDaemon(True)
+        self.comms = AsyncLobbyServer(in_queue=self.in_queue,
+                                      port=self.api_port,
+                                      timeout_response="Err: Request Timed Out")
         self.comms.start()
         print("Comms Launched")
 
     def _check_queues(self):
         """
-        Check the STDOUT queues in both the PAL and Agent threads, logging the responses appropriately
-        :return: next_line containing the STDOUT of the PAL process only:
-                    used to determine game ending conditions and update the score_dict{}
+        Check for the next request from the load balancer.
+        :return: next_line containing the request's command ('' if there is none).
+                 The request is kept in self.current_request until it is answered with _reply().
         """
-        next_line = b''
-
-        # # write output from procedure A (if there is any)
-        # DN: Remove "blockInFront" data from PAL, as it just gunks up our PAL logs for no good reason.
+        next_line = ''
         try:
-            next_line = self.in_queue.get(False, timeout=0.025)
+            self.current_request = self.in_queue.get(True, timeout=0.05)
+            next_line = self.current_request.command
             print(f"input: {next_line}")
-            # self.PAL_log.message_strip(str(next_line))
             sys.stdout.flush()
             sys.stderr.flush()
         except Empty:
             pass
 
-        return str(next_line, TCPServers.ENCODING, 'ignore')
+        return next_line
+
+    def _reply(self, response: str):
+        """
+        Answer the request being handled. Replies go back on the connection that sent it.
+        """
+        if self.current_request is not None:
+            self.current_request.reply(response)
+            self.current_request = None
 
     def check_and_send_msg(self, msg: FormattedMsg):
         """
@@ -157,7 +167,7 @@ class MCServer:
             serv = mcstatus.MinecraftServer.lookup("127.0.0.1:25565")
             val = serv.status()
             print(val.raw)
-            # self.out_queue.put(val.raw)
+            # self._reply(val.raw)
             if self.state == MCServer.State.STARTING:
                 self.state = MCServer.State.ACTIVE
             return True
@@ -169,7 +179,48 @@ class MCServer:
 
             print("Err: Server is not up")
             return False
-            # self.out_queue.put("Err: Server is not alive")
+            # self._reply("Err: Server is not alive")
+
+    def _heartbeat_status(self):
+        """
+        Status pushed in each heartbeat. Runs on the HeartbeatSender thread, so it reads the server without changing
+        self.state (test_mc_status does that on the main thread).
+        """
+        try:
+            online, players = self._roster()
+            return {"state": self.state.name, "mc_up": True, "online": online, "players": players}
+        except Exception:
+            return {"state": self.state.name, "mc_up": False, "online": 0, "players": {}}
+
+    def _roster(self):
+        """
+        Every player online, in one status + one query round trip on localhost.
+        Falls back to the status sample if Query is disabled or doesn't answer.
+        :return: (players online, {uuid: name})
+        :raises Exception: if the server doesn't answer the status request
+        """
+        serv = mcstatus.MinecraftServer.lookup("127.0.0.1:25565")
+        stat = serv.status()
+        sample = {player.id: player.name for player in (stat.players.sample or [])}
+        if stat.players.online <= len(sample):
+            return stat.players.online, sample      # The sample already holds everyone
+        try:
+            names = serv.query().players.names
+        except Exception as e:
+            print(f"Err: Query failed - is enable-query on? {e}")
+            return stat.players.online, sample
+        return stat.players.online, merge_roster(sample, names, self.user_cache.lookup())
+
+    def parse_subscribe_msg(self, line):
+        """
+        Expected Format:
+        heartbeat_to {"PORT":9010, "ID":"123.45.12.20:25565"}
+        """
+        if line.find('{') != -1 and line.find('}') != -1:
+            data_dict = json.loads(line[line.find('{'):line.rfind('}')+1])
+            if 'PORT' in data_dict and 'ID' in data_dict:
+                return data_dict['PORT'], data_dict['ID']
+        return None
 
     def parse_deallocate_msg(self, line):
         """
@@ -206,54 +257,70 @@ class MCServer:
     def run(self):
         stay_alive = True
         self._launch_comms()
+        self.heartbeat.start()
         self.__check_and_launch_minecraft()
         while stay_alive:
             next_line = self._check_queues()
 
             if next_line is None or next_line == '':
-                time.sleep(0.05)
                 now = datetime.datetime.now()
                 if now.hour == 3 and now.minute == 0 and now.second == 0:
                     self._launch_minecraft()
                     time.sleep(12)
                 continue
 
-            if CommandSet.HELLO.value in next_line.lower():
-                self.out_queue.put("I am awake")
+            if CommandSet.SUBSCRIBE.value in next_line.lower():
+                subscription = self.parse_subscribe_msg(next_line)
+                if subscription is None:
+                    self._reply("Err: Bad Subscription")
+                else:
+                    # Heartbeats go back to the host the load balancer connected from
+                    self.heartbeat.subscribe(self.current_request.client_address[0], subscription[0], subscription[1])
+                    self._reply("Heartbeats On")
+
+            elif next_line.strip().lower() == CommandSet.PLAYERS.value:     # not a substring match: pass_msg text may say 'players'
+                try:
+                    online, players = self._roster()
+                    self._reply(json.dumps({"online": online, "players": players}))
+                except Exception:
+                    self._reply("Err: Server is not alive")
+
+            elif CommandSet.HELLO.value in next_line.lower():
+                self._reply("I am awake")
 
             elif CommandSet.ABORT.value in next_line.lower():
                 print(f"abort received...")
-                self.out_queue.put("Aborting...")
+                self._reply("Aborting...")
                 stay_alive = False
 
             elif CommandSet.LAUNCH.value in next_line.lower():
                 print(f"(Re)Launching MC Server")
                 self._launch_minecraft()
-                self.out_queue.put("Re-launching MC Server")
+                self._reply("Re-launching MC Server")
 
             elif CommandSet.MCALIVE.value in next_line.lower():
                 print("is MC Alive?")
                 if self.test_mc_status():
-                    self.out_queue.put("Server is Up!")
+                    self._reply("Server is Up!")
                 else:
-                    self.out_queue.put("Err: Server is not alive")
+                    self._reply("Err: Server is not alive")
 
             elif CommandSet.DEALLOCATE.value in next_line.lower():
                 print("requesting decommission...")
                 if not self.test_mc_status():
                     print("Critical error! Server is not active")
-                    self.out_queue.put("Err: Server is not active")
+                    self._reply("Err: Server is not active")
                 else:
                     targetIP = self.altparse_deallocate_msg(next_line)
                     args = "NONE"
                     if targetIP is None:
-                        self.out_queue.put("Deallocating Server")
+                        self._reply("Deallocating Server")
                         msg = FormattedMsg(MCCommandSet.KILL)
                         self.check_and_send_msg(msg)
 
                         # self.send_message_to_minecraft_api(msg)
                     else:
-                        self.out_queue.put(f"Deallocating Server. Sending Players to {targetIP}")
+                        self._reply(f"Deallocating Server. Sending Players to {targetIP}")
                         args = "{" + f'"IP":"{targetIP[0]}", "PORT":{targetIP[1]}' + "}"
                         msg = FormattedMsg(MCCommandSet.DEALLOC, f"{targetIP[0]}:{targetIP[1]}")
                         self.check_and_send_msg(msg)
@@ -267,28 +334,29 @@ class MCServer:
                 nl = re.sub(rf"{CommandSet.PASSMSG.value}", "", next_line.lower()).strip()
                 msg = FormattedMsg(MCCommandSet.SAY, nl)
                 if self.check_and_send_msg(msg):
-                    self.out_queue.put(f"Sent message to server")
+                    self._reply(f"Sent message to server")
                 else:
-                    self.out_queue.put(f"Error: Server is not active!")
+                    self._reply(f"Error: Server is not active!")
 
 
 
             elif CommandSet.MCSTATUS.value in next_line.lower():
                 print("Testing: MCSTATUS")
                 if self.test_mc_status():
-                    self.out_queue.put("Server is Up!")
+                    self._reply("Server is Up!")
                 else:
-                    self.out_queue.put("Err: Server is not alive")
+                    self._reply("Err: Server is not alive")
 
             elif CommandSet.REQUESTSTATE.value in next_line.lower():
                 print(f"Requesting MC State: {self.state.value}")
                 self.test_mc_status() # Update the state.
-                self.out_queue.put(f'{{"State":{self.state.value}}}')
+                self._reply(f'{{"State":{self.state.value}}}')
 
             else:
                 print("unknown command")
-                self.out_queue.put("Err: Unknown Command")
+                self._reply("Err: Unknown Command")
 
+        self.heartbeat.stop()
         self.comms.kill()
         self.comms.join(5)
 
@@ -0,0 +1,63 @@
+import argparse
+import json
+from modules.LobbyLoad import TraceShape
+from modules.ScalingSimulation import ScalingSimulation
+from root import *
+
+"""
+Evaluate scaling settings against a day of simulated traffic in seconds (see modules/ScalingSimulation.py).
+Any config value can be overridden with --set SECTION.key=value, e.g.
+    python -m main.ScalingSimulator --hours 24 --teams-per-hour 30 --set LOAD.thresholdTeamsAvailable=3 \
+        --set POOL.mincount=2 --set LOAD.secondsBetweenMCPoll=20 --set SIMULATED.bootLatency=300
+"""
+
+
+def parse_overrides(settings):
+    """
+    :param settings: list of "SECTION.key=value"
+    :return: section -> {key: value}
+    """
+    overrides = {}
+    for setting in settings:
+        name, value = setting.split('=', 1)
+        section, key = name.split('.', 1)
+        overrides.setdefault(section, {})[key] = value
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the autoscaler on a virtual clock")
+    parser.add_argument('--config', default=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'))
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.key=value',
+                        help="override a config value (repeatable)")
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--trace', default=TraceShape.DIURNAL.value, choices=[shape.value for shape in TraceShape])
+    parser.add_argument('--teams-per-hour', type=float, default=20)
+    parser.add_argument('--team-size', type=int, default=4)
+    parser.add_argument('--session-minutes', type=float, default=60)
+    parser.add_argument('--crash-rate', type=float, default=0, help="crashes per node-hour")
+    parser.add_argument('--flap-window', type=float, default=900, help="seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log', help="write the load balancer's output to this file")
+    parser.add_argument('--json', help="write the report to this file")
+    args = parser.parse_args()
+
+    log = open(args.log, 'w') if args.log else None
+    simulation = ScalingSimulation(config=args.config, hours=args.hours, shape=TraceShape(args.trace),
+                                   teams_per_hour=args.teams_per_hour, team_size=args.team_size,
+                                   session_minutes=args.session_minutes, crashes_per_node_hour=args.crash_rate,
+                                   flap_window=args.flap_window, seed=args.seed,
+                                   overrides=parse_overrides(args.set), log=log)
+    report = simulation.run()
+    if log is not None:
+        log.close()
+
+    for key, value in report.items():
+        print(f"{key:<22}{value}")
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(dict(report, settings=args.set, actions=simulation.actions), out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import configparser
+import json
+import time
+from modules.comms.StubFleet import StubFleet, StubEndpoint
+from root import *
+
+"""
+Stand-in for pool nodes (MCServerMain + its Minecraft server) for running the load balancer off-cloud.
+One node by default - that is what LocalBackend starts for every node. With --nodes N it serves N nodes on consecutive
+ports from one process (e.g. the ports SimulatedBackend hands out), and --script replays timed roster changes,
+latencies, hangs and crashes against them (see modules/comms/StubFleet.py).
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub pool nodes: fake Minecraft status + node API + heartbeats")
+    parser.add_argument('--mc-port', type=int, required=True, help="Minecraft port of the first node")
+    parser.add_argument('--api-port', type=int, required=True, help="API port of the first node")
+    parser.add_argument('--node-id', default="stub", help="node id (or prefix of the ids with --nodes)")
+    parser.add_argument('--nodes', type=int, default=1)
+    parser.add_argument('--players', type=int, default=0, help="fake players on every node at the start")
+    parser.add_argument('--latency', type=float, default=0, help="seconds added to every reply")
+    parser.add_argument('--dealloc-delay', type=float, default=5)
+    parser.add_argument('--script', help='JSON list of {"at": s, "node": id or "*", "action": ...} events')
+    parser.add_argument('--config', default=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'))
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    options = dict(players=args.players, latency=args.latency, dealloc_delay=args.dealloc_delay)
+    if args.nodes == 1:
+        endpoints = [StubEndpoint(args.node_id, args.mc_port, args.api_port, **options)]
+    else:
+        endpoints = StubFleet.on_ports(args.nodes, args.mc_port, args.api_port, prefix=args.node_id, **options)
+
+    fleet = StubFleet(endpoints,
+                      check_interval=float(config.get('LOAD', 'heartbeatCheckInterval', fallback=2)),
+                      keepalive=float(config.get('LOAD', 'heartbeatKeepalive', fallback=15)))
+    fleet.start()
+    fleet.ready.wait()
+    print(f"Stub nodes {endpoints[0].node_id}..{endpoints[-1].node_id}: minecraft from {args.mc_port}, "
+          f"API from {args.api_port}")
+    if args.script:
+        with open(args.script) as script:
+            fleet.run_script(json.load(script))
+    try:
+        while fleet.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fleet.kill()
+        fleet.join(5)
+
+
+if __name__ == '__main__':
+    main()
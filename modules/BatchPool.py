@@ -4,19 +4,31 @@ import azure.batch.models as batchmodels
 from azure.batch.models import BatchErrorException
 from azure.common.credentials import ServicePrincipalCredentials
 from misc import helpers
+from modules.ComputeBackend import ComputeBackend
 import configparser
 import datetime
+import time
 from root import *
 
-class BatchPool:
+# Only the fields the load balancer reads ($select) - keeps responses small as the pool grows
+POOL_FIELDS = 'id,eTag,state,allocationState,targetDedicatedNodes,currentDedicatedNodes'
+NODE_FIELDS = 'id,state,endpointConfiguration'
+JOB_FIELDS = 'id,poolInfo'
+# add_collection errors that mean the job itself is gone (and a new one is needed), and how often a chunk is submitted
+JOB_GONE_CODES = ['JobNotFound', 'JobCompleted']
+TASK_ADD_ATTEMPTS = 3
+
+class BatchPool(ComputeBackend):
 
     def __init__(self,  config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'),
-                        credentials=os.path.join(ROOT_DIR, 'configs/SECRET_paleast_credentials.cfg')):
+                        credentials=os.path.join(ROOT_DIR, 'configs/SECRET_paleast_credentials.cfg'),
+                        clock=time.monotonic):
         """
         BatchPool Object contains a reference to the pool, a credentials object to authorize pool transactions,
         and a config object to
         :param config:
         :param credentials:
+        :param clock: time source of the read cache, for tests
         """
         self.config = configparser.ConfigParser()
         self.config.read(config)
@@ -27,6 +39,14 @@ class BatchPool:
         self.pool_id = self.config.get('POOL', 'id')    #  this can get overwritten when the getPool function is run.
         self.job_id = ""
         self.globalTaskCounter = 0
+        # Read cache: pool and node reads within read_ttl seconds of each other share one Azure call. After the TTL the
+        # pool is re-read conditionally (If-None-Match on its ETag). Resizes and removals invalidate both.
+        self.read_ttl = float(self.config.get('POOL', 'azureReadTTL', fallback=10))
+        self.clock = clock
+        self._pool = None               # last CloudPool read (selected fields only)
+        self._pool_read_at = None
+        self._nodes = None              # last compute node list (selected fields only)
+        self._nodes_read_at = None
 
 
     def _login_to_batch(self):
@@ -45,6 +65,54 @@ class BatchPool:
 
         return batch_client
 
+    def get_pool(self, max_age=None):
+        """
+        Read the pool (id, state, allocation state and node counts), through the read cache.
+        :param max_age: seconds a cached read may be reused for. Defaults to read_ttl; 0 always asks Azure, but only
+                        downloads the pool again if its ETag changed
+        :return: CloudPool with the POOL_FIELDS set
+        :raises BatchErrorException: if the pool doesn't exist or Azure can't be reached
+        """
+        max_age = self.read_ttl if max_age is None else max_age
+        if self._pool is not None and self._pool.id == self.pool_id:
+            if self._pool_read_at is not None and self.clock() - self._pool_read_at < max_age:
+                return self._pool
+            etag = self._pool.e_tag
+        else:
+            etag = None
+
+        options = batchmodels.PoolGetOptions(select=POOL_FIELDS, if_none_match=etag)
+        try:
+            self._pool = self.client.pool.get(self.pool_id, pool_get_options=options)
+        except BatchErrorException as e:
+            if etag is None or e.response is None or e.response.status_code != 304:
+                raise
+            # 304 Not Modified - the cached pool is still current
+        self._pool_read_at = self.clock()
+        return self._pool
+
+    def list_nodes(self, max_age=None):
+        """
+        List the pool's compute nodes (id, state and endpoints), through the read cache.
+        :param max_age: seconds a cached list may be reused for. Defaults to read_ttl
+        :return: list of ComputeNode with the NODE_FIELDS set
+        """
+        max_age = self.read_ttl if max_age is None else max_age
+        if self._nodes is None or self._nodes_read_at is None or self.clock() - self._nodes_read_at >= max_age:
+            options = batchmodels.ComputeNodeListOptions(select=NODE_FIELDS)
+            self._nodes = list(self.client.compute_node.list(self.pool_id, compute_node_list_options=options))
+            self._nodes_read_at = self.clock()
+        return self._nodes
+
+    def invalidate_reads(self):
+        """
+        Force the next get_pool / list_nodes to ask Azure. Called after anything that changes the pool.
+        The cached pool keeps its ETag, so the next pool read is still conditional.
+        """
+        self._pool_read_at = None
+        self._nodes = None
+        self._nodes_read_at = None
+
     def _get_github_commands(self):
         return [
             'cd $HOME',
@@ -85,19 +153,29 @@ class BatchPool:
         return cmds + copy_mods + launch_server
 
     def remove_node_from_pool(self, node_id):
-        print(f"Attempting to remove node: {node_id}")
+        return self.remove_nodes_from_pool([node_id])
+
+    def remove_nodes_from_pool(self, node_ids):
+        """
+        Remove several nodes with a single resize (Batch accepts up to 100 nodes per remove_nodes call).
+        :param node_ids: ids of the compute nodes to remove
+        :return: True if every remove call was accepted
+        """
+        print(f"Attempting to remove nodes: {node_ids}")
+        self.invalidate_reads()
         try:
-            self.client.pool.remove_nodes(pool_id=self.pool_id,
-                      node_remove_parameter=batchmodels.NodeRemoveParameter(
-                            node_list=[node_id],
-                            node_deallocation_option=batchmodels.ComputeNodeDeallocationOption.terminate
-            ))
+            for start in range(0, len(node_ids), 100):
+                self.client.pool.remove_nodes(pool_id=self.pool_id,
+                          node_remove_parameter=batchmodels.NodeRemoveParameter(
+                                node_list=node_ids[start:start + 100],
+                                node_deallocation_option=batchmodels.ComputeNodeDeallocationOption.terminate
+                ))
             return True
         except BatchErrorException as e:
-            print(f"Something went wrong when attempting to remove a node! ID: {node_id} \n{e}")
+            print(f"Something went wrong when attempting to remove nodes! IDs: {node_ids} \n{e}")
             return False
         except Exception as e:
-            print(f"Something went wrong when attempting to remove a node! ID: {node_id} \n{e}")
+            print(f"Something went wrong when attempting to remove nodes! IDs: {node_ids} \n{e}")
             return False
 
     def expand_pool(self, size):
@@ -107,6 +185,7 @@ class BatchPool:
         :return: True if successful; False otherwise.
         """
         print(f"Attempting to resize... {size}")
+        self.invalidate_reads()
         try:
             self.client.pool.resize(pool_id=self.pool_id, pool_resize_parameter=batchmodels.PoolResizeParameter(
                 target_dedicated_nodes=size
@@ -116,8 +195,10 @@ class BatchPool:
             print(f"something went wrong in the resize! {e.with_traceback()}")
             return False
 
-    def add_task_to_start_server(self):
-
+    def _start_server_task(self):
+        """
+        :return: a new TaskAddParameter that starts one MC server
+        """
         constraint = batchmodels.TaskConstraints(
             retention_time=datetime.timedelta(hours=24),
         )
@@ -135,15 +216,59 @@ class BatchPool:
             command_line=helpers.wrap_commands_in_shell('linux', self.get_start_task_commands()),
             constraints=constraint,
             user_identity=user_identity)
+        self.globalTaskCounter += 1
+        return task
+
+    def add_task_to_start_server(self):
+
+        task = self._start_server_task()
 
         try:
-            self.globalTaskCounter += 1
             self.client.task.add(job_id=self.job_id, task=task)
         except BatchErrorException as e:
             self.globalTaskCounter += 1
             self.start_mc_server_job_pool(1)
             self.client.task.add(job_id=self.job_id, task=task)
 
+    def add_tasks_to_start_servers(self, count):
+        """
+        Submit the start tasks for count new servers in as few calls as possible (Batch accepts up to 100 tasks per
+        add_collection call) instead of one call per task.
+        :param count: number of start tasks to add
+        """
+        tasks = [self._start_server_task() for i in range(0, count)]
+        for start in range(0, len(tasks), 100):
+            self._add_task_chunk(tasks[start:start + 100])
+
+    def _add_task_chunk(self, chunk):
+        """
+        Add up to 100 tasks in one add_collection call. Tasks Batch rejects with a server error are resubmitted (up to
+        TASK_ADD_ATTEMPTS calls in all); tasks rejected with a client error are logged and dropped. A new job is only
+        created if the current one is gone - other errors are raised.
+        :param chunk: TaskAddParameters to add
+        """
+        pending = chunk
+        for attempt in range(TASK_ADD_ATTEMPTS):
+            try:
+                result = self.client.task.add_collection(job_id=self.job_id, value=pending)
+            except BatchErrorException as e:
+                if e.error is None or e.error.code not in JOB_GONE_CODES:
+                    raise
+                print(f"Job {self.job_id} is gone ({e.error.code}) - starting a new one")
+                self.start_mc_server_job_pool(0)      # New job only - its tasks are this chunk
+                continue
+            retry = set()
+            for task_result in result.value:
+                if task_result.status == batchmodels.TaskAddStatus.server_error:
+                    retry.add(task_result.task_id)
+                elif task_result.status == batchmodels.TaskAddStatus.client_error:
+                    print(f"Err: task {task_result.task_id} was rejected: "
+                          f"{task_result.error.code if task_result.error is not None else 'no error given'}")
+            pending = [task for task in pending if task.id in retry]
+            if not pending:
+                return
+        print(f"Err: gave up adding {len(pending)} start tasks after {TASK_ADD_ATTEMPTS} attempts")
+
     def start_mc_server_job_pool(self, maxNodes = None):
 
         if maxNodes is None:
@@ -180,17 +305,17 @@ class BatchPool:
 
         self.pool_id = id
 
-        if self.client.pool.exists(id):
-            found_job = False
-            # Update the Job ID here
-            for job in self.client.job.list():
-                if job.pool_info.pool_id == self.pool_id:
-                    self.job_id = job.id
-                    found_job = True
-                    break
-            if not found_job:
-                self.start_mc_server_job_pool()     # Restart Jobs for this pool - this is necessary!
-            return self.client.pool.get(id)
+        pool_known = self._pool is not None and self._pool.id == id
+        if pool_known or self.client.pool.exists(id):
+            if not self.job_id:
+                # Find the Job ID here - once; start_mc_server_job_pool keeps it up to date after that
+                for job in self.client.job.list(job_list_options=batchmodels.JobListOptions(select=JOB_FIELDS)):
+                    if job.pool_info.pool_id == self.pool_id:
+                        self.job_id = job.id
+                        break
+                if not self.job_id:
+                    self.start_mc_server_job_pool()     # Restart Jobs for this pool - this is necessary!
+            return self.get_pool(max_age=0)
 
         api_port = self.config.get('POOL', 'api_port')
         min_count = self.config.get('POOL', 'mincount')
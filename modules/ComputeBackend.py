@@ -0,0 +1,154 @@
+from abc import ABC, abstractmethod
+import time
+from enum import Enum
+from typing import NamedTuple, List
+
+"""
+Compute backend interface: everything the PoolManager asks of the pool of nodes the MC servers run on.
+
+    azure       BatchPool - the Azure Batch pool the load balancer runs in production
+    simulated   SimulatedBackend - in memory, with configurable boot latencies and failure injection (no processes)
+    local       LocalBackend - every node is a stub node process (main/StubNode.py) on localhost ports
+
+Select with [POOL] backend = azure | simulated | local. Backends hand back pools and nodes shaped like the Azure Batch
+models the PoolManager was written against (Pool and Node below), so the PoolManager doesn't care which one it has.
+"""
+
+
+class BackendType(Enum):
+    AZURE = 'azure'
+    SIMULATED = 'simulated'
+    LOCAL = 'local'
+
+
+class NodeState(str, Enum):
+    """
+    Same values as azure.batch.models.ComputeNodeState. Both are str enums, so they compare equal to each other.
+    """
+    idle = 'idle'
+    rebooting = 'rebooting'
+    running = 'running'
+    unusable = 'unusable'
+    creating = 'creating'
+    starting = 'starting'
+    waiting_for_start_task = 'waitingforstarttask'
+    start_task_failed = 'starttaskfailed'
+    unknown = 'unknown'
+    leaving_pool = 'leavingpool'
+    offline = 'offline'
+
+
+class AllocationState(str, Enum):
+    """
+    Same values as azure.batch.models.AllocationState
+    """
+    steady = 'steady'
+    resizing = 'resizing'
+    stopping = 'stopping'
+
+
+class Endpoint(NamedTuple):
+    name: str                   # 'minecraftServer' or 'api_port', like the pool's inbound NAT pools
+    public_ip_address: str
+    frontend_port: int
+    backend_port: int
+
+
+class EndpointConfiguration(NamedTuple):
+    inbound_endpoints: List[Endpoint]
+
+
+class Node(NamedTuple):
+    id: str
+    state: NodeState
+    endpoint_configuration: EndpointConfiguration
+
+
+class Pool(NamedTuple):
+    id: str
+    allocation_state: AllocationState
+    target_dedicated_nodes: int
+    current_dedicated_nodes: int
+    e_tag: str = None
+
+
+class BackendError(Exception):
+    """
+    A backend call failed (the Azure equivalent is BatchErrorException)
+    """
+    pass
+
+
+class ComputeBackend(ABC):
+    """
+    Base class of the compute backends. See BatchPool for what each call means on Azure.
+    A backend that doesn't implement every abstract call can't be instantiated.
+    """
+
+    pool_id = ""
+
+    @abstractmethod
+    def check_or_create_pool(self, id=None):
+        """
+        Attach to the pool, creating it (with mincount nodes and their start tasks) if it doesn't exist.
+        :return: the Pool if it already existed, None if it was just created
+        """
+
+    @abstractmethod
+    def get_pool(self, max_age=None):
+        """
+        :param max_age: seconds a cached read may be reused for (backends without a cache ignore it)
+        :return: the Pool
+        """
+
+    @abstractmethod
+    def list_nodes(self, max_age=None):
+        """
+        :param max_age: seconds a cached read may be reused for (backends without a cache ignore it)
+        :return: list of Node
+        """
+
+    @abstractmethod
+    def expand_pool(self, size):
+        """
+        Resize the pool to size nodes.
+        :return: True if the resize was accepted
+        """
+
+    @abstractmethod
+    def remove_nodes_from_pool(self, node_ids):
+        """
+        Remove the given nodes with one resize.
+        :return: True if the removal was accepted
+        """
+
+    def remove_node_from_pool(self, node_id):
+        return self.remove_nodes_from_pool([node_id])
+
+    @abstractmethod
+    def add_tasks_to_start_servers(self, count):
+        """
+        Queue count tasks that each start an MC server (and its node agent) on a free node.
+        """
+
+    def add_task_to_start_server(self):
+        self.add_tasks_to_start_servers(1)
+
+
+def make_backend(config, config_file, clock=time.monotonic):
+    """
+    :param config: the load balancer's ConfigParser
+    :param config_file: path of the config file (backends read their own sections from it)
+    :param clock: time source - the simulated pool runs on it, the others use real time
+    :return: the ComputeBackend selected by [POOL] backend
+    """
+    backend = BackendType(config.get('POOL', 'backend', fallback=BackendType.AZURE.value))
+    # Imported here so the azure packages are only needed by the azure backend
+    if backend == BackendType.SIMULATED:
+        from modules.SimulatedBackend import SimulatedBackend
+        return SimulatedBackend(config=config_file, clock=clock)
+    if backend == BackendType.LOCAL:
+        from modules.LocalBackend import LocalBackend
+        return LocalBackend(config=config_file)
+    from modules.BatchPool import BatchPool
+    return BatchPool(config=config_file)
@@ -0,0 +1,67 @@
+from typing import NamedTuple
+
+"""
+Consolidation planner for scale-in.
+A node can only hand its players to a single other server (the DEALLOCATE message carries one IP/port), so each
+server being retired is one item, and the servers that stay are bins with room for maxTeamsPerServer teams and
+maxPlayersOverall players. The planner packs as many of the least loaded servers as it may retire into the others,
+so several nodes are drained in parallel in one DECREASING -> TRIGGER_REMOVAL -> WAIT_FOR_REMOVAL cycle.
+"""
+
+
+class Migration(NamedTuple):
+    source: object      # Server to retire
+    target: object      # Server that takes the source's players, or None if the source is empty
+
+
+def plan_consolidation(servers, max_teams, max_players, max_removals):
+    """
+    Greedy best-fit bin-packing, sources in increasing order of load: the least loaded servers (fewest players, then
+    teams) are retired first, each into the server that fits it with the least room to spare.
+    :param servers: servers that can take part - retired or be merged into (callers pass the STABLE ones).
+                    Each needs .id, .teams and .playercount
+    :param max_teams: team capacity of a server (maxTeamsPerServer)
+    :param max_players: player capacity of a server (maxPlayersOverall)
+    :param max_removals: retire at most this many servers
+    :return: list of Migration, one per server to retire. A target is never also a source.
+    """
+    if max_removals <= 0:
+        return []
+
+    load = {server.id: [len(server.teams), server.playercount] for server in servers}
+    retiring = set()
+    targets = set()
+    plan = []
+
+    # Least loaded first: empty servers go for free, and small ones are the easiest to fit elsewhere
+    for source in sorted(servers, key=lambda srv: (srv.playercount, len(srv.teams), srv.id)):
+        if len(plan) >= max_removals:
+            break
+        if source.id in targets:
+            continue
+
+        teams, players = load[source.id]
+        if teams == 0 and players == 0:
+            retiring.add(source.id)
+            plan.append(Migration(source, None))
+            continue
+
+        best, best_slack = None, None
+        for target in servers:
+            if target.id == source.id or target.id in retiring:
+                continue
+            target_teams, target_players = load[target.id]
+            if target_teams + teams > max_teams or target_players + players > max_players:
+                continue    # The TODO this replaces: never merge into a server without room
+            slack = (max_players - target_players - players, max_teams - target_teams - teams, target.id)
+            if best is None or slack < best_slack:
+                best, best_slack = target, slack
+        if best is None:
+            continue
+
+        load[best.id][0] += teams
+        load[best.id][1] += players
+        retiring.add(source.id)
+        targets.add(best.id)
+        plan.append(Migration(source, best))
+    return plan
@@ -0,0 +1,91 @@
+import threading
+import queue
+import traceback
+from concurrent.futures import Future
+from modules.Scheduler import Scheduler
+
+MAX_BATCH = 256         # commands run between two snapshots at most
+
+
+class ControlPlane(threading.Thread):
+    """
+    Worker thread that owns everything slow: Azure calls, server polls and the scaling state machine.
+    It runs the periodic jobs of its Scheduler plus any command submitted from another thread, and publishes a new
+    PoolSnapshot after each batch of them, so the routing thread always has a consistent view without waiting on it.
+    """
+
+    def __init__(self, pool, scheduler: Scheduler = None):
+        """
+        :param pool: PoolManager this thread controls. Only this thread should mutate it after start().
+        :param scheduler: Scheduler holding the periodic jobs. A new one is created if None.
+        """
+        threading.Thread.__init__(self, daemon=True, name='ControlPlane')
+        self.pool = pool
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.commands = queue.Queue()
+        self.running = True
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Run fn(*args, **kwargs) on the control plane thread. Safe to call from any thread.
+        :return: a Future resolved with fn's result (or exception) once it has run and the snapshot is republished
+        """
+        future = Future()
+        self.commands.put((future, fn, args, kwargs))
+        return future
+
+    def stop(self):
+        self.running = False
+        self.commands.put(None)
+
+    def run(self):
+        while self.running:
+            try:
+                command = self.commands.get(True, self.scheduler.time_until_next())
+            except queue.Empty:
+                self.step()
+                continue
+            self.step([command] + self.drain())
+
+    def drain(self, limit=MAX_BATCH):
+        """
+        :return: up to limit commands waiting in self.commands, without blocking
+        """
+        commands = []
+        while len(commands) < limit:
+            try:
+                commands.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+        return commands
+
+    def step(self, commands=()):
+        """
+        One turn of the control loop: run the jobs that are due, then the commands, and republish the snapshot once
+        if anything ran - a burst of routed players costs one snapshot, not one each. Futures are resolved after the
+        snapshot is published. run() calls this whenever it wakes up; a simulation can call it directly.
+        :param commands: (future, fn, args, kwargs) entries taken from self.commands
+        """
+        ran = self.scheduler.run_pending()
+
+        finished = []      # (future, result, exception)
+        for command in commands:
+            if command is None:
+                continue    # stop()
+            future, fn, args, kwargs = command
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                finished.append((future, fn(*args, **kwargs), None))
+            except Exception as e:
+                print(f"Err: control plane command {fn} failed: {e}")
+                traceback.print_exc()
+                finished.append((future, None, e))
+
+        if len(ran) > 0 or len(finished) > 0:
+            self.pool.publish_snapshot()
+        for future, result, error in finished:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,117 @@
+import collections
+import math
+import threading
+import time
+
+WINDOW = 100                # inter-arrival samples kept per node
+MIN_STD_DEV = 5.0           # seconds - stops a very regular node from being suspected the moment it is a little late
+ACCEPTABLE_PAUSE = 10.0     # seconds of lateness (GC, a slow poll cycle) that never counts against a node
+
+"""
+Phi accrual failure detection (Hayashibara et al.), in the form Cassandra and Akka use it.
+
+Every sign of life from a node - a successful poll or a heartbeat - is an arrival. The detector keeps a window of the
+intervals between arrivals and, at any moment, turns the time since the last one into a suspicion level:
+    phi = -log10(P(the next arrival is still this late | the intervals seen so far))
+phi 1 means a ~10% chance the node is only late, phi 8 about one in 10^8. A node that is usually regular is suspected
+quickly once it goes silent; one that has always been irregular (slow, loaded) is given proportionally longer.
+
+Server keeps one detector per node and marks it CRASHED when phi reaches the threshold for its current state, see
+thresholds_from_config().
+"""
+
+
+class PhiAccrualDetector:
+
+    def __init__(self, first_interval, window=WINDOW, min_std_dev=MIN_STD_DEV, acceptable_pause=ACCEPTABLE_PAUSE,
+                 clock=time.monotonic):
+        """
+        :param first_interval: expected seconds until the first arrival (used until real intervals are seen)
+        :param window: number of inter-arrival intervals kept
+        :param min_std_dev: lower bound of the interval standard deviation, seconds
+        :param acceptable_pause: seconds added to the mean interval before any suspicion builds up
+        :param clock: time source, for tests and simulation
+        """
+        self.window = window
+        self.min_std_dev = min_std_dev
+        self.acceptable_pause = acceptable_pause
+        self.clock = clock
+        self._intervals = collections.deque(maxlen=window)
+        self._last = None
+        self._lock = threading.Lock()
+        self.reset(first_interval)
+
+    def reset(self, first_interval):
+        """
+        Forget the history and start over from now, expecting the next arrival about first_interval seconds from now.
+        Used when a node (re)starts: its boot or downtime says nothing about how regular it is while running.
+        """
+        with self._lock:
+            self._intervals.clear()
+            # Bootstrap like Akka: two samples with mean first_interval and a std dev of a quarter of it
+            spread = first_interval / 4
+            self._intervals.extend([first_interval - spread, first_interval + spread])
+            self._last = self.clock()
+
+    def heartbeat(self):
+        """
+        Record an arrival (the node answered a poll or pushed a heartbeat).
+        """
+        with self._lock:
+            now = self.clock()
+            self._intervals.append(now - self._last)
+            self._last = now
+
+    def since_last(self):
+        """
+        :return: seconds since the last arrival
+        """
+        with self._lock:
+            return self.clock() - self._last
+
+    def phi(self):
+        """
+        :return: the current suspicion level (0 = on time, grows without bound the longer the node stays silent)
+        """
+        with self._lock:
+            elapsed = self.clock() - self._last
+            count = len(self._intervals)
+            mean = sum(self._intervals) / count
+            variance = sum((interval - mean) ** 2 for interval in self._intervals) / count
+        std_dev = max(math.sqrt(variance), self.min_std_dev)
+        return phi(elapsed, mean + self.acceptable_pause, std_dev)
+
+    def suspect(self, threshold):
+        """
+        :return: True if phi has reached threshold
+        """
+        return self.phi() >= threshold
+
+
+def phi(elapsed, mean, std_dev):
+    """
+    -log10 of the probability that an arrival comes later than elapsed, for normally distributed intervals.
+    Uses the logistic approximation of the normal CDF, which stays finite far out in the tail.
+    """
+    y = (elapsed - mean) / std_dev
+    try:
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+    except OverflowError:
+        return 0.0      # Far earlier than expected
+    if elapsed > mean:
+        return -math.log10(e / (1.0 + e))
+    return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+
+def thresholds_from_config(config):
+    """
+    Suspicion level at which a node is marked CRASHED, per Server.State name. States without an entry are never
+    evicted by the detector (deactivation is driven by the load balancer, CRASHED is already down).
+    """
+    stable = float(config.get('LOAD', 'phiThreshold', fallback=8))
+    return {
+        'INITIALIZING': float(config.get('LOAD', 'phiThresholdInitializing', fallback=6)),
+        'STABLE': stable,
+        'WAITING_FOR_MERGE': stable,
+        'STABLE_BUT_TASK_FAILED': float(config.get('LOAD', 'phiThresholdTaskFailed', fallback=stable)),
+    }
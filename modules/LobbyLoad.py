@@ -0,0 +1,269 @@
+import asyncio
+import collections
+import json
+import math
+import random
+import time
+import uuid
+from enum import Enum
+from typing import NamedTuple
+from modules.comms.TCPServers import ENCODING
+from modules.comms.AsyncLobbyServer import SESSION_COMMAND, SESSION_ACK
+
+"""
+Load generator for the lobby port (see main/LobbyBenchmark.py).
+A trace is a list of timed lobby commands - players asking get_server_for_team, plus the odd list_all / status - built
+from an arrival rate that is steady, comes in bursts (a round starting) or follows a day. run_trace replays it
+open-loop over many concurrent connections: every command is sent at its scheduled time whether or not earlier ones
+have been answered, and its latency is measured from that scheduled time, so a slow lobby shows up as latency instead
+of silently lowering the request rate.
+"""
+
+ERROR_PREFIXES = ('{"IP":"None"', 'Err')       # Replies the load balancer sends when it couldn't serve a request
+
+
+class TraceShape(Enum):
+    STEADY = 'steady'
+    BURSTS = 'bursts'
+    DIURNAL = 'diurnal'
+
+
+class LobbyCall(NamedTuple):
+    at: float               # seconds from the start of the trace
+    kind: str               # lobby command name, e.g. get_server_for_team
+    command: str            # the line sent to the lobby
+
+
+def arrival_rate(shape: TraceShape, t, rate, duration, burst_every=60, burst_length=5, burst_factor=10):
+    """
+    :param t: seconds since the start of the trace
+    :param rate: mean requests per second (bursts: between bursts; diurnal: over the whole trace)
+    :return: requests per second at time t
+    """
+    if shape == TraceShape.BURSTS:
+        return rate * burst_factor if t % burst_every < burst_length else rate
+    if shape == TraceShape.DIURNAL:
+        # One day squeezed into the trace: quiet at the start and end, peak in the middle
+        return rate * (1 - math.cos(2 * math.pi * t / duration))
+    return rate
+
+
+def make_trace(shape: TraceShape, duration, rate, teams=24, list_ratio=0.02, status_ratio=0.02, seed=0, **shape_args):
+    """
+    Lobby requests arriving at arrival_rate(shape, ...) (see arrival_times).
+    :param duration: seconds of trace
+    :param teams: number of distinct teams players belong to
+    :param list_ratio: fraction of requests that are list_all
+    :param status_ratio: fraction of requests that are status
+    :param seed: random seed - the same arguments always give the same trace
+    :param shape_args: burst_every / burst_length / burst_factor for TraceShape.BURSTS
+    :return: list of LobbyCall, in time order
+    """
+    rng = random.Random(seed)
+    trace = []
+    for t in arrival_times(shape, duration, rate, rng, **shape_args):
+        draw = rng.random()
+        if draw < list_ratio:
+            trace.append(LobbyCall(t, 'list_all', 'list_all'))
+        elif draw < list_ratio + status_ratio:
+            trace.append(LobbyCall(t, 'status', 'status'))
+        else:
+            player = str(uuid.UUID(int=rng.getrandbits(128)))
+            command = json.dumps({"command": "get_server_for_team", "playeruuid": player,
+                                  "playerteam": f"team{rng.randrange(teams)}"})
+            trace.append(LobbyCall(t, 'get_server_for_team', command))
+    return trace
+
+
+def arrival_times(shape: TraceShape, duration, rate, rng: random.Random, **shape_args):
+    """
+    Non-homogeneous Poisson arrivals at arrival_rate(shape, ...), by thinning.
+    :param rng: random.Random to draw from
+    :return: generator of arrival times (seconds from the start), in order
+    """
+    peak = max(arrival_rate(shape, t, rate, duration, **shape_args) for t in _grid(duration))
+    t = 0.0
+    while peak > 0:
+        t += rng.expovariate(peak)
+        if t >= duration:
+            return
+        if rng.random() * peak <= arrival_rate(shape, t, rate, duration, **shape_args):
+            yield t
+
+
+def _grid(duration, steps=1000):
+    return [duration * i / steps for i in range(steps + 1)]
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile.
+    :param values: sorted list of numbers
+    """
+    if len(values) == 0:
+        return None
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class LatencyStats:
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)      # kind -> seconds, one per reply
+        self.errors = collections.Counter()                 # kind -> error replies
+        self.failures = collections.Counter()               # kind -> requests that got no reply at all
+        self.elapsed = 0.0
+
+    def record(self, kind, seconds, reply):
+        self.latencies[kind].append(seconds)
+        if reply.startswith(ERROR_PREFIXES):
+            self.errors[kind] += 1
+
+    def fail(self, kind):
+        self.failures[kind] += 1
+
+    def summary(self):
+        """
+        :return: kind -> {requests, errors, failures, throughput (replies/s), p50, p95, p99, max (ms)}
+        """
+        result = {}
+        for kind in sorted(set(self.latencies) | set(self.failures)):
+            values = sorted(self.latencies[kind])
+            ms = {f"p{p}": _ms(percentile(values, p)) for p in [50, 95, 99]}
+            result[kind] = dict(requests=len(values) + self.failures[kind], errors=self.errors[kind],
+                                failures=self.failures[kind],
+                                throughput=len(values) / self.elapsed if self.elapsed > 0 else 0.0,
+                                max=_ms(values[-1] if values else None), **ms)
+        return result
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def format_report(summary):
+    lines = [f"{'command':<22}{'requests':>9}{'errors':>8}{'failed':>8}{'req/s':>9}"
+             f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for kind, row in summary.items():
+        cells = [f"{row[key]:>10.2f}" if row[key] is not None else f"{'-':>10}" for key in ['p50', 'p95', 'p99', 'max']]
+        lines.append(f"{kind:<22}{row['requests']:>9}{row['errors']:>8}{row['failures']:>8}"
+                     f"{row['throughput']:>9.1f}" + ''.join(cells))
+    return "\n".join(lines)
+
+
+def find_regressions(summary, baseline, tolerance=0.2):
+    """
+    :param baseline: a summary saved from an earlier run
+    :param tolerance: allowed slowdown, as a fraction of the baseline
+    :return: list of descriptions of every percentile that got slower than baseline * (1 + tolerance)
+    """
+    regressions = []
+    for kind, row in summary.items():
+        for key in ['p50', 'p95', 'p99']:
+            before = baseline.get(kind, {}).get(key)
+            if before is not None and row[key] is not None and row[key] > before * (1 + tolerance):
+                regressions.append(f"{kind} {key}: {row[key]:.2f} ms, was {before:.2f} ms")
+    return regressions
+
+
+async def run_trace(trace, host, port, connections=64, session=True, timeout=30):
+    """
+    Replay a trace against a lobby server.
+    :param trace: list of LobbyCall
+    :param connections: session connections the calls are spread over (round robin), or with session=False the max
+                        one-shot connections open at once
+    :param session: use pipelined session connections (see AsyncLobbyServer) instead of a connection per request
+    :param timeout: seconds to wait for any one reply
+    :return: LatencyStats
+    """
+    stats = LatencyStats()
+    loop = asyncio.get_running_loop()
+    start = loop.time() + 0.5           # Time to open the session connections before the first call is due
+    began = time.monotonic()
+    if session:
+        await asyncio.gather(*[_run_session(trace[i::connections], host, port, start, stats, timeout)
+                               for i in range(min(connections, len(trace)))])
+    else:
+        limit = asyncio.Semaphore(connections)
+        tasks = []
+        for call in trace:
+            await _sleep_until(start + call.at)
+            tasks.append(loop.create_task(_one_shot(call, host, port, start + call.at, limit, stats, timeout)))
+        await asyncio.gather(*tasks)
+    stats.elapsed = time.monotonic() - began
+    return stats
+
+
+async def _sleep_until(deadline):
+    delay = deadline - asyncio.get_running_loop().time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+async def _run_session(calls, host, port, start, stats, timeout):
+    loop = asyncio.get_running_loop()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        writer.write(SESSION_COMMAND + b"\n")
+        ack = await asyncio.wait_for(reader.readline(), timeout)
+        if str(ack, ENCODING).strip() != SESSION_ACK:
+            raise ConnectionError(f"no session: {ack}")
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Err: unable to open a lobby session: {e}")
+        for call in calls:
+            stats.fail(call.kind)
+        return
+
+    sent = asyncio.Queue()
+
+    async def read_replies():
+        # Replies come back in request order - match them to what was sent
+        broken = False
+        while True:
+            call = await sent.get()
+            if call is None:
+                return
+            if broken:
+                stats.fail(call.kind)
+                continue
+            try:
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                if not line:
+                    raise ConnectionError("lobby closed the session")
+                stats.record(call.kind, loop.time() - (start + call.at), str(line, ENCODING, 'ignore'))
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                print(f"Err: lobby session broke: {e!r}")
+                broken = True
+                stats.fail(call.kind)
+
+    replies = loop.create_task(read_replies())
+    count = 0
+    try:
+        for call in calls:
+            await _sleep_until(start + call.at)
+            await sent.put(call)
+            count += 1
+            writer.write(bytes(call.command + "\n", ENCODING))
+            await writer.drain()
+    except ConnectionError as e:
+        print(f"Err: lobby session broke while sending: {e!r}")
+    finally:
+        await sent.put(None)
+        await replies
+        for call in calls[count:]:
+            stats.fail(call.kind)       # Never sent
+        writer.close()
+
+
+async def _one_shot(call, host, port, scheduled, limit, stats, timeout):
+    loop = asyncio.get_running_loop()
+    async with limit:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            try:
+                writer.write(bytes(call.command + "\n", ENCODING))
+                reply = await asyncio.wait_for(reader.read(), timeout)     # The lobby closes after replying
+            finally:
+                writer.close()
+            stats.record(call.kind, loop.time() - scheduled, str(reply, ENCODING, 'ignore'))
+        except (OSError, asyncio.TimeoutError):
+            stats.fail(call.kind)
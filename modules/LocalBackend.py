@@ -0,0 +1,154 @@
+import collections
+import configparser
+import shlex
+import subprocess
+import sys
+import threading
+from modules.ComputeBackend import ComputeBackend, NodeState, AllocationState, Pool, Node, Endpoint, \
+    EndpointConfiguration
+from root import *
+
+"""
+Compute backend that runs the pool on this machine.
+A node is a slot with a Minecraft port and an API port on [LOCAL] host (counting up from mcPortStart / apiPortStart).
+A start task launches [LOCAL] nodeCommand on a free slot - by default main/StubNode.py, a stand-in for MCServerMain
+and its Minecraft server - and the node is 'running' for as long as that process lives.
+Resizes are instant, so the pool is always steady.
+"""
+
+NODE_COMMAND = '{python} -m main.StubNode --mc-port {mc_port} --api-port {api_port} --node-id {node_id} --config {config}'
+
+
+class LocalNode:
+
+    def __init__(self, node_id, index):
+        self.id = node_id
+        self.index = index
+        self.process = None
+
+
+class LocalBackend(ComputeBackend):
+
+    def __init__(self, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg')):
+        """
+        :param config: config file - reads [POOL] id / mincount and the [LOCAL] section
+        """
+        self.config_file = config
+        self.config = configparser.ConfigParser()
+        self.config.read(config)
+        self.pool_id = self.config.get('POOL', 'id', fallback='local')
+        self.host = self.config.get('LOCAL', 'host', fallback='127.0.0.1')
+        self.mc_port_start = int(self.config.get('LOCAL', 'mcPortStart', fallback=45000))
+        self.api_port_start = int(self.config.get('LOCAL', 'apiPortStart', fallback=45500))
+        self.node_command = self.config.get('LOCAL', 'nodeCommand', fallback=NODE_COMMAND)
+        self.created = False
+        self.nodes = collections.OrderedDict()      # node id -> LocalNode
+        self.pending_tasks = 0
+        self._node_counter = 0
+        self._lock = threading.RLock()
+
+    def check_or_create_pool(self, id=None):
+        with self._lock:
+            if id is not None:
+                self.pool_id = id
+            if self.created:
+                return self.get_pool()
+            self.created = True
+            count = int(self.config.get('POOL', 'mincount', fallback=1))
+            self.expand_pool(count)
+            self.add_tasks_to_start_servers(count)
+            return None
+
+    def get_pool(self, max_age=None):
+        with self._lock:
+            self._start_pending_tasks()
+            return Pool(id=self.pool_id, allocation_state=AllocationState.steady,
+                        target_dedicated_nodes=len(self.nodes), current_dedicated_nodes=len(self.nodes))
+
+    def list_nodes(self, max_age=None):
+        with self._lock:
+            self._start_pending_tasks()
+            return [self._as_node(node) for node in self.nodes.values()]
+
+    def expand_pool(self, size):
+        with self._lock:
+            while len(self.nodes) < size:
+                self._node_counter += 1
+                node = LocalNode(f"local-node-{self._node_counter}", self._free_index())
+                self.nodes[node.id] = node
+            surplus = len(self.nodes) - size
+            if surplus > 0:
+                # Like Azure, prefer nodes that aren't running anything
+                idle_first = sorted(self.nodes.values(), key=lambda n: self._is_running(n))
+                self.remove_nodes_from_pool([node.id for node in idle_first[:surplus]])
+            return True
+
+    def remove_nodes_from_pool(self, node_ids):
+        with self._lock:
+            for node_id in node_ids:
+                node = self.nodes.pop(node_id, None)
+                if node is not None and node.process is not None:
+                    self._stop(node)
+            return True
+
+    def add_tasks_to_start_servers(self, count):
+        with self._lock:
+            self.pending_tasks += count
+            self._start_pending_tasks()
+
+    def shutdown(self):
+        """
+        Stop every node process.
+        """
+        with self._lock:
+            self.remove_nodes_from_pool(list(self.nodes.keys()))
+
+    def endpoints(self, node_id):
+        """
+        :return: (ip, minecraft port, API port) of a node
+        """
+        node = self.nodes[node_id]
+        return self.host, self.mc_port_start + node.index, self.api_port_start + node.index
+
+    def _free_index(self):
+        used = {node.index for node in self.nodes.values()}
+        index = 0
+        while index in used:
+            index += 1
+        return index
+
+    @staticmethod
+    def _is_running(node):
+        return node.process is not None and node.process.poll() is None
+
+    def _start_pending_tasks(self):
+        for node in self.nodes.values():
+            if self.pending_tasks <= 0:
+                return
+            if self._is_running(node):
+                continue
+            ip, mc_port, api_port = self.endpoints(node.id)
+            command = self.node_command.format(python=shlex.quote(sys.executable), mc_port=mc_port,
+                                               api_port=api_port, node_id=node.id,
+                                               config=shlex.quote(self.config_file))
+            print(f"Local pool: starting {node.id}: {command}")
+            env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+            node.process = subprocess.Popen(shlex.split(command), cwd=ROOT_DIR, env=env)
+            self.pending_tasks -= 1
+
+    @staticmethod
+    def _stop(node):
+        node.process.terminate()
+        try:
+            node.process.wait(5)
+        except subprocess.TimeoutExpired:
+            node.process.kill()
+            node.process.wait()
+
+    def _as_node(self, node):
+        ip, mc_port, api_port = self.endpoints(node.id)
+        state = NodeState.running if self._is_running(node) else NodeState.idle
+        return Node(id=node.id, state=state, endpoint_configuration=EndpointConfiguration([
+            Endpoint('minecraftServer', ip, mc_port, mc_port),
+            Endpoint('api_port', ip, api_port, api_port),
+        ]))
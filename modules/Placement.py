@@ -0,0 +1,119 @@
+import heapq
+import itertools
+from enum import Enum
+
+
+class PlacementStrategy(Enum):
+    WORST_FIT = 'worst_fit'     # Spread: the server with the most free player (then team) slots
+    BEST_FIT = 'best_fit'       # Pack: the server with the fewest free slots that still fits the team
+
+
+class PlacementIndex:
+    """
+    Keeps the servers that can take a new team ordered by free capacity, so the next one is found in O(log n)
+    instead of sorting the server list for every new team.
+
+    Servers are keyed on (free player slots, free team slots) - most free first for WORST_FIT, least free first for
+    BEST_FIT. The heap uses lazy deletion: update() pushes a fresh entry and marks the old one stale; stale entries
+    are dropped when they reach the top.
+    A server that isn't accepting teams, has no team slot left or has fewer than team_size free player slots is
+    simply not in the index.
+    """
+
+    def __init__(self, max_teams_per_server, max_players_per_server, strategy=PlacementStrategy.WORST_FIT,
+                 team_size=0):
+        """
+        :param max_teams_per_server: team capacity of a server (maxTeamsPerServer)
+        :param max_players_per_server: player capacity of a server (maxPlayersOverall)
+        :param strategy: PlacementStrategy
+        :param team_size: player slots a new team needs on its server (maxPlayersPerTeam)
+        """
+        self.max_teams = max_teams_per_server
+        self.max_players = max_players_per_server
+        self.strategy = strategy
+        self.team_size = team_size
+        self._heap = []
+        self._entries = {}      # server id -> the live heap entry for it
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, server_id):
+        return server_id in self._entries
+
+    def update(self, server_id, accepting, team_load, player_load):
+        """
+        (Re)index a server after its load or state changed. O(log n)
+        :param server_id: id of the server
+        :param accepting: False if the server shouldn't get new teams (not STABLE)
+        :param team_load: teams on the server, including ones routed there but not confirmed yet
+        :param player_load: players on the server, including ones routed there but not confirmed yet
+        """
+        free_teams = self.max_teams - team_load
+        free_players = self.max_players - player_load
+        if not accepting or free_teams <= 0 or free_players <= 0 or free_players < self.team_size:
+            self.remove(server_id)
+            return
+        if self.strategy == PlacementStrategy.BEST_FIT:
+            entry = [free_players, free_teams, next(self._counter), server_id, True]
+        else:
+            entry = [-free_players, -free_teams, next(self._counter), server_id, True]
+        old = self._entries.get(server_id)
+        if old is not None:
+            old[-1] = False
+        self._entries[server_id] = entry
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 4 * len(self._entries) + 16:
+            self._heap = list(self._entries.values())     # drop stale entries that never reached the top
+            heapq.heapify(self._heap)
+
+    def remove(self, server_id):
+        old = self._entries.pop(server_id, None)
+        if old is not None:
+            old[-1] = False
+
+    def clear(self):
+        self._heap = []
+        self._entries = {}
+
+    def peek(self, avoid=None):
+        """
+        :param avoid: optional set of server ids to skip (anti-affinity). Costs O(k log n) for k skipped servers.
+        :return: id of the server the strategy picks for a new team, or None if there is none
+        """
+        while self._heap and not self._heap[0][-1]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        if not avoid or self._heap[0][3] not in avoid:
+            return self._heap[0][3]
+
+        skipped = []
+        found = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if not entry[-1]:
+                continue
+            skipped.append(entry)
+            if entry[3] not in avoid:
+                found = entry[3]
+                break
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return found
+
+
+def parse_anti_affinity(groups):
+    """
+    Parse the antiAffinityGroups setting: groups separated by ';', teams in a group by ','. Teams of the same group
+    are kept on different servers whenever there is a server that allows it.
+    e.g. "12, 15; 7, 8, 9"
+    :return: dict str(team) -> frozenset of the other teams (as str) in its group
+    """
+    rules = {}
+    for group in (groups or '').split(';'):
+        teams = frozenset(team.strip() for team in group.split(',') if team.strip())
+        for team in teams:
+            rules[team] = rules.get(team, frozenset()) | (teams - {team})
+    return rules
@@ -1,33 +1,68 @@
 import configparser
+import json
+import queue
+import time
 import requests
-from azure.batch.models import BatchErrorException
-from azure.batch.models import ComputeNodeState
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from modules.BatchPool import BatchPool
+from modules.ComputeBackend import ComputeBackend, NodeState, make_backend
 from modules.Server import Server
+from modules.PoolSnapshot import PoolSnapshot
+from modules.TeamMap import TeamMap
+from modules.comms.Heartbeat import HeartbeatListener
+from modules.comms.LoadBalancerToMCMain import LBFormattedMsg
+from main.MCServerMain import CommandSet as MCCommands
 from root import *
 from enum import Enum
 
 
 class PoolManager:
 
-    def __init__(self, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg')):
+    def __init__(self, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'), clock=time.monotonic):
+        """
+        :param config: config file
+        :param clock: time source for the pool and its servers, for tests and simulation
+        """
         self.config = configparser.ConfigParser()
         self.config.read(config)
         # self.creds_raw_file = credentials
         self.raw_config_file = config
+        self.clock = clock
 
         # self.state = PoolManager.State(0, {})
         self.servercount = 0
-        self.teams_to_servers = {}
+        # Teams routed here stay assigned for teamAssignmentTTL seconds even if a poll doesn't show them yet.
+        self.team_map = TeamMap(float(self.config.get('LOAD', 'teamAssignmentTTL', fallback=120)), clock=clock)
+        self.teams_to_servers = self.team_map.assignments    # team -> Server. Updated in place, never rebuilt.
         self.servers = []
-        self.player_to_team_lookup = {}
-        self.player_to_server_lookup = {}
+        self.player_to_team_lookup = {}     # player name -> team id, from the teams API
+        self.teams_api_timeout = float(self.config.get('LOAD', 'teamsApiTimeout', fallback=10))
+        self.player_to_server_lookup = {}   # player uuid -> Server the player is on (or was just routed to)
+        self.player_to_team_index = {}      # player uuid -> team, for the same players
 
         self.flag_transition = False  # Set to true during expansions OR contractions to prevent multiple triggers
-        self.batchclient: BatchPool = BatchPool(config=self.raw_config_file)
+
+        # Servers are probed concurrently. A poll cycle waits at most pollCycleDeadline seconds; servers that haven't
+        # answered by then keep their last known state and aren't re-polled until their outstanding probe finishes.
+        # Probes only read from their node - results are applied on the control thread (see apply_polls()).
+        self.poll_cycle_deadline = float(self.config.get('LOAD', 'pollCycleDeadline', fallback=10))
+        self.poll_executor = ThreadPoolExecutor(max_workers=int(self.config.get('LOAD', 'pollWorkers', fallback=16)),
+                                                thread_name_prefix='ServerPoll')
+        self.polls_in_flight = {}     # node_id -> Future of a probe whose result hasn't been applied yet
+        # Nodes push heartbeats to heartbeat_port (0 turns this off). A node is only pull polled once it has been quiet
+        # for heartbeatQuietAfter seconds.
+        self.heartbeat_port = int(self.config.get('POOL', 'heartbeat_port', fallback=0))
+        self.heartbeat_quiet_after = float(self.config.get('LOAD', 'heartbeatQuietAfter', fallback=45))
+        self.heartbeat_queue = queue.Queue()
+        self.heartbeat_listener = None
+        self.last_heartbeat = {}        # server id -> (clock() time, boot, seq) of its last heartbeat
+        # Azure Batch in production; [POOL] backend selects the simulated or local pool instead
+        self.batchclient: ComputeBackend = make_backend(self.config, self.raw_config_file, clock)
         self.state = PoolManager.State.STARTING
 
+        # Everything above belongs to the control plane. Routing reads only this - see publish_snapshot().
+        self.snapshot: PoolSnapshot = PoolSnapshot.empty(self.state)
+
     class State(Enum):
         STARTING = -1       # True when the constructor is called and it has not yet reached allocation_state = steady
         STABLE = 0          # This is true when the pool.allocation_state == steady (i.e., the pool can be altered)
@@ -48,24 +83,33 @@ class PoolManager:
         Updates the pool State (based on its allocation_state variable)
         Queries all servers and updates their Server State.
 
-        NOTE: this is expensive to run and should be running during the config's specified interval to prevent delays
+        NOTE: this is expensive to run. The load balancer schedules poll_pool_state and poll_servers separately;
+        this runs both back to back.
+        """
+        if self.poll_pool_state():
+            self.poll_servers()
+
+    def poll_pool_state(self):
+        """
+        Updates the pool State (based on its allocation_state variable and the state of its nodes)
+        :return: False if the pool is still starting up and its servers shouldn't be polled yet.
         """
 
         if self.batchclient:
             pool_id = self.batchclient.pool_id
             try:
-                pool = self.batchclient.client.pool.get(pool_id)
+                pool = self.batchclient.get_pool()
                 if pool is not None and 'steady' in pool.allocation_state.value:
                     # Case: Pool is stable but the load balancer is intending to change that soon
 
                     flag_nodes_not_ready = False
                     # Go through the nodes and see if they aren't running/idle.
-                    for node in self.batchclient.client.compute_node.list(pool_id):
-                        if node.state in [ComputeNodeState.leaving_pool, ComputeNodeState.offline,
-                                          ComputeNodeState.unusable]:
+                    for node in self.batchclient.list_nodes():
+                        if node.state in [NodeState.leaving_pool, NodeState.offline,
+                                          NodeState.unusable]:
                             continue  # Skip compute nodes that are leaving, shutdown, or otherwise useless.
 
-                        if node.state not in [ComputeNodeState.running, ComputeNodeState.idle]:
+                        if node.state not in [NodeState.running, NodeState.idle]:
                             flag_nodes_not_ready = True
 
                     if flag_nodes_not_ready:
@@ -79,27 +123,172 @@ class PoolManager:
 
                 # Case: Pool is still in startup
                 elif self.state == PoolManager.State.STARTING:
-                    return    # Don't run server.poll until the pool is up.
+                    return False    # Don't run server.poll until the pool is up.
                     # pass    # Pool is still starting - don't change its state and don't poll servers
 
                 # Case: Pool is not steady
                 else:
                     self.state = PoolManager.State.TRANSITIONING
-            except BatchErrorException as e:
-                self.state = PoolManager.State.TRANSITIONING
-            except Exception as e:
+            except Exception as e:      # BatchErrorException / BackendError - or Azure can't be reached
                 print(e)
                 self.state = PoolManager.State.TRANSITIONING
-
-            self.teams_to_servers.clear()
-            for server in self.servers:
-                server.poll()
-                self.teams_to_servers.update({team: server for team in server.teams})
+            return True
         else:
             self.state = PoolManager.State.STARTING  # If the batchclient is null, the pool must be starting or closing.
+            return False
+
+    def poll_servers(self):
+        """
+        Queries all servers concurrently, updates their Server State and applies each server's team delta to the
+        team -> server map.
+        Returns after every poll finished or pollCycleDeadline seconds, whichever comes first. Servers that are
+        still being polled keep their previous state (partial results) - a hung node can't stall the cycle. Their
+        result is applied by a later cycle.
+        Servers that pushed a heartbeat recently aren't polled at all; quiet ones are polled and asked to push again.
+        :return: list of servers whose poll did not finish within the deadline
+        """
+        self.apply_heartbeats()
+        self.apply_polls()      # Late polls from earlier cycles
+
+        cycle = []
+        quiet = []
+        for server in self.servers:
+            if self.heartbeat_fresh(server):
+                continue    # Pushed its status recently - no need to poll it
+            quiet.append(server)
+            if server.node_id in self.polls_in_flight:
+                print(f"Skipping poll of {server.id}: the previous poll is still running")
+                continue
+            future = self.poll_executor.submit(server.probe)
+            self.polls_in_flight[server.node_id] = future
+            cycle.append(future)
+
+        wait(cycle, timeout=self.poll_cycle_deadline)
+        self.apply_polls()
+
+        late = [server for server in self.servers if server.node_id in self.polls_in_flight]
+        if len(late) > 0:
+            print(f"Poll deadline reached - no answer yet from: {[server.id for server in late]}")
+
+        for server in self.servers:
+            self.team_map.update_server(server)
+            self.apply_player_changes(server)
+        self.team_map.expire()
+        self.subscribe_heartbeats(quiet)
+        return late
+
+    def apply_polls(self):
+        """
+        Control plane: apply the result of every finished probe to its server. The probes ran on worker threads but
+        only read from their nodes, so a server's state and roster are only ever changed from this thread.
+        """
+        for server in self.servers:
+            future = self.polls_in_flight.get(server.node_id)
+            if future is None or not future.done():
+                continue
+            del self.polls_in_flight[server.node_id]
+            if future.exception() is not None:
+                print(f"Err: server poll failed: {future.exception()}")
+            else:
+                server.apply_poll(future.result())
+
+    def start_heartbeat_listener(self):
+        """
+        Start receiving node heartbeats on heartbeat_port (if it is set).
+        """
+        if self.heartbeat_port > 0 and self.heartbeat_listener is None:
+            self.heartbeat_listener = HeartbeatListener(self.heartbeat_queue, port=self.heartbeat_port)
+            self.heartbeat_listener.start()
+
+    def apply_heartbeats(self):
+        """
+        Control plane: apply every heartbeat received since the last call. Cheap enough to run every few seconds,
+        so crashes and player changes are seen long before the next poll.
+        :return: number of heartbeats applied
+        """
+        applied = 0
+        while True:
+            try:
+                heartbeat = self.heartbeat_queue.get_nowait()
+            except queue.Empty:
+                return applied
+            server = self.find_server(heartbeat.get('id'))
+            if server is None:
+                continue
+            last = self.last_heartbeat.get(server.id)
+            boot, seq = heartbeat.get('boot'), heartbeat.get('seq', 0)
+            if last is not None and last[1] == boot and last[2] >= seq:
+                continue    # Out of order or duplicate datagram
+            if server.apply_heartbeat(heartbeat):
+                self.last_heartbeat[server.id] = (self.clock(), boot, seq)
+                self.team_map.update_server(server)
+                self.apply_player_changes(server)
+                applied += 1
+
+    def heartbeat_fresh(self, server: Server):
+        """
+        :return: True if the server pushed a heartbeat within heartbeatQuietAfter seconds and its state is one
+                 heartbeats cover
+        """
+        last = self.last_heartbeat.get(server.id)
+        return last is not None and server.accepts_heartbeats() and \
+            self.clock() - last[0] < self.heartbeat_quiet_after
+
+    def subscribe_heartbeats(self, servers):
+        """
+        Ask quiet nodes to push heartbeats to this load balancer. Nodes learn our address from the connection.
+        """
+        if self.heartbeat_port <= 0:
+            return
+        for server in servers:
+            if server.accepts_heartbeats():
+                msg = LBFormattedMsg(MCCommands.SUBSCRIBE, json.dumps({"PORT": self.heartbeat_port, "ID": server.id}))
+                server.send_msg_threaded_to_server(msg)
+
+    def apply_player_changes(self, server: Server):
+        """
+        Update the player -> server / player -> team index from the players that joined or left a server since the
+        last call. Costs O(changes), not O(players).
+        """
+        joined, left = server.drain_player_changes()
+        for player in left:
+            if self.player_to_server_lookup.get(player) is server:
+                del self.player_to_server_lookup[player]
+                self.player_to_team_index.pop(player, None)
+        for player, team in joined.items():
+            self.player_to_server_lookup[player] = server
+            self.player_to_team_index[player] = team
+
+    def forget_server_players(self, server: Server):
+        """
+        Drop every player indexed on a server that is leaving the pool.
+        """
+        server.drain_player_changes()
+        for player in [player for player, srv in self.player_to_server_lookup.items() if srv is server]:
+            del self.player_to_server_lookup[player]
+            self.player_to_team_index.pop(player, None)
+
+    def refresh_teams(self):
+        """
+        Re-download the player -> team lookup and hand it to every server.
+        Keeps the previous lookup if the teams API can't be reached.
+        """
+        previous = self.player_to_team_lookup
+        try:
+            self.__call_teams_api()
+        except requests.RequestException as e:
+            print(f"Err: teams API unreachable, keeping the previous teams: {e}")
+            self.player_to_team_lookup = previous
+        except Exception as e:
+            print(f"Err: unable to refresh teams: {e}")
+            self.player_to_team_lookup = previous
+        if self.player_to_team_lookup is None:
+            self.player_to_team_lookup = previous
+        for server in self.servers:
+            server.master_player_team_map = self.player_to_team_lookup
 
     def __call_teams_api(self):
-        resp = requests.get("https://beta.polycraftworld.com/api/best-teams/")
+        resp = requests.get("https://beta.polycraftworld.com/api/best-teams/", timeout=self.teams_api_timeout)
         if resp.status_code == 200:
             if resp.text.startswith('{') and resp.text.endswith('}'):
                 self.player_to_team_lookup = {key.lower(): value['team_id'] for key, value in resp.json().items() if isinstance(resp.json()[key], dict) and 'team_id' in resp.json()[key].keys()}
@@ -109,43 +298,113 @@ class PoolManager:
 
     def update_server_list(self):
         """
-        Polls all servers in a given pool and updates the PoolManager's list of servers
+        Reconcile the PoolManager's list of servers with the pool's nodes, by node id: servers whose node is still
+        in the pool are kept as they are (players, teams, reservations, failure detector), servers for new nodes are
+        created and polled in parallel, and servers whose node has left are retired. Costs O(changed nodes).
         :return: False if the pool is undefined or if the pool is not at Steady State.
         """
-        # if pool_id is None:
-        if self.batchclient:
-            pool_id = self.batchclient.pool_id
-        else:
+        if not self.batchclient:
             return False
 
         if self.check_is_pool_steady():
-            self.servers.clear()
-            self.__call_teams_api()
-            self.servercount = 0
-            for node in self.batchclient.client.compute_node.list(pool_id):
-                if node.state in [ComputeNodeState.leaving_pool, ComputeNodeState.offline, ComputeNodeState.unusable]:
+            self.refresh_teams()
+            nodes = {}
+            for node in self.batchclient.list_nodes(max_age=0):
+                if node.state in [NodeState.leaving_pool, NodeState.offline, NodeState.unusable]:
                     continue  # Skip compute nodes that are leaving, shutdown, or otherwise useless.
-
-                ip = None
-                minecraftPort = None
-                APIPort = None
-
-                for endpoint in node.endpoint_configuration.inbound_endpoints:
-                    if 'minecraft' in endpoint.name:
-                        minecraftPort = endpoint.frontend_port
-                        ip = endpoint.public_ip_address
-                    if 'api' in endpoint.name:
-                        APIPort = endpoint.frontend_port
-                        ip = endpoint.public_ip_address
-
-                newSrv = Server(node_id=node.id,
-                                ip=ip, port=minecraftPort, api_port=APIPort,
-                                api_player_team=self.player_to_team_lookup)
-                newSrv.poll()  # Update its state
+                nodes[node.id] = node
+
+            known = {server.node_id: server for server in self.servers}
+            for server in list(self.servers):
+                node = nodes.get(server.node_id)
+                if node is None or server.id != self._server_id_for_node(node):
+                    self._retire_server(server)     # Gone - or its endpoints changed (e.g. it had none yet)
+                    known.pop(server.node_id, None)
+
+            new_servers = []
+            for node_id, node in nodes.items():
+                if node_id in known:
+                    continue
+                newSrv = self._new_server(node)
                 self.add_logical_server(newSrv)
+                new_servers.append(newSrv)
+
+            if len(new_servers) > 0:
+                print(f"Pool change: {len(new_servers)} new servers, {len(self.servers)} in total")
+                futures = []
+                for server in new_servers:
+                    future = self.poll_executor.submit(server.probe)    # Update its state
+                    self.polls_in_flight[server.node_id] = future
+                    futures.append(future)
+                wait(futures, timeout=self.poll_cycle_deadline)
+                self.apply_polls()
+                for server in new_servers:
+                    self.team_map.update_server(server)
+                    self.apply_player_changes(server)
+
+            self._finish_merges()
+            self.servercount = len(self.servers)
+            self.team_map.retain(self.servers)
             return True
         return False
 
+    def _new_server(self, node):
+        """
+        :return: a new Server for a compute node that just joined the pool
+        """
+        ip, minecraftPort, APIPort = self._node_endpoints(node)
+        return Server(node_id=node.id,
+                      ip=ip, port=minecraftPort, api_port=APIPort,
+                      api_player_team=self.player_to_team_lookup,
+                      config=self.raw_config_file, clock=self.clock)
+
+    @staticmethod
+    def _node_endpoints(node):
+        """
+        :return: (public ip, minecraft port, API port) of a compute node - None for any it doesn't have yet
+        """
+        ip = None
+        minecraftPort = None
+        APIPort = None
+
+        for endpoint in (node.endpoint_configuration.inbound_endpoints if node.endpoint_configuration else []):
+            if 'minecraft' in endpoint.name:
+                minecraftPort = endpoint.frontend_port
+                ip = endpoint.public_ip_address
+            if 'api' in endpoint.name:
+                APIPort = endpoint.frontend_port
+                ip = endpoint.public_ip_address
+        return ip, minecraftPort, APIPort
+
+    @staticmethod
+    def _server_id_for_node(node):
+        ip, minecraftPort, APIPort = PoolManager._node_endpoints(node)
+        return f"{ip}:{minecraftPort}"
+
+    def _retire_server(self, server: Server):
+        """
+        Drop a server whose node has left the pool, with everything indexed on it.
+        """
+        self.servers.remove(server)
+        self.last_heartbeat.pop(server.id, None)
+        self.polls_in_flight.pop(server.node_id, None)
+        self.team_map.remove_server(server)
+        self.forget_server_players(server)
+        server.api_client.close()
+
+    def _finish_merges(self):
+        """
+        Servers stay WAITING_FOR_MERGE while players are being moved onto them. Once no server is still being drained,
+        every merge has finished and the targets can take new teams again.
+        """
+        draining = [Server.State.REQUESTED_DEACTIVATION, Server.State.CONFIRMING_DEACTIVATION]
+        if any(server.state in draining for server in self.servers):
+            return
+        for server in self.servers:
+            if server.state == Server.State.WAITING_FOR_MERGE:
+                print(f"Merge into {server.id} complete")
+                server.state = Server.State.STABLE
+
     def initializeManager(self, pool_id=None):
         """
         Connects Pool Manager to Azure batch on pool_id
@@ -175,8 +434,7 @@ class PoolManager:
             if pool is not None and 'steady' in pool.allocation_state.value:  # and not self.flag_transition:
                 if self.batchclient.expand_pool(count):     # This triggers the pool.allocation_state to change!
                     # self.flag_transition = True
-                    for i in range(0, new_srv_count):
-                        self.batchclient.add_task_to_start_server()  # Add task to the ongoing server.
+                    self.batchclient.add_tasks_to_start_servers(new_srv_count)  # One batch of start tasks
                     self.poll_servers_and_update()
                     return True
 
@@ -189,13 +447,26 @@ class PoolManager:
         :param server: The server to remove
         :return: True if msg passed successfully to the server. False otherwise.
         """
+        return len(self.actual_remove_servers([server])) > 0
+
+    def actual_remove_servers(self, servers):
+        """
+        Tell the pool to dequeue several Nodes with one resize
+        :param servers: The servers to remove. Only DEACTIVATED or CRASHED ones are removed.
+        :return: list of the servers that were removed
+        """
         if self.state in [PoolManager.State.STABLE, PoolManager.State.FLAG_TO_SHIFT]:  # Run if stable (due to crash) or if the pool is flagged to shrink
-            if server.state == Server.State.DEACTIVATED or server.state == Server.State.CRASHED:
-                if self.batchclient.remove_node_from_pool(server.node_id):   #  CONFIRMED this triggers allocation_state change!
-                    #  print(f"Pool State: {self.batchclient.client.pool.get(self.batchclient.pool_id).allocation_state.value}")
-                    self.servers.remove(server)
-                    return True
-        return False
+            removable = [server for server in servers
+                         if server.state == Server.State.DEACTIVATED or server.state == Server.State.CRASHED]
+            if len(removable) > 0 and self.batchclient.remove_nodes_from_pool([server.node_id for server in removable]):   #  CONFIRMED this triggers allocation_state change!
+                #  print(f"Pool State: {self.batchclient.client.pool.get(self.batchclient.pool_id).allocation_state.value}")
+                for server in removable:
+                    self._retire_server(server)
+                # The resize is under way: wait for a poll to see the pool steady again. (Waiting to see it resizing
+                # instead would hang in FLAG_TO_SHIFT whenever the resize finishes between two polls.)
+                self.state = PoolManager.State.TRANSITIONING
+                return removable
+        return []
 
     def signal_remove_server(self, server: Server, targetServer: Server = None):
         """
@@ -204,21 +475,34 @@ class PoolManager:
         :param targetServer: optional new server for current players to transition over towards
         :return: True if the signal was applied
         """
+        return len(self.signal_remove_servers([(server, targetServer)])) > 0
+
+    def signal_remove_servers(self, migrations):
+        """
+        Signal to MC intent to delete several servers at once (see Consolidation.plan_consolidation)
+        :param migrations: (server, targetServer) pairs - targetServer may be None if server is empty. Several servers
+                           can merge into the same target.
+        :return: list of the servers whose signal was applied
+        """
         # pool = self.batchclient.check_or_create_pool(self.batchclient.pool_id)
+        signalled = []
         if self.check_is_pool_steady():     # and not self.flag_transition:
-            if server.state == Server.State.STABLE:
-                if server.playercount > 0 and (targetServer is None or targetServer.state != Server.State.STABLE):
-                    return False  # Desired server has players! needs a target server that is stable.
-
+            for server, targetServer in migrations:
+                if server.state != Server.State.STABLE:
+                    continue
+                if server.playercount > 0 and (targetServer is None or targetServer.state not in
+                                               [Server.State.STABLE, Server.State.WAITING_FOR_MERGE]):
+                    continue  # Desired server has players! needs a target server that is stable.
+
+                if server.decommission(targetServer) is False:
+                    continue    # Crashed, or it changed state under us
                 if targetServer is not None:
-                    server.decommission(targetServer)
                     targetServer.state = Server.State.WAITING_FOR_MERGE
-                else:
-                    server.decommission()
+                signalled.append(server)
 
+            if len(signalled) > 0:
                 self.state = PoolManager.State.FLAG_TO_SHIFT   # Alert the Load Balancer that a msg to shift is received
-                return True
-        return False
+        return signalled
 
     def add_logical_server(self, server: Server):
         if server not in self.servers:
@@ -227,23 +511,37 @@ class PoolManager:
             return True
         return False
 
-    def getServerForTeam(self, team):
+    def publish_snapshot(self):
         """
-        THis gets the server that a player can be added to
-        :param team: the team whose server we need
-        :return: {Server} object that can add a player.
+        Control plane: publish the current servers, pool state and team map as a new immutable PoolSnapshot.
+        Readers pick it up with a single attribute read of self.snapshot.
+        :return: the new snapshot
         """
-        if team not in self.teams_to_servers:
-            self.teams_to_servers.update({team: self.__get_next_available_server()})
+        self.snapshot = PoolSnapshot.build(self.snapshot.version + 1, self.state, self.servers, self.teams_to_servers,
+                                           self.player_to_server_lookup, self.player_to_team_index)
+        return self.snapshot
 
-        return self.teams_to_servers[team]
+    def find_server(self, server_id):
+        """
+        :param server_id: Server.id ("ip:port")
+        :return: the Server with this id, or None
+        """
+        for server in self.servers:
+            if server == server_id:
+                return server
+        return None
 
-    def __get_next_available_server(self) -> Server:
+    def assign_player(self, playerUUID, team, server_id):
         """
-        :return: server with least number of players on it (for a new team to spawn) that is running
+        Control plane: apply a routing decision made by the data plane (see Router).
+        :return: False if the server has since left the pool
         """
-        self.servers.sort()
-        for srv in self.servers:
-            if srv.eligible_for_new_teams():
-                return srv
-        raise   # Throw an error if no servers are available - this should NEVER happen.
+        server = self.find_server(server_id)
+        if server is None:
+            print(f"Err: {playerUUID} was routed to {server_id}, which is no longer in the pool")
+            return False
+        server.add_player(playerUUID, team)
+        self.team_map.assign(team, server)
+        self.team_map.update_server(server)
+        self.apply_player_changes(server)
+        return True
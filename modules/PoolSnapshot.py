@@ -0,0 +1,82 @@
+from typing import NamedTuple
+from types import MappingProxyType
+import time
+
+"""
+Immutable, versioned views of the pool.
+The control plane (polling, Azure calls, scaling) is the only thing that touches Server objects. After every change it
+publishes a new PoolSnapshot by swapping a single reference (PoolManager.snapshot). The data plane (routing lobby
+requests) only ever reads the latest snapshot, so it never takes a lock and never sees a half-updated pool.
+"""
+
+
+class ServerView(NamedTuple):
+    """
+    Read-only copy of a Server at the moment a snapshot was published.
+    """
+    id: str
+    node_id: str
+    ip: str
+    port: int
+    api: int
+    state: object           # Server.State
+    accepting: bool         # True if the server can be given new teams (state is STABLE)
+    reachable: bool         # True if players already on the server can (re)connect to it (STABLE or WAITING_FOR_MERGE)
+    teams: frozenset
+    players: frozenset
+    playercount: int
+
+    @staticmethod
+    def from_server(server):
+        state = server.state
+        return ServerView(id=server.id,
+                          node_id=server.node_id,
+                          ip=server.ip,
+                          port=server.port,
+                          api=server.api,
+                          state=state,
+                          accepting=state.name == 'STABLE',
+                          reachable=state.name in ('STABLE', 'WAITING_FOR_MERGE'),
+                          teams=frozenset(server.teams),
+                          players=frozenset(server.players),
+                          playercount=server.playercount)
+
+
+class PoolSnapshot(NamedTuple):
+    version: int
+    pool_state: object      # PoolManager.State
+    servers: tuple          # ServerView, in PoolManager.servers order
+    by_id: MappingProxyType             # server id -> ServerView
+    teams_to_servers: MappingProxyType  # team -> ServerView
+    players_to_servers: MappingProxyType    # player uuid -> ServerView
+    players_to_teams: MappingProxyType      # player uuid -> team
+    published: float        # time.monotonic() when this snapshot was built
+
+    @staticmethod
+    def build(version, pool_state, servers, teams_to_servers, players_to_servers=None, players_to_teams=None):
+        """
+        :param version: monotonically increasing snapshot number
+        :param pool_state: PoolManager.State at publish time
+        :param servers: iterable of Server
+        :param teams_to_servers: dict team -> Server
+        :param players_to_servers: dict player uuid -> Server
+        :param players_to_teams: dict player uuid -> team
+        :return: a new PoolSnapshot. Nothing in it refers back to the mutable Server objects.
+        """
+        views = tuple(ServerView.from_server(server) for server in servers)
+        by_id = {view.id: view for view in views}
+        teams = {team: by_id[server.id] for team, server in teams_to_servers.items() if server.id in by_id}
+        players = {player: by_id[server.id] for player, server in (players_to_servers or {}).items()
+                   if server.id in by_id}
+        return PoolSnapshot(version=version,
+                            pool_state=pool_state,
+                            servers=views,
+                            by_id=MappingProxyType(by_id),
+                            teams_to_servers=MappingProxyType(teams),
+                            players_to_servers=MappingProxyType(players),
+                            players_to_teams=MappingProxyType(dict(players_to_teams or {})),
+                            published=time.monotonic())
+
+    @staticmethod
+    def empty(pool_state=None):
+        return PoolSnapshot.build(0, pool_state, (), {})
@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class ReservationTable:
+    """
+    Capacity leases on one server.
+
+    When a player is routed to a server, a lease is taken out for them. The lease holds the player's (and so their
+    team's) slot until either a status poll shows the player online (the lease is confirmed and dropped) or the lease
+    expires. Server.poll keeps leased players in its roster, so a burst of teams routed between two polls counts
+    against the server's capacity instead of being wiped out by the next poll.
+    Thread safe: leases are taken out on the control plane and confirmed on poll worker threads.
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        """
+        :param ttl: seconds a lease holds capacity without the player showing up
+        :param clock: time source, for tests and simulation
+        """
+        self.ttl = ttl
+        self.clock = clock
+        self._leases = {}       # player uuid -> (team, monotonic expiry)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._leases)
+
+    def __contains__(self, player):
+        with self._lock:
+            return player in self._leases
+
+    def reserve(self, player, team):
+        """
+        Take out (or renew) the lease for a player routed to this server.
+        """
+        with self._lock:
+            self._leases[player] = (team, self.clock() + self.ttl)
+
+    def release(self, player):
+        with self._lock:
+            self._leases.pop(player, None)
+
+    def confirm(self, players):
+        """
+        Drop the leases of players a poll has seen online - they now count as confirmed load.
+        :param players: iterable of player uuids reported by the server
+        :return: number of leases confirmed
+        """
+        confirmed = 0
+        with self._lock:
+            for player in players:
+                if self._leases.pop(player, None) is not None:
+                    confirmed += 1
+        return confirmed
+
+    def active(self):
+        """
+        Expire old leases.
+        :return: dict player uuid -> team of the leases still holding capacity
+        """
+        now = self.clock()
+        with self._lock:
+            expired = [player for player, (team, expiry) in self._leases.items() if expiry <= now]
+            for player in expired:
+                del self._leases[player]
+            return {player: team for player, (team, expiry) in self._leases.items()}
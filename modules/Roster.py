@@ -0,0 +1,68 @@
+import json
+import os
+from enum import Enum
+
+"""
+Full player roster of a Minecraft server.
+The status (SLP) response only carries a small sample of the players online, so a roster built from it undercounts
+busy servers. The Query protocol (enable-query=true in server.properties) lists every player online, but by name only;
+the load balancer tracks players by uuid, so names are resolved through the server's usercache.json, which Minecraft
+writes as players join. MCServerMain builds the roster on the node and hands it to the load balancer in heartbeats and
+in reply to CommandSet.PLAYERS.
+"""
+
+
+class RosterSource(Enum):
+    """
+    Where the load balancer's polls get a server's players from ([LOAD] rosterSource)
+    """
+    SAMPLE = 'sample'       # the status sample only - partial on busy servers
+    NODE = 'node'           # ask the node agent (CommandSet.PLAYERS) whenever the sample is partial
+
+
+class UserCache:
+    """
+    name -> uuid from a Minecraft usercache.json. Re-read only when the file changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._uuids = {}
+
+    def lookup(self):
+        """
+        :return: dict of lower case player name -> uuid (empty if the file doesn't exist yet)
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return self._uuids
+        if mtime != self._mtime:
+            try:
+                with open(self.path) as cache:
+                    entries = json.load(cache)
+                self._uuids = {entry['name'].lower(): entry['uuid'] for entry in entries
+                               if 'name' in entry and 'uuid' in entry}
+                self._mtime = mtime
+            except (OSError, ValueError) as e:
+                print(f"Err: unable to read {self.path}: {e}")
+        return self._uuids
+
+
+def merge_roster(sample, names, uuids):
+    """
+    Combine the status sample with the Query player list.
+    :param sample: uuid -> name from the status response (may be partial)
+    :param names: every player name online, from Query (empty if Query is off)
+    :param uuids: lower case name -> uuid, see UserCache
+    :return: uuid -> name for every player we can identify. Players only known by name (not in the usercache yet) are
+             keyed by their name, so they are still counted.
+    """
+    roster = dict(sample)
+    known = {name.lower() for name in sample.values()}
+    for name in names:
+        if name.lower() in known:
+            continue
+        roster[uuids.get(name.lower(), name)] = name
+    return roster
@@ -0,0 +1,166 @@
+from modules.PoolSnapshot import PoolSnapshot, ServerView
+from modules.Placement import PlacementIndex, PlacementStrategy
+
+
+class Router:
+    """
+    Data plane: answers "which server should this player go to?" from the latest published PoolSnapshot.
+    Only the lobby thread uses a Router. It never touches Server objects and never takes a lock.
+
+    Routing decisions are applied to the real Servers by the control plane (see PoolManager.assign_player). Until a
+    published snapshot reflects a decision, the Router remembers it locally (pending_teams / pending_players) so that
+    a team is never placed twice and servers aren't overfilled while the control plane catches up.
+
+    New teams are placed with a PlacementIndex (best or worst fit on team and player slots, see PlacementStrategy),
+    skipping servers that hold a team the new one has an anti-affinity rule with. The index is updated incrementally: only servers whose view changed between
+    snapshots (a poll, a state change, a confirmed add_player) or that just received a routing decision are re-indexed.
+    """
+
+    def __init__(self, pool, max_teams_per_server, max_players_per_server, strategy=PlacementStrategy.WORST_FIT,
+                 team_size=0, anti_affinity=None):
+        """
+        :param pool: PoolManager whose snapshot is routed against
+        :param max_teams_per_server: team capacity of a single server
+        :param max_players_per_server: player capacity of a single server
+        :param strategy: PlacementStrategy used for new teams
+        :param team_size: free player slots a server needs to take a new team
+        :param anti_affinity: str(team) -> teams it shouldn't share a server with (see Placement.parse_anti_affinity)
+        """
+        self.pool = pool
+        self.max_teams = max_teams_per_server
+        self.anti_affinity = anti_affinity or {}
+        self.pending_teams = {}         # team -> server id, not yet in a published snapshot
+        self.pending_players = {}       # player uuid -> server id, not yet in a published snapshot
+        self.pending_team_count = {}    # server id -> len of pending_teams routed there
+        self.pending_player_count = {}  # server id -> len of pending_players routed there
+        self.index = PlacementIndex(max_teams_per_server, max_players_per_server, strategy, team_size)
+        self.snapshot = PoolSnapshot.empty()
+        self.seen_version = -1
+
+    def current_snapshot(self) -> PoolSnapshot:
+        """
+        :return: the latest snapshot. Pending decisions that it already contains are forgotten, and servers whose
+                 view changed are re-indexed.
+        """
+        snapshot = self.pool.snapshot
+        if snapshot.version == self.seen_version:
+            return snapshot
+
+        previous = self.snapshot
+        self.snapshot = snapshot
+        self.seen_version = snapshot.version
+
+        old_counts = (self.pending_team_count, self.pending_player_count)
+        self.pending_teams = {team: server_id for team, server_id in self.pending_teams.items()
+                              if server_id in snapshot.by_id and team not in snapshot.teams_to_servers}
+        self.pending_players = {player: server_id for player, server_id in self.pending_players.items()
+                                if server_id in snapshot.by_id
+                                and player not in snapshot.by_id[server_id].players}
+        self.pending_team_count = self._count(self.pending_teams)
+        self.pending_player_count = self._count(self.pending_players)
+
+        for server_id in previous.by_id.keys() - snapshot.by_id.keys():
+            self.index.remove(server_id)
+        for server in snapshot.servers:
+            if previous.by_id.get(server.id) != server \
+                    or old_counts[0].get(server.id, 0) != self.pending_team_count.get(server.id, 0) \
+                    or old_counts[1].get(server.id, 0) != self.pending_player_count.get(server.id, 0):
+                self._reindex(server)
+        return snapshot
+
+    @staticmethod
+    def _count(pending):
+        counts = {}
+        for server_id in pending.values():
+            counts[server_id] = counts.get(server_id, 0) + 1
+        return counts
+
+    def route_player(self, player, team) -> ServerView:
+        """
+        Pick the server for a player, placing their team on a new server if it doesn't have one yet.
+        The caller is responsible for handing the decision to the control plane (PoolManager.assign_player).
+        :param player: player uuid
+        :param team: the player's team
+        :return: ServerView of the chosen server, or None if no server has room for a new team
+        """
+        server = self.get_server_for_team(team)
+        if server is None:
+            return None
+        previous_id = self.pending_players.get(player)
+        if previous_id != server.id:
+            if previous_id is not None:
+                self.pending_player_count[previous_id] -= 1
+                if previous_id in self.snapshot.by_id:
+                    self._reindex(self.snapshot.by_id[previous_id])
+            self.pending_players[player] = server.id
+            self.pending_player_count[server.id] = self.pending_player_count.get(server.id, 0) + 1
+            self._reindex(server)
+        return server
+
+    def get_server_for_player(self, player) -> ServerView:
+        """
+        O(1) lookup of the server a player is on (or was just routed to) - used when a player reconnects.
+        :param player: player uuid
+        :return: ServerView of the player's server, or None if the player is unknown or their server is unreachable
+        """
+        snapshot = self.current_snapshot()
+        server_id = self.pending_players.get(player)
+        if server_id is not None:
+            server = snapshot.by_id.get(server_id)
+        else:
+            server = snapshot.players_to_servers.get(player)
+        if server is None or not server.reachable:
+            return None
+        return server
+
+    def get_server_for_team(self, team) -> ServerView:
+        """
+        :param team: the team whose server we need
+        :return: {ServerView} of the server the team is (or now will be) on, or None if no server has room
+        """
+        snapshot = self.current_snapshot()
+        server = snapshot.teams_to_servers.get(team)
+        if server is not None:
+            return server
+
+        server_id = self.pending_teams.get(team)
+        if server_id is not None:
+            return snapshot.by_id[server_id]
+
+        server_id = self.index.peek(self._servers_to_avoid(team, snapshot))
+        if server_id is None and str(team) in self.anti_affinity:
+            print(f"Anti-affinity for team {team} can't be met - placing it anyway")
+            server_id = self.index.peek()
+        if server_id is None:
+            print(f"Err: no server has room for team {team}")
+            return None
+        server = snapshot.by_id[server_id]
+        self.pending_teams[team] = server.id
+        self.pending_team_count[server.id] = self.pending_team_count.get(server.id, 0) + 1
+        self._reindex(server)
+        return server
+
+    def _servers_to_avoid(self, team, snapshot):
+        """
+        :return: ids of the servers holding a team that has an anti-affinity rule with this one
+        """
+        rivals = self.anti_affinity.get(str(team))
+        if not rivals:
+            return None
+        avoid = set()
+        for other, server in snapshot.teams_to_servers.items():
+            if str(other) in rivals:
+                avoid.add(server.id)
+        for other, server_id in self.pending_teams.items():
+            if str(other) in rivals:
+                avoid.add(server_id)
+        return avoid
+
+    def _team_load(self, server: ServerView):
+        return len(server.teams) + self.pending_team_count.get(server.id, 0)
+
+    def _player_load(self, server: ServerView):
+        return server.playercount + self.pending_player_count.get(server.id, 0)
+
+    def _reindex(self, server: ServerView):
+        self.index.update(server.id, server.accepting, self._team_load(server), self._player_load(server))
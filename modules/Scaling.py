@@ -0,0 +1,321 @@
+import collections
+import math
+import threading
+import time
+from typing import NamedTuple
+
+"""
+Autoscaling for the load balancer.
+
+A DemandTracker records team arrivals and departures over time. A ScalingPolicy turns that demand into a node delta:
+how many nodes to add (positive), or whether nodes can be removed (negative). The threshold rule the load balancer
+has always used is ThresholdPolicy. The predictive policies forecast demand over the time a new node needs to boot
+(nodeBootLeadTime), so the pool is sized for the teams that will have arrived by the time a node is ready.
+Select the policy with [LOAD] scalingPolicy = threshold | ewma | holt.
+"""
+
+
+def scale_out_deficit(servers, teams, players, max_teams_per_server, max_players_per_server, threshold_teams,
+                      min_nodes, max_nodes):
+    """
+    Work out how many nodes to add in one resize so the pool covers current demand plus the team headroom, instead
+    of adding one node per boot cycle.
+    :param servers: number of servers in the pool (including ones still booting)
+    :param teams: teams placed or reserved on the pool
+    :param players: players on the pool
+    :param max_teams_per_server: team capacity of a node
+    :param max_players_per_server: player capacity of a node
+    :param threshold_teams: free team slots the pool should always have (thresholdTeamsAvailable)
+    :param min_nodes: pool mincount
+    :param max_nodes: pool maxcount
+    :return: number of nodes to add (0 if the pool is big enough or already at max_nodes)
+    """
+    # should_add_server_check is satisfied once free team slots >= threshold_teams
+    nodes_for_teams = math.ceil((teams + threshold_teams) / max_teams_per_server)
+    nodes_for_players = math.ceil(players / max_players_per_server)
+    target = min(max(min_nodes, nodes_for_teams, nodes_for_players), max_nodes)
+    return max(target - servers, 0)
+
+
+class CapacitySettings(NamedTuple):
+    max_teams_per_server: int
+    max_players_per_server: int
+    threshold_teams: int
+    min_nodes: int
+    max_nodes: int
+
+    @staticmethod
+    def from_config(config):
+        return CapacitySettings(max_teams_per_server=int(config.get('SERVER', 'maxTeamsPerServer')),
+                                max_players_per_server=int(config.get('SERVER', 'maxPlayersOverall')),
+                                threshold_teams=int(config.get('LOAD', 'thresholdTeamsAvailable')),
+                                min_nodes=int(config.get('POOL', 'mincount')),
+                                max_nodes=int(config.get('POOL', 'maxcount')))
+
+
+class DemandTracker:
+    """
+    Time series of the pool's demand, fed once per scaling check.
+    Keeps EWMA-smoothed team arrival and departure rates, and a Holt (level + trend) model of the team count.
+    All rates and trends are per second.
+    """
+
+    def __init__(self, alpha=0.3, beta=0.1, clock=time.monotonic):
+        """
+        :param alpha: smoothing of the rates and the Holt level (0..1, higher reacts faster)
+        :param beta: smoothing of the Holt trend (0..1)
+        :param clock: time source, for tests and simulation
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.clock = clock
+        self.teams = 0
+        self.players = 0
+        self.arrival_rate = 0.0
+        self.departure_rate = 0.0
+        self.level = None
+        self.trend = 0.0
+        self._last = None       # (time, arrivals, departures) of the previous observation
+
+    def observe(self, teams, players, arrivals, departures):
+        """
+        :param teams: teams on the pool now
+        :param players: players on the pool now
+        :param arrivals: total teams that have ever arrived (a running counter, see TeamMap.arrivals)
+        :param departures: total teams that have ever left (see TeamMap.departures)
+        """
+        now = self.clock()
+        self.teams = teams
+        self.players = players
+        if self._last is None or self.level is None:
+            self.level = float(teams)
+            self._last = (now, arrivals, departures)
+            return
+
+        last_time, last_arrivals, last_departures = self._last
+        dt = now - last_time
+        if dt <= 0:
+            return
+        self.arrival_rate = self._smooth(self.arrival_rate, (arrivals - last_arrivals) / dt)
+        self.departure_rate = self._smooth(self.departure_rate, (departures - last_departures) / dt)
+
+        previous_level = self.level
+        self.level = self.alpha * teams + (1 - self.alpha) * (self.level + self.trend * dt)
+        self.trend = self.beta * (self.level - previous_level) / dt + (1 - self.beta) * self.trend
+        self._last = (now, arrivals, departures)
+
+    def _smooth(self, average, sample):
+        return self.alpha * sample + (1 - self.alpha) * average
+
+    def forecast_ewma(self, horizon):
+        """
+        :return: teams expected in horizon seconds, from the smoothed net arrival rate
+        """
+        return self.teams + (self.arrival_rate - self.departure_rate) * horizon
+
+    def forecast_holt(self, horizon):
+        """
+        :return: teams expected in horizon seconds, from the Holt level and trend
+        """
+        if self.level is None:
+            return self.teams
+        return self.level + self.trend * horizon
+
+
+class ThresholdPolicy:
+    """
+    Reactive rule: keep at least thresholdTeamsAvailable free team slots. Once more than
+    thresholdTeamsAvailable + maxTeamsPerServer slots are free, remove every node the pool doesn't need.
+    """
+    name = 'threshold'
+
+    def __init__(self, settings: CapacitySettings, lead_time=0):
+        """
+        :param settings: capacity limits of the pool
+        :param lead_time: seconds between asking for a node and it taking teams
+        """
+        self.settings = settings
+        self.lead_time = lead_time
+
+    def forecast_teams(self, demand: DemandTracker):
+        return demand.teams
+
+    def decide(self, demand: DemandTracker, servers):
+        """
+        :param demand: DemandTracker with the latest observation
+        :param servers: number of servers in the pool
+        :return: nodes to add (> 0), nodes that may be removed (< 0) or 0
+        """
+        s = self.settings
+        # Never plan for less than is on the pool right now
+        teams = max(self.forecast_teams(demand), demand.teams)
+        players = demand.players * teams / demand.teams if demand.teams > 0 else demand.players
+        add = scale_out_deficit(servers, math.ceil(teams), math.ceil(players), s.max_teams_per_server,
+                                s.max_players_per_server, s.threshold_teams, s.min_nodes, s.max_nodes)
+        if add > 0:
+            return add
+        if servers > s.min_nodes and \
+                servers * s.max_teams_per_server - teams > s.threshold_teams + s.max_teams_per_server:
+            # Every node above what the demand needs can go in the same consolidation round
+            needed = max(s.min_nodes,
+                         math.ceil((teams + s.threshold_teams) / s.max_teams_per_server),
+                         math.ceil(players / s.max_players_per_server))
+            return -max(servers - needed, 1)
+        return 0
+
+
+class EWMAPolicy(ThresholdPolicy):
+    """
+    Predictive: plan for the teams expected after the node boot lead time at the smoothed net arrival rate.
+    """
+    name = 'ewma'
+
+    def forecast_teams(self, demand: DemandTracker):
+        return demand.forecast_ewma(self.lead_time)
+
+
+class HoltPolicy(ThresholdPolicy):
+    """
+    Predictive: plan for the teams expected after the node boot lead time from a Holt (level + trend) model.
+    """
+    name = 'holt'
+
+    def forecast_teams(self, demand: DemandTracker):
+        return demand.forecast_holt(self.lead_time)
+
+
+POLICIES = {policy.name: policy for policy in (ThresholdPolicy, EWMAPolicy, HoltPolicy)}
+
+
+def make_policy(config):
+    """
+    :param config: ConfigParser with the [LOAD], [SERVER] and [POOL] sections
+    :return: the ScalingPolicy named by [LOAD] scalingPolicy (threshold if unset or unknown)
+    """
+    name = config.get('LOAD', 'scalingPolicy', fallback=ThresholdPolicy.name).strip().lower()
+    if name not in POLICIES:
+        print(f"Err: unknown scalingPolicy '{name}' - using {ThresholdPolicy.name}")
+        name = ThresholdPolicy.name
+    return POLICIES[name](CapacitySettings.from_config(config),
+                          lead_time=float(config.get('LOAD', 'nodeBootLeadTime', fallback=300)))
+
+
+class ScalingDecision(NamedTuple):
+    time: float             # clock() of the scaling check
+    servers: int
+    teams: int
+    forecast: float         # teams the policy planned for
+    recommended: int        # what the policy asked for
+    delta: int              # what the controller let through (0 = hold)
+    reason: str
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class ScalingController:
+    """
+    Damps a ScalingPolicy so churny demand doesn't make the pool flap between adding and removing nodes.
+
+    - Stabilization windows: the policy has to keep asking to scale out (scaleUpStabilization) or to scale in
+      (scaleDownStabilization) for that many seconds in a row before it's acted on.
+    - Cooldowns: no new scale-out for scaleUpCooldown seconds after the last one (the nodes it asked for are still
+      booting), and no scale-in for scaleDownCooldown seconds after any scaling action.
+    Every check is kept in a bounded decision log.
+    """
+
+    def __init__(self, policy, up_window=0, down_window=300, up_cooldown=60, down_cooldown=600, log_size=100,
+                 clock=time.monotonic):
+        """
+        :param policy: ScalingPolicy that recommends node deltas
+        :param up_window: seconds scale-out must be recommended continuously before nodes are added
+        :param down_window: seconds scale-in must be recommended continuously before a node is removed
+        :param up_cooldown: seconds after a scale-out before another scale-out
+        :param down_cooldown: seconds after any scaling action before a scale-in
+        :param log_size: decisions kept in the log
+        :param clock: time source, for tests and simulation
+        """
+        self.policy = policy
+        self.up_window = up_window
+        self.down_window = down_window
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.clock = clock
+        self.log = collections.deque(maxlen=log_size)
+        self.log_lock = threading.Lock()    # the lobby thread reads the log while the control plane appends to it
+        self.up_since = None        # start of the current run of scale-out recommendations
+        self.down_since = None      # start of the current run of scale-in recommendations
+        self.last_scale_up = None
+        self.last_action = None
+
+    @staticmethod
+    def from_config(config, policy, clock=time.monotonic):
+        return ScalingController(policy,
+                                 up_window=float(config.get('LOAD', 'scaleUpStabilization', fallback=0)),
+                                 down_window=float(config.get('LOAD', 'scaleDownStabilization', fallback=300)),
+                                 up_cooldown=float(config.get('LOAD', 'scaleUpCooldown', fallback=60)),
+                                 down_cooldown=float(config.get('LOAD', 'scaleDownCooldown', fallback=600)),
+                                 log_size=int(config.get('LOAD', 'scalingLogSize', fallback=100)),
+                                 clock=clock)
+
+    def evaluate(self, demand: DemandTracker, servers):
+        """
+        Ask the policy for a recommendation and decide whether it should be acted on now.
+        Call once per scaling check.
+        :return: nodes to add (> 0), nodes to remove (< 0) or 0 to hold
+        """
+        now = self.clock()
+        recommended = self.policy.decide(demand, servers)
+
+        if recommended > 0:
+            self.up_since = now if self.up_since is None else self.up_since
+            self.down_since = None
+        elif recommended < 0:
+            self.down_since = now if self.down_since is None else self.down_since
+            self.up_since = None
+        else:
+            self.up_since = self.down_since = None
+
+        delta, reason = 0, "within capacity"
+        if recommended > 0:
+            if now - self.up_since < self.up_window:
+                reason = f"scale-out stabilizing ({now - self.up_since:.0f}/{self.up_window:.0f}s)"
+            elif self.last_scale_up is not None and now - self.last_scale_up < self.up_cooldown:
+                reason = f"scale-out cooldown ({now - self.last_scale_up:.0f}/{self.up_cooldown:.0f}s)"
+            else:
+                delta, reason = recommended, "scale out"
+        elif recommended < 0:
+            if now - self.down_since < self.down_window:
+                reason = f"scale-in stabilizing ({now - self.down_since:.0f}/{self.down_window:.0f}s)"
+            elif self.last_action is not None and now - self.last_action < self.down_cooldown:
+                reason = f"scale-in cooldown ({now - self.last_action:.0f}/{self.down_cooldown:.0f}s)"
+            else:
+                delta, reason = recommended, "scale in"
+
+        decision = ScalingDecision(time=now, servers=servers, teams=demand.teams,
+                                   forecast=round(max(self.policy.forecast_teams(demand), demand.teams), 2),
+                                   recommended=recommended, delta=delta, reason=reason)
+        with self.log_lock:
+            previous = self.log[-1] if len(self.log) > 0 else None
+            self.log.append(decision)
+        if recommended != 0 and (previous is None or previous.reason != reason):
+            print(f"Scaling ({self.policy.name}): recommended {recommended}, doing {delta} - {reason}")
+        return delta
+
+    def record_action(self, delta):
+        """
+        Tell the controller a scaling action was actually started (automatic or manual), to start its cooldowns.
+        :param delta: nodes added (> 0) or removed (< 0)
+        """
+        now = self.clock()
+        self.last_action = now
+        if delta > 0:
+            self.last_scale_up = now
+        self.up_since = self.down_since = None
+
+    def decisions(self):
+        """
+        :return: the decision log, oldest first
+        """
+        with self.log_lock:
+            return list(self.log)
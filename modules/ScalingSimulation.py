@@ -0,0 +1,527 @@
+import collections
+import configparser
+import contextlib
+import heapq
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from types import SimpleNamespace
+from main.LoadBalancerMain import LoadBalancerMain
+from main.MCServerMain import CommandSet as MCCommands
+from modules.PoolManager import PoolManager
+from modules.ComputeBackend import NodeState
+from modules.LobbyLoad import TraceShape, arrival_times, percentile
+from modules.comms.StubSLP import status_response
+from root import *
+
+"""
+Discrete-event simulation of the autoscaler, on a virtual clock.
+The real LoadBalancerMain runs unchanged - its scheduled jobs (pool poll, server polls, handle_active_state with
+should_add_server_check / should_merge_servers_check), its Router and the real Server state machines - on a
+SimulatedBackend pool. Only the network is simulated: each Server talks to an in-memory Minecraft status and node API
+instead of a socket. Players arrive in teams (steady, bursts or diurnal, see LobbyLoad.arrival_rate), ask the lobby
+path for a server, retry while there's no capacity, play for a while and leave; merges move them between nodes, and
+nodes can be made to crash.
+The clock jumps from one event or job deadline to the next, so a day of traffic takes seconds.
+Reports wait-for-capacity, node-hours, scale-outs, merges and flaps (a scaling action that reverses the previous one
+within flap_window seconds).
+"""
+
+SIMULATION_CONFIG = {
+    'POOL': {'backend': 'simulated', 'heartbeat_port': '0'},     # Polls only: the simulated nodes don't push
+}
+CRASH_CHECK_INTERVAL = 60       # seconds between rolls of the crash dice
+
+
+def config_with_overrides(config_file, overrides):
+    """
+    :param overrides: section -> {key: value}, applied over config_file
+    :return: path of a temporary copy of config_file with the overrides
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str        # Keep the keys' case in the copy
+    config.read(config_file)
+    for section, values in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, str(value))
+    copy = tempfile.NamedTemporaryFile('w', suffix='.cfg', delete=False)
+    config.write(copy)
+    copy.close()
+    return copy.name
+
+
+class VirtualClock:
+    """
+    Time source that only moves when the simulation moves it. Pass it wherever a clock=time.monotonic is taken.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = float(start)
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance_to(self, t):
+        self.now = max(self.now, t)
+
+
+class SimulatedPlayer:
+
+    def __init__(self, player_id, name, team):
+        self.id = player_id
+        self.name = name
+        self.team = team
+        self.node = None                # node the player is playing on
+        self.waiting_since = None       # time of the first lobby request that hasn't been answered with a server
+        self.gone = False
+
+
+class SimulatedMinecraft:
+    """
+    Stands in for mcstatus.MinecraftServer: status() of a simulated node.
+    """
+
+    def __init__(self, simulation, node_id):
+        self.simulation = simulation
+        self.node_id = node_id
+
+    def status(self, tries=1):
+        if not self.simulation.mc_up(self.node_id):
+            raise ConnectionRefusedError(f"{self.node_id}: Minecraft is down")
+        raw = status_response(dict(self.simulation.rosters[self.node_id]))
+        sample = [SimpleNamespace(id=player['id'], name=player['name']) for player in raw['players']['sample']]
+        return SimpleNamespace(raw=raw, latency=1.0,
+                               players=SimpleNamespace(online=raw['players']['online'], max=raw['players']['max'],
+                                                       sample=sample))
+
+
+class SimulatedNodeApi:
+    """
+    Stands in for NodeClient: the node API of a simulated node.
+    """
+
+    def __init__(self, simulation, node_id):
+        self.simulation = simulation
+        self.node_id = node_id
+
+    def call(self, msg):
+        return self.simulation.node_command(self.node_id, msg)
+
+    def request(self, msg):
+        future = Future()
+        try:
+            future.set_result(self.call(msg))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        pass
+
+
+class SimulatedPoolManager(PoolManager):
+    """
+    PoolManager whose servers reach their nodes through the simulation, and whose teams come from the simulated
+    players instead of the teams API.
+    """
+
+    def __init__(self, simulation, config, clock):
+        self.simulation = simulation
+        PoolManager.__init__(self, config=config, clock=clock)
+
+    def refresh_teams(self):
+        self.player_to_team_lookup = self.simulation.team_lookup
+        for server in self.servers:
+            server.master_player_team_map = self.player_to_team_lookup
+
+    def _new_server(self, node):
+        server = PoolManager._new_server(self, node)
+        server.mcServer = SimulatedMinecraft(self.simulation, node.id)
+        server.api_client.close()
+        server.api_client = SimulatedNodeApi(self.simulation, node.id)
+        return server
+
+
+class SimulatedRequest:
+    """
+    Stands in for a LobbyRequest: keeps the reply.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.response = None
+
+    def reply(self, response):
+        self.response = response
+
+
+class ScalingSimulation:
+
+    def __init__(self, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'), hours=24.0,
+                 shape=TraceShape.DIURNAL, teams_per_hour=20.0, team_size=4, session_minutes=60.0,
+                 crashes_per_node_hour=0.0, retry_interval=10.0, connect_delay=5.0, dealloc_delay=5.0,
+                 flap_window=900.0, seed=0, overrides=None, log=None):
+        """
+        :param config: config file to simulate. [POOL] backend is forced to simulated; [SIMULATED] sets the boot times
+        :param hours: simulated time, after the pool has come up
+        :param shape: how team arrivals are spread over the run (TraceShape)
+        :param teams_per_hour: mean team arrival rate
+        :param team_size: players per team
+        :param session_minutes: mean time a team stays (exponentially distributed)
+        :param crashes_per_node_hour: rate at which running nodes crash
+        :param retry_interval: seconds a player waits before asking the lobby again after "no capacity"
+        :param connect_delay: seconds from the lobby's answer to the player showing up on the server
+        :param dealloc_delay: seconds a node takes to move its players and stop Minecraft after a deallocate command
+        :param flap_window: a scaling action reversing the previous one within this many seconds is a flap
+        :param seed: seeds the players, the crashes, the pool's boot times and the scheduler's jitter
+        :param overrides: section -> {key: value} applied over config, e.g. {'LOAD': {'thresholdTeamsAvailable': 3}}
+        :param log: file the load balancer's output goes to (default: discarded)
+        """
+        settings = {section: dict(values) for section, values in SIMULATION_CONFIG.items()}
+        settings.setdefault('SIMULATED', {})['seed'] = seed
+        for section, values in (overrides or {}).items():
+            settings.setdefault(section, {}).update(values)
+        self.config_file = config_with_overrides(config, settings)
+
+        self.duration = hours * 3600
+        self.shape = shape
+        self.teams_per_hour = teams_per_hour
+        self.team_size = team_size
+        self.session = session_minutes * 60
+        self.crashes_per_node_hour = crashes_per_node_hour
+        self.retry_interval = retry_interval
+        self.connect_delay = connect_delay
+        self.dealloc_delay = dealloc_delay
+        self.flap_window = flap_window
+        self.rng = random.Random(seed)
+        self.owns_log = log is None             # close() closes the log only if it was opened here
+        self.log = log if log is not None else open(os.devnull, 'w')
+
+        self.clock = VirtualClock()
+        self.events = []                        # heap of (time, seq, callback)
+        self._seq = 0
+        self._events_lock = threading.Lock()    # deallocate commands can arrive from poll worker threads
+        self.rosters = collections.defaultdict(dict)    # node id -> {player uuid: name} online there
+        self.deallocated = set()                # nodes whose Minecraft server was shut down by a deallocate command
+        self.team_lookup = {}                   # player name -> team, what the teams API would return
+        self.players = {}                       # player uuid -> SimulatedPlayer
+        self.start = 0.0
+
+        self.pool = SimulatedPoolManager(self, self.config_file, self.clock)
+        self.backend = self.pool.batchclient
+        self.lb = LoadBalancerMain(config=self.config_file, clock=self.clock, pool=self.pool)
+        self.lb.scheduler.rng = random.Random(seed)
+
+        # Results
+        self.waits = []                         # seconds from asking the lobby to getting a server, per request episode
+        self.gave_up = 0                        # players whose team left before they got a server
+        self.requests = 0
+        self.rejected = 0
+        self.node_seconds = 0.0
+        self.peak_nodes = 0
+        self.actions = []                       # (time, nodes added (> 0) or retired (< 0)) of every scaling action
+        self.scale_outs = 0
+        self.nodes_added = 0
+        self.merge_rounds = 0
+        self.servers_retired = 0
+        self.players_moved = 0
+        self.crashes = 0
+        self.crash_removal_rounds = 0           # handle_active_state rounds that removed crashed servers
+        self.teams = 0
+        self._accounted_until = 0.0
+
+    # Events
+
+    def schedule(self, at, callback):
+        with self._events_lock:
+            self._seq += 1
+            heapq.heappush(self.events, (at, self._seq, callback))
+
+    def run(self):
+        """
+        Bring the pool up, then run hours of traffic.
+        :return: the report (see report())
+        """
+        began = time.monotonic()
+        try:
+            with contextlib.redirect_stdout(self.log):
+                if not self.lb.initialize(sleep=self.clock.sleep):
+                    raise RuntimeError("the simulated pool never became steady - check the [SIMULATED] boot times")
+                self.start = self._accounted_until = self.clock()
+                end = self.start + self.duration
+
+                for at in arrival_times(self.shape, self.duration, self.teams_per_hour / 3600, self.rng):
+                    self.schedule(self.start + at, self._team_arrives)
+                if self.crashes_per_node_hour > 0:
+                    self.schedule(self.start + CRASH_CHECK_INTERVAL, self._crash_check)
+
+                state = self.lb.state
+                while True:
+                    next_job = self.lb.scheduler.next_deadline()
+                    next_job = end if next_job is None else max(next_job, self.clock())
+                    next_event = self.events[0][0] if len(self.events) > 0 else end
+                    now = min(next_job, next_event)
+                    if now >= end:
+                        break
+                    self._account(now)
+                    self.clock.advance_to(now)
+                    while len(self.events) > 0 and self.events[0][0] <= now:
+                        with self._events_lock:
+                            callback = heapq.heappop(self.events)[2]
+                        callback()
+                    self._control_step()
+                    state = self._observe(state)
+                self._account(end)
+                self.clock.advance_to(end)
+        finally:
+            self.close()
+        return self.report(time.monotonic() - began)
+
+    def close(self):
+        """
+        Remove the temporary config file and close the log if the simulation opened it. run() does this on its way out.
+        """
+        if os.path.exists(self.config_file):
+            os.remove(self.config_file)
+        if self.owns_log:
+            self.log.close()
+
+    def _control_step(self):
+        """
+        What the control plane thread would do now: run due jobs, then every command the lobby path submitted.
+        """
+        control = self.lb.control
+        control.step()
+        while True:
+            commands = control.drain()
+            if len(commands) == 0:
+                return
+            control.step(commands)
+
+    def _account(self, now):
+        # Nodes are paid for from the resize that adds them until they have left the pool
+        nodes = len(self.backend.nodes)
+        self.node_seconds += nodes * (now - self._accounted_until)
+        self.peak_nodes = max(self.peak_nodes, nodes)
+        self._accounted_until = now
+
+    def _observe(self, previous):
+        """
+        Count the load balancer's scaling actions from its state changes.
+        """
+        state = self.lb.state
+        if state == previous:
+            return state
+        now = self.clock() - self.start
+        if state == LoadBalancerMain.State.INCREASING:
+            decisions = self.lb.scaling.decisions()
+            added = decisions[-1].delta if len(decisions) > 0 and decisions[-1].delta > 0 else 1
+            self.scale_outs += 1
+            self.nodes_added += added
+            self._action(now, added)
+        elif state == LoadBalancerMain.State.DECREASING:
+            retired = len(self.lb.deallocation_targets)
+            self.merge_rounds += 1
+            self.servers_retired += retired
+            self._action(now, -retired)
+        elif state == LoadBalancerMain.State.WAIT_FOR_REMOVAL and previous != LoadBalancerMain.State.TRIGGER_REMOVAL:
+            self.crash_removal_rounds += 1
+        return state
+
+    def _action(self, now, delta):
+        self.actions.append((now, delta))
+
+    def flaps(self):
+        """
+        :return: scaling actions that reversed the previous action within flap_window seconds
+        """
+        count = 0
+        for (before, previous), (at, delta) in zip(self.actions, self.actions[1:]):
+            if (previous > 0) != (delta > 0) and at - before <= self.flap_window:
+                count += 1
+        return count
+
+    # Players
+
+    def _team_arrives(self):
+        self.teams += 1
+        team = f"team{self.teams}"
+        now = self.clock()
+        members = []
+        for i in range(self.team_size):
+            player = SimulatedPlayer(str(uuid.UUID(int=self.rng.getrandbits(128))), f"{team}-player{i}", team)
+            self.players[player.id] = player
+            self.team_lookup[player.name.lower()] = team
+            members.append(player)
+            self.schedule(now + self.rng.uniform(0, 30), lambda p=player: self._ask_lobby(p))
+        self.schedule(now + self.rng.expovariate(1 / self.session), lambda: self._team_leaves(members))
+
+    def _team_leaves(self, members):
+        now = self.clock()
+        for player in members:
+            player.gone = True
+            if player.node is not None:
+                self.rosters[player.node].pop(player.id, None)
+                player.node = None
+            if player.waiting_since is not None:
+                self.waits.append(now - player.waiting_since)
+                self.gave_up += 1
+            self.team_lookup.pop(player.name.lower(), None)
+            del self.players[player.id]
+
+    def _ask_lobby(self, player: SimulatedPlayer):
+        """
+        get_server_for_team through the load balancer's lobby path, as its main loop would answer it.
+        """
+        if player.gone:
+            return
+        now = self.clock()
+        if player.waiting_since is None:
+            player.waiting_since = now
+        self.requests += 1
+        reply = None
+        if self.lb.state != LoadBalancerMain.State.STARTING:
+            request = SimulatedRequest(json.dumps({"command": "get_server_for_team", "playeruuid": player.id,
+                                                   "playerteam": player.team}))
+            self.lb.handle_lobby_request(request)
+            reply = json.loads(request.response)
+        node_id = self.node_at_port(reply['PORT']) if reply is not None and reply['IP'] != "None" else None
+        if node_id is None:
+            self.rejected += 1
+            self.schedule(now + self.retry_interval, lambda: self._ask_lobby(player))
+            return
+        self.waits.append(now - player.waiting_since)
+        player.waiting_since = None
+        self.schedule(now + self.connect_delay, lambda: self._join(player, node_id))
+
+    def _join(self, player: SimulatedPlayer, node_id):
+        if player.gone:
+            return
+        if not self.mc_up(node_id):
+            self._ask_lobby(player)     # The server went away while they were connecting
+            return
+        self.rosters[node_id][player.id] = player.name
+        player.node = node_id
+
+    def _disconnect(self, node_id):
+        """
+        Everyone on the node is kicked back to the lobby.
+        """
+        for player_id in list(self.rosters.pop(node_id, {}).keys()):
+            player = self.players.get(player_id)
+            if player is not None:
+                player.node = None
+                self.schedule(self.clock() + self.connect_delay, lambda p=player: self._ask_lobby(p))
+
+    # Nodes
+
+    def mc_up(self, node_id):
+        return node_id not in self.deallocated and self.backend.server_up(node_id)
+
+    def node_running(self, node_id):
+        node = self.backend.nodes.get(node_id)
+        return node is not None and node.state == NodeState.running
+
+    def node_at_port(self, port):
+        for node_id in list(self.backend.nodes.keys()):
+            if self.backend.endpoints(node_id)[1] == int(port):
+                return node_id
+        return None
+
+    def node_command(self, node_id, msg):
+        """
+        :return: what MCServerMain on the node would answer
+        :raises ConnectionRefusedError: if the node (and so its API) is down
+        """
+        if not self.node_running(node_id):
+            raise ConnectionRefusedError(f"{node_id}: node API is down")
+        line = msg.lower()
+        up = self.mc_up(node_id)
+        if line.strip() == MCCommands.PLAYERS.value:
+            if not up:
+                return "Err: Server is not alive"
+            roster = dict(self.rosters[node_id])
+            return json.dumps({"online": len(roster), "players": roster})
+        if MCCommands.SUBSCRIBE.value in line:
+            return "Heartbeats On"
+        if MCCommands.HELLO.value in line:
+            return "I am awake"
+        if MCCommands.MCALIVE.value in line or MCCommands.MCSTATUS.value in line:
+            return "Server is Up!" if up else "Err: Server is not alive"
+        if MCCommands.DEALLOCATE.value in line:
+            if not up:
+                return "Err: Server is not active"
+            target = re.search(r'"port":\s*(\d+)', line)
+            target_port = int(target.group(1)) if target else None
+            self.schedule(self.clock() + self.dealloc_delay, lambda: self._deallocate(node_id, target_port))
+            return "Deallocating Server"
+        if MCCommands.PASSMSG.value in line:
+            return "Sent message to server" if up else "Error: Server is not active!"
+        return "Err: Unknown Command"
+
+    def _deallocate(self, node_id, target_port):
+        """
+        The node moves its players to the target server (or back to the lobby) and stops Minecraft.
+        """
+        target = self.node_at_port(target_port) if target_port is not None else None
+        roster = self.rosters.pop(node_id, {})
+        self.deallocated.add(node_id)
+        for player_id in roster.keys():
+            player = self.players.get(player_id)
+            if player is None:
+                continue
+            if target is not None and self.mc_up(target):
+                self.rosters[target][player_id] = player.name
+                player.node = target
+                self.players_moved += 1
+            else:
+                player.node = None
+                self.schedule(self.clock() + self.connect_delay, lambda p=player: self._ask_lobby(p))
+
+    def _crash_check(self):
+        chance = self.crashes_per_node_hour * CRASH_CHECK_INTERVAL / 3600
+        for node_id in list(self.backend.nodes.keys()):
+            if self.node_running(node_id) and node_id not in self.deallocated and self.rng.random() < chance:
+                self.crashes += 1
+                self.backend.fail_node(node_id)
+                self._disconnect(node_id)
+        self.schedule(self.clock() + CRASH_CHECK_INTERVAL, self._crash_check)
+
+    # Results
+
+    def report(self, wall_seconds=0.0):
+        waits = sorted(self.waits)
+        waited = [wait for wait in waits if wait > 0]
+        return {
+            "simulated_hours": round(self.duration / 3600, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "teams": self.teams,
+            "lobby_requests": self.requests,
+            "no_capacity_replies": self.rejected,
+            "players_waited": len(waited),
+            "players_gave_up": self.gave_up,
+            "wait_mean_s": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_p95_s": round(percentile(waits, 95) or 0.0, 1),
+            "wait_max_s": round(waits[-1], 1) if waits else 0.0,
+            "wait_player_hours": round(sum(waits) / 3600, 2),
+            "node_hours": round(self.node_seconds / 3600, 2),
+            "peak_nodes": self.peak_nodes,
+            "scale_outs": self.scale_outs,
+            "nodes_added": self.nodes_added,
+            "merge_rounds": self.merge_rounds,
+            "servers_retired": self.servers_retired,
+            "players_moved": self.players_moved,
+            "flaps": self.flaps(),
+            "crashes": self.crashes,
+            "crash_removal_rounds": self.crash_removal_rounds,
+        }
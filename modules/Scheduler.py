@@ -0,0 +1,135 @@
+import time
+import random
+import traceback
+
+
+class Scheduler:
+    """
+    Runs periodic jobs against monotonic deadlines.
+
+    - Deadlines come from time.monotonic() (or the injected clock), so wall clock jumps don't matter.
+    - Missed ticks are coalesced: if a job (or the loop) ran long and several deadlines passed, the job runs once
+      and its next deadline is the first one still in the future - it never runs back to back to "catch up".
+    - Each run is offset by a random jitter (a fraction of the interval) so jobs with the same interval don't
+      all land on the same tick. The jitter does not accumulate: it is applied around a fixed base schedule.
+
+    The Scheduler does not own a thread. The owner asks time_until_next() how long it may sleep and calls
+    run_pending() when it wakes up.
+    """
+
+    class Job:
+
+        def __init__(self, name, interval, callback, jitter=0.0):
+            self.name = name
+            self.interval = interval
+            self.callback = callback
+            self.jitter = jitter
+            self.base = 0.0             # un-jittered deadline
+            self.deadline = 0.0         # when the job should next run
+            self.runs = 0
+            self.missed = 0             # ticks coalesced away because we ran late
+            self.last_run = None
+            self.last_duration = 0.0
+
+    def __init__(self, clock=time.monotonic, rng=None):
+        """
+        :param clock: function returning the current time in seconds. Must never go backwards.
+        :param rng: random.Random used for jitter. Defaults to a new, unseeded instance.
+        """
+        self.clock = clock
+        self.rng = rng if rng is not None else random.Random()
+        self.jobs = {}
+
+    def add_job(self, name, interval, callback, jitter=0.0, first_delay=None):
+        """
+        Register a periodic job.
+        :param name: unique name of the job
+        :param interval: seconds between runs
+        :param callback: function taking no arguments
+        :param jitter: fraction of the interval (0 - 0.5) each run may be moved earlier or later by
+        :param first_delay: seconds until the first run. Defaults to one interval.
+        :return: the Job
+        """
+        job = Scheduler.Job(name, float(interval), callback, min(max(float(jitter), 0.0), 0.5))
+        job.base = self.clock() + (job.interval if first_delay is None else first_delay)
+        job.deadline = self._jittered(job)
+        self.jobs[name] = job
+        return job
+
+    def remove_job(self, name):
+        self.jobs.pop(name, None)
+
+    def _jittered(self, job):
+        if job.jitter <= 0:
+            return job.base
+        return job.base + self.rng.uniform(-job.jitter, job.jitter) * job.interval
+
+    def interval(self, name):
+        return self.jobs[name].interval
+
+    def delay(self, name, seconds):
+        """
+        Push a job's next run back by some seconds (e.g. to give Azure time to notice a change we just requested).
+        """
+        job = self.jobs.get(name)
+        if job is not None:
+            job.base += seconds
+            job.deadline += seconds
+
+    def run_now(self, name):
+        """
+        Make a job due immediately. Its schedule continues from now.
+        """
+        job = self.jobs.get(name)
+        if job is not None:
+            job.base = job.deadline = self.clock()
+
+    def next_deadline(self):
+        """
+        :return: clock() time the next job is due at, or None if there are no jobs.
+        """
+        if not self.jobs:
+            return None
+        return min(job.deadline for job in self.jobs.values())
+
+    def time_until_next(self):
+        """
+        :return: seconds until the next job is due (0 if one is overdue), or None if there are no jobs.
+        """
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        return max(deadline - self.clock(), 0)
+
+    def run_pending(self):
+        """
+        Run every job whose deadline has passed, earliest deadline first.
+        An exception in one job is printed and does not stop the others.
+        :return: list of names of the jobs that ran
+        """
+        now = self.clock()
+        due = sorted((job for job in self.jobs.values() if job.deadline <= now), key=lambda j: j.deadline)
+        ran = []
+        for job in due:
+            if self.jobs.get(job.name) is not job:
+                continue    # removed by an earlier job
+            start = self.clock()
+            try:
+                job.callback()
+            except Exception as e:
+                print(f"Err: scheduled job {job.name} failed: {e}")
+                traceback.print_exc()
+            end = self.clock()
+            job.runs += 1
+            job.last_run = start
+            job.last_duration = end - start
+
+            # Coalesce missed ticks: skip every deadline that passed while the job (or the loop) was busy.
+            job.base += job.interval
+            if job.base <= end:
+                missed = int((end - job.base) // job.interval) + 1
+                job.missed += missed
+                job.base += missed * job.interval
+            job.deadline = self._jittered(job)
+            ran.append(job.name)
+        return ran
@@ -1,22 +1,32 @@
 from enum import Enum
 import datetime
 from mcstatus import MinecraftServer
+from mcstatus.pinger import ServerPinger
+from mcstatus.protocol.connection import TCPSocketConnection
 from socket import timeout
 import configparser
 import socket
 from functools import total_ordering
+from typing import NamedTuple
 from modules.comms.LoadBalancerToMCMain import LBFormattedMsg
+from modules.comms.NodeClient import NodeClient, shared_executor
+from modules.Reservations import ReservationTable
+from modules.FailureDetector import PhiAccrualDetector, thresholds_from_config
+from modules.Roster import RosterSource
 from main.MCServerMain import CommandSet as MCCommands
 import os
 from root import *
 import threading
+import json
+import time
 
 """
 Holds a server object and can run the main() function for the server object
 """
 class Server:
 
-    def __init__(self, ip, port, api_port, node_id, api_player_team=None, reattach = False, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg')):
+    def __init__(self, ip, port, api_port, node_id, api_player_team=None, reattach = False, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'),
+                 clock=time.monotonic):
         if api_player_team is None:
             api_player_team = {}
         self.ip = ip
@@ -25,21 +35,46 @@ class Server:
         self.node_id = node_id
         self.config = configparser.ConfigParser()
         self.config.read(config)
+        self.clock = clock              # time source, for tests and simulation
         self.id = f"{self.ip}:{self.port}"
         self.teams = []
         self.players = []
         self.player_team = {}
+        self.players_joined = {}        # player -> team, since the last drain_player_changes()
+        self.players_left = set()
+        self.player_changes_lock = threading.Lock()     # roster changes vs drain_player_changes()
         self.master_player_team_map = api_player_team
+        # Players routed here hold their slot until a poll sees them online or the lease runs out.
+        self.reservations = ReservationTable(float(self.config.get('LOAD', 'playerReservationTTL', fallback=120)),
+                                             clock=clock)
         self.playercount = 0
+        self.hidden_players = 0         # players online that the last roster couldn't name (a capped status sample)
         if not reattach:
             self.state = Server.State.INITIALIZING
         else:
             self.state = Server.State.STABLE
-        self.last_request_time = None
-
-        self.countfailures = 0
-        self.maxFailsBeforeDown = 13
-        self.mcServer = MinecraftServer(self.ip, self.port)
+        self.last_request_time = None   # clock() when the deallocation was requested
+
+        self.countfailures = 0          # consecutive failed polls, for the logs
+        self.pollTimeout = float(self.config.get('LOAD', 'pollTimeoutPerServer', fallback=3))
+        # Liveness: every successful poll or heartbeat is an arrival; the node is marked CRASHED once the phi
+        # suspicion level reaches the threshold for its state (see modules/FailureDetector.py)
+        self.pollInterval = float(self.config.get('LOAD', 'secondsBetweenMCPoll', fallback=35))
+        self.phiThresholds = thresholds_from_config(self.config)
+        self.liveness = PhiAccrualDetector(
+            self.pollInterval if reattach else float(self.config.get('LOAD', 'failureBootInterval', fallback=300)),
+            window=int(self.config.get('LOAD', 'failureWindowSize', fallback=100)),
+            min_std_dev=float(self.config.get('LOAD', 'failureMinStdDev', fallback=5)),
+            acceptable_pause=float(self.config.get('LOAD', 'failureAcceptablePause', fallback=10)),
+            clock=clock)
+        self.statusTries = int(self.config.get('LOAD', 'pollStatusTries', fallback=10))
+        self.rosterSource = RosterSource(self.config.get('LOAD', 'rosterSource', fallback=RosterSource.NODE.value))
+        self.mcServer = TimedMinecraftServer(self.ip, self.port, self.pollTimeout)
+        # Persistent connections to the node's API, sharing one bounded worker pool with every other Server
+        self.api_client = NodeClient(self.ip, self.api,
+                                     connect_timeout=self.pollTimeout,
+                                     request_timeout=float(self.config.get('LOAD', 'nodeApiRequestTimeout', fallback=10)),
+                                     executor=shared_executor(int(self.config.get('LOAD', 'nodeApiWorkers', fallback=16))))
 
     def __hash__(self):
         return self.node_id.__hash__()
@@ -62,13 +97,6 @@ class Server:
         else:
             return False
 
-    def eligible_for_new_teams(self):
-        if self.state == Server.State.STABLE and len(self.teams) < int(self.config.get('SERVER', 'maxTeamsPerServer')):
-            return True
-        else:
-            return False
-
-
     def is_ready(self):
         if self.state < Server.State.STABLE:
             return False
@@ -76,39 +104,47 @@ class Server:
 
     def _is_mc_alive(self):
         #  Check to see if the server is up yet:
-        # srv = MinecraftServer(self.ip, self.port)
-        stat = ""
+        status, _ = self._check_status()
+        self._record_status(status)
+        return status == StatusCheck.ANSWERED
+
+    def _check_status(self, tries=None):
+        """
+        Ask the Minecraft server for its status. Doesn't change this Server - see _record_status().
+        :param tries: status attempts (default: mcstatus' own)
+        :return: (StatusCheck, the status response if ANSWERED)
+        """
+        stat = None
         try:
-            stat = self.mcServer.status()
+            stat = self.mcServer.status() if tries is None else self.mcServer.status(tries=tries)
             if len(stat.raw) > 0:
-                self.countfailures = 0
-                return True
-            # if (stat.raw['players']['online'] >= 0):
-            #     self.countfailures = 0
-            #     return True
-                # Continue onwards and update the player lists!
+                return StatusCheck.ANSWERED, stat
+            print(f"Empty status response from {self.id}")
+            return StatusCheck.MALFORMED, None
         except timeout:
-            # The Server is not up yet.
-            print(f"[IsAlive]Server can't be accessed yet")
-            self.countfailures += 1
-
+            # The Server is not up (yet).
+            print(f"Err: Status timed out - is {self.id} down?")
+            return StatusCheck.DOWN, None
+        except ConnectionRefusedError:
+            print(f"Err: Connection Refused: {self.id}")
+            return StatusCheck.DOWN, None
         except KeyError:
             # The status return doesn't have a players or online segment
-            print(f"Something weird with Status response: {stat.raw}")
-
-        except ConnectionRefusedError:
-            print(f"Err: Connection Refused? Is Alive {self.ip}:{self.port}")
-            self.countfailures += 1
-
-        except OSError:
-            print(f"Err: OS Error - no response: {self.ip}:{self.port}")
-            self.countfailures += 1
-
+            print(f"Something weird with Status response: {stat.raw if stat is not None else stat}")
+            return StatusCheck.MALFORMED, None
         except Exception as e:
             print(f"Err: Something else happened:{self.ip}:{self.port} \n {e}")
-            self.countfailures += 1
+            return StatusCheck.FAILED, None
 
-        return False
+    def _record_status(self, status):
+        """
+        Count a status check towards the failure detector: an answer is an arrival, no answer a failed poll.
+        """
+        if status == StatusCheck.ANSWERED:
+            self.countfailures = 0
+            self.liveness.heartbeat()
+        elif status in [StatusCheck.DOWN, StatusCheck.FAILED]:
+            self.countfailures += 1
 
     def _get_team_for_player(self, playerName):
         if self.master_player_team_map is not None:
@@ -117,206 +153,264 @@ class Server:
         return -1
 
     def poll(self):
+        """
+        Poll the node and update this server from its answer: probe() then apply_poll().
+        """
+        self.apply_poll(self.probe())
+
+    def probe(self):
+        """
+        The network half of poll(): ask the node how it is doing without changing this Server. The PoolManager runs
+        probes on worker threads and applies their results on the control thread, so a slow poll never races routing
+        or a merge for the server's state and roster.
+        :return: PollResult
+        """
+        state = self.state
         print(f"{datetime.datetime.now()} Running Poll: {self.id}")
-        if self.state == Server.State.INITIALIZING:
-            #  Check to see if the server is up yet:
-            if self._is_mc_alive():
-                self.state = Server.State.STABLE
-            elif self.countfailures > self.maxFailsBeforeDown*2:
-                self.state = Server.State.CRASHED
+        if state in [Server.State.INITIALIZING, Server.State.CRASHED]:
+            if state == Server.State.CRASHED:
+                print(f"This server is crashed! {self.id} - is it back up?")
+            status, _ = self._check_status()
+            return PollResult(state, status)
+
+        if state in [Server.State.STABLE, Server.State.WAITING_FOR_MERGE, Server.State.STABLE_BUT_TASK_FAILED]:
+            api_up = None
+            if state == Server.State.STABLE_BUT_TASK_FAILED:
+                # Ping the API port to see if its back up!
+                api_up = self._check_api()
+                status, stat = self._check_status()
+            else:
+                status, stat = self._check_status(tries=self.statusTries)
+            if status != StatusCheck.ANSWERED:
+                return PollResult(state, status, api_up=api_up)
+            online, playersdetected = self._roster_from_status(stat)
+            if api_up is None:
+                api_up = self._check_api()
+            return PollResult(state, status, online, playersdetected, api_up)
+
+        if state == Server.State.CONFIRMING_DEACTIVATION:
+            status, stat = self._check_status()
+            return PollResult(state, status, stat.players.online if status == StatusCheck.ANSWERED else 0)
+
+        return PollResult(state)
+
+    def apply_poll(self, result):
+        """
+        The control thread half of poll(): update state, roster and failure detector from what probe() found.
+        A result is dropped if the server changed state while it was being probed - it describes a server that no
+        longer exists.
+        :param result: PollResult
+        """
+        if result.state != self.state:
+            print(f"{self.id} went from {result.state.name} to {self.state.name} during its poll - result dropped")
             return
 
-        if self.state == Server.State.STABLE or self.state == Server.State.WAITING_FOR_MERGE:
-            # Check if the server is still up. Update the active player lists
-            # srv = MinecraftServer(self.ip, self.port)
-            stat = ""
-            try:
-                stat = self.mcServer.status(tries=10)
-
-                self.playercount = stat.players.online
-                playersdetected = {}
-                if stat.players.sample is not None:
-                    for player in stat.players.sample:
-                        playersdetected.update({player.id: player.name})
-
-                # Update player and team arrays
-                self.player_team = {player: team for player, team in self.player_team.items() if player in playersdetected.keys()}
-
-                if len(self.player_team) < len(playersdetected):
-                    players_to_search = {player: name for player, name in playersdetected.items() if player not in self.player_team}
-                    for player, name in players_to_search.items():
-                        team2 = self._get_team_for_player(name)
-                        self.player_team.update({player: team2})
-
-
-                self.players = list(self.player_team.keys())
-                self.playercount = len(self.players)
-                self.teams = list(set(self.player_team.values()))
-                self.countfailures = 0
-
-                self.check_is_server_api_alive()
-
-                return
-
-            except timeout:
-                # The Server is not up yet.
-                print(f"Error! Is Server Down?")
-                self.countfailures += 1
-                # self.state = Server.State.CRASHED
-
-            except ConnectionRefusedError:
-                print(f"Err: Connection Refused - state STABLE? {self.ip}:{self.port}")
-                self.countfailures += 1
-                # self.state = Server.State.CRASHED
-
-            except KeyError:
-                # The status return doesn't have a players or online segment
-                print(f"Something weird with Status response: {stat.raw}")
-                # self.countfailures += 1
-
-            except Exception as e:
-                print(f"Something else went wrong... {e}")
-                self.countfailures += 1
-
-            if self.countfailures > self.maxFailsBeforeDown:
+        if self.state in [Server.State.INITIALIZING, Server.State.CRASHED]:
+            self._record_status(result.status)
+            if result.status == StatusCheck.ANSWERED:
+                self._recovered()
+            elif self.state == Server.State.INITIALIZING and self._suspected():
                 self.state = Server.State.CRASHED
             return
 
-        if self.state == Server.State.STABLE_BUT_TASK_FAILED:
-            # Ping the API port to see if its back up!
-            self.check_is_server_api_alive()
-
-            stat = ""
-            try:
-                stat = self.mcServer.status()
-
-                self.playercount = stat.players.online
-                playersdetected = {}
-                if stat.players.sample is not None:
-                    for player in stat.players.sample:
-                        playersdetected.update({player.id: player.name})
-
-                # Update player and team arrays
-                self.player_team = {player: team for player, team in self.player_team.items() if
-                                    player in playersdetected.keys()}
-
-                if len(self.player_team) < len(playersdetected):
-                    players_to_search = {player: name for player, name in playersdetected.items() if
-                                         player not in self.player_team}
-                    for player, name in players_to_search.items():
-                        team = self._get_team_for_player(name)
-                        self.player_team.update({player: team})
-
-                self.players = list(self.player_team.keys())
-                self.playercount = len(self.players)
-                self.teams = list(set(self.player_team.values()))
-                self.countfailures = 0
-
-                return
-
-            except timeout:
-                # The Server is not up yet.
-                print(f"Error! Is Server Down?")
-                self.countfailures += 1
-                # self.state = Server.State.CRASHED
-                # return
-            except ConnectionRefusedError:
-                print(f"Err: Connection Refused? - Stable failed task {self.ip}:{self.port}")
-                self.countfailures += 1
-                # self.state = Server.State.CRASHED
-                # return False
-            except KeyError:
-                # The status return doesn't have a players or online segment
-                print(f"Something weird with Status response: {stat.raw}")
-
-            except Exception as e:
-                print(f"Something else went wrong... {e}")
-                self.countfailures += 1
-                # return
-
-            if self.countfailures > self.maxFailsBeforeDown:
+        if self.state in [Server.State.STABLE, Server.State.WAITING_FOR_MERGE, Server.State.STABLE_BUT_TASK_FAILED]:
+            self._apply_api_check(result.api_up)
+            if result.status == StatusCheck.ANSWERED:
+                self._update_roster(result.players, result.online)
+            self._record_status(result.status)
+            if result.status != StatusCheck.ANSWERED and self._suspected():
                 self.state = Server.State.CRASHED
             return
 
         if self.state == Server.State.REQUESTED_DEACTIVATION:
             max_seconds_raw = self.config.get('SERVER', 'maxRequestProcessTime')
             max_seconds = int(max_seconds_raw) if max_seconds_raw and max_seconds_raw.isdecimal() else 600
-            delta = datetime.timedelta(seconds=max_seconds)
-            if delta < (datetime.datetime.now() - self.last_request_time):
+            if self.clock() - self.last_request_time > max_seconds:
                 print("enough time has passed! We should now check to see if the server is behaving")
                 self.state = Server.State.CONFIRMING_DEACTIVATION
 
             return
 
         if self.state == Server.State.CONFIRMING_DEACTIVATION:
-
-            # srv = MinecraftServer(self.ip, self.port)
-            stat = ""
-            try:
-                stat = self.mcServer.status()
-                if stat.players.online > 0:
-                    print(f"Error: Something went wrong with {self.id}. Should we re-send the request? {stat.raw}")
-                    # TODO: Resend the deactivation request.
-                    return
-                else:
-                    self.state = Server.State.DEACTIVATED       # No players online
-            except timeout:
-                # The Server is down
+            if result.status == StatusCheck.ANSWERED and result.online > 0:
+                print(f"Error: Something went wrong with {self.id}. Should we re-send the request? {result.online} "
+                      f"players online")
+                # TODO: Resend the deactivation request.
+            elif result.status in [StatusCheck.ANSWERED, StatusCheck.DOWN]:
+                # No players online, or the server is down
                 print(f"Server {self.id} has been deactivated")
                 self.state = Server.State.DEACTIVATED
-                return
-            except ConnectionRefusedError:
-                print(f"Server {self.id} has been deactivated")
-                self.state = Server.State.DEACTIVATED
-                return
-            except KeyError:
-                # The server isn't down, but the status return doesn't have a players or online segment
-                print(f"Something weird with Status response: {stat.raw}")
-                return
-            except Exception as e:
-                print(f"Something else went wrong: {e}")
-                return
-
-        if self.state == Server.State.CRASHED:
-            print(f"This server is crashed! {self.id} - is it back up?")
-            if self._is_mc_alive():
-                self.state = Server.State.STABLE
-            # TODO: Send msg to restart the server.
             return
 
         else:
             print(f"This server has been deactivated! Please don't run  me anymore!")
             return
 
-    def check_is_server_api_alive(self):
-        ## Ping the API port to confirm it is available!
+    def _roster_from_status(self, stat):
+        """
+        The status sample is capped at a few players. When it is partial, ask the node agent for the full list
+        (Minecraft Query on the node, see modules/Roster.py) - if rosterSource allows it and the node supports it.
+        :return: (players online, {player uuid: player name})
+        """
+        online = stat.players.online
+        playersdetected = {player.id: player.name for player in (stat.players.sample or [])}
+        if self.rosterSource != RosterSource.NODE or online <= len(playersdetected):
+            return online, playersdetected
+        try:
+            reply = json.loads(self.send_msg_to_server(LBFormattedMsg(MCCommands.PLAYERS)))
+            return reply['online'], reply['players']
+        except (ValueError, KeyError, TypeError):
+            print(f"{self.id}: node didn't send a player list - using the status sample")
+        except Exception as e:
+            print(f"Err: unable to get the player list from {self.id}: {e}")
+        return online, playersdetected
+
+    def _update_roster(self, playersdetected, online=None):
+        """
+        Update player and team arrays from the players a status check found online.
+        :param playersdetected: player uuid -> player name
+        :param online: players online according to the server. If more than playersdetected (a partial sample), the
+                       players we can't see still count towards playercount.
+        """
+        player_team = {player: team for player, team in self.player_team.items() if player in playersdetected.keys()}
+
+        if len(player_team) < len(playersdetected):
+            players_to_search = {player: name for player, name in playersdetected.items() if player not in player_team}
+            for player, name in players_to_search.items():
+                team = self._get_team_for_player(name)
+                player_team.update({player: team})
+
+        self._keep_reserved_players(player_team)
+        self._set_player_team(player_team)
+        self.hidden_players = max((online or 0) - len(playersdetected), 0)
+        self.playercount = len(self.players) + self.hidden_players
+
+    def accepts_heartbeats(self):
+        """
+        States where a node heartbeat replaces a pull poll. Other states are driven by the load balancer
+        (deactivation) or mean the node's API is down (STABLE_BUT_TASK_FAILED), so they are always polled.
+        """
+        return self.state in [Server.State.INITIALIZING, Server.State.STABLE, Server.State.WAITING_FOR_MERGE,
+                              Server.State.CRASHED]
+
+    def apply_heartbeat(self, heartbeat):
+        """
+        Update this server from a heartbeat pushed by its node (see modules/comms/Heartbeat.py) - the push
+        equivalent of poll() for the states heartbeats cover (INITIALIZING, STABLE, WAITING_FOR_MERGE, CRASHED).
+        :param heartbeat: dict with state, mc_up, online and players (uuid -> name)
+        :return: False if the heartbeat can't stand in for a poll in the current state
+        """
+        if not self.accepts_heartbeats():
+            return False
+        if not heartbeat.get('mc_up'):
+            # Counts as a failed poll, not a crash: one failed status check on the node (or the nightly relaunch)
+            # mustn't evict it. The failure detector decides once the node has stayed down long enough.
+            if self.state != Server.State.CRASHED:
+                print(f"Node {self.id} reports Minecraft is down")
+                self.countfailures += 1
+                if self._suspected():
+                    self.state = Server.State.CRASHED
+            return True
+
+        if self.state in [Server.State.INITIALIZING, Server.State.CRASHED]:
+            self._recovered()
+        else:
+            self.liveness.heartbeat()
+        self.countfailures = 0
+        self._update_roster(heartbeat.get('players') or {}, heartbeat.get('online'))
+        return True
+
+    def _recovered(self):
+        """
+        The node came up (or back): mark it STABLE and restart its failure detector, so the boot or the outage
+        doesn't count as one very long interval.
+        """
+        self.state = Server.State.STABLE
+        self.liveness.reset(self.pollInterval)
+
+    def _suspected(self):
+        """
+        Called after a failed poll.
+        :return: True if the node has been silent long enough, given how regularly it usually answers, to be declared
+                 CRASHED in its current state
+        """
+        threshold = self.phiThresholds.get(self.state.name)
+        if threshold is None:
+            return False
+        phi = self.liveness.phi()
+        print(f"{self.id}: {self.countfailures} failed polls, {self.liveness.since_last():.0f}s silent, phi={phi:.2f} "
+              f"(crashed at {threshold})")
+        return phi >= threshold
+
+    def _check_api(self):
+        """
+        Ping the API port to confirm it is available!
+        :return: True if the node's API answered, False if it refused the connection, None if that's unclear
+        """
         try:
             check_val = self.send_msg_to_server(LBFormattedMsg(MCCommands.HELLO))
             if check_val is not None and len(check_val) > 0:
-                if self.state == Server.State.STABLE_BUT_TASK_FAILED:
-                    print("yay! I'm back alive")
-                    self.state = Server.State.STABLE
-
                 return True
-
-        except ConnectionRefusedError as e:
-            if self.state == Server.State.STABLE:
-                print("error - unable to connect to API. Please restart me!")
-                self.state = Server.State.STABLE_BUT_TASK_FAILED
+        except ConnectionRefusedError:
+            return False
         except Exception as e:
-            print("General Error " + e)
+            print(f"General Error {e}")
+        return None
 
-        return False
+    def _apply_api_check(self, api_up):
+        if api_up and self.state == Server.State.STABLE_BUT_TASK_FAILED:
+            print("yay! I'm back alive")
+            self.state = Server.State.STABLE
+        elif api_up is False and self.state == Server.State.STABLE:
+            print("error - unable to connect to API. Please restart me!")
+            self.state = Server.State.STABLE_BUT_TASK_FAILED
 
 
     def add_player(self, playerUUID, teamID):
         # Send msg to server?
         # self.teams.append(teamID)
         # self.players.append(playerUUID)
-        self.player_team.update({playerUUID: teamID})
-        self.players = list(self.player_team.keys())
-        self.teams = list(set(self.player_team.values()))
-        self.playercount += 1
+        self.reservations.reserve(playerUUID, teamID)
+        player_team = dict(self.player_team)
+        player_team.update({playerUUID: teamID})
+        self._set_player_team(player_team)
+        self.playercount = len(self.players) + self.hidden_players
+
+    def _keep_reserved_players(self, player_team):
+        """
+        Confirm the leases of players the poll found online, and keep players whose lease is still running in the
+        roster so their slot (and their team's) isn't given away before they finish connecting.
+        :param player_team: player -> team detected by the poll. Updated in place.
+        """
+        self.reservations.confirm(player_team.keys())
+        for player, team in self.reservations.active().items():
+            player_team.setdefault(player, team)
+
+    def _set_player_team(self, player_team):
+        """
+        Replace the player -> team map (and the players/teams lists derived from it), recording who joined and left
+        so the PoolManager can update its player index from the diff. See drain_player_changes().
+        """
+        with self.player_changes_lock:
+            for player in self.player_team.keys() - player_team.keys():
+                self.players_joined.pop(player, None)
+                self.players_left.add(player)
+            for player, team in player_team.items():
+                if self.player_team.get(player) != team:
+                    self.players_left.discard(player)
+                    self.players_joined[player] = team
+            self.player_team = player_team
+            self.players = list(player_team.keys())
+            self.teams = list(set(player_team.values()))
+
+    def drain_player_changes(self):
+        """
+        :return: (joined, left) since the last call - joined is a dict of player -> team, left a set of players.
+        """
+        with self.player_changes_lock:
+            joined, left = self.players_joined, self.players_left
+            self.players_joined, self.players_left = {}, set()
+        return joined, left
 
     def decommission(self, newServer =None):
         if self.state != Server.State.STABLE:      # Cannot call decommission on a transitioning server.
@@ -331,7 +425,7 @@ class Server:
         if newServer is not None:
             newServer.state = Server.State.WAITING_FOR_MERGE
             self.state = Server.State.REQUESTED_DEACTIVATION
-            self.last_request_time = datetime.datetime.now()
+            self.last_request_time = self.clock()
             print("Transitioning Players to a new server")
             msg = LBFormattedMsg(MCCommands.DEALLOCATE, f'{{"IP":"{newServer.ip}", "PORT":{newServer.port}}}')
             self.send_msg_threaded_to_server(msg)
@@ -340,35 +434,30 @@ class Server:
         else:
             print("Decommissioning this server")
             self.state = Server.State.CONFIRMING_DEACTIVATION # No need to wait! Skip to the fun parts!
-            self.last_request_time = datetime.datetime.now()
+            self.last_request_time = self.clock()
             msg = LBFormattedMsg(MCCommands.DEALLOCATE, "test Dealloc")
             self.send_msg_threaded_to_server(msg)
             #  noTODO: send msg to server
 
     def send_msg_threaded_to_server(self, msg: LBFormattedMsg):
-
-        thread = threading.Thread(target=self.send_msg_to_server, args=(msg,))
-        thread.setDaemon(True)
-        thread.start()
-        return True
+        """
+        Send a message without waiting for the reply.
+        :return: a Future resolved with the node's reply (or the connection error)
+        """
+        future = self.api_client.request(msg.msg)
+        future.add_done_callback(lambda f: print(f"Err: {self.id} did not get {msg.msg}: {f.exception()}")
+                                 if f.exception() is not None else None)
+        return future
 
     def send_msg_to_server(self, lb_fmt_msg: LBFormattedMsg):
-
-        # self.socket = socket.create_connection(addr, timeout=timeout)
-        #
-        #
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-            sock.connect((self.ip, self.api))
-            sock.settimeout(2)
-
-            print("sending data to the server...")
-            sock.sendall(bytes(lb_fmt_msg.msg + "\n", "utf-8"))
-            print("data sent!")
-            received = str(sock.recv(1024), "utf-8")
-            print(f"received data from the server: {received}")
-            return received
-            # self.assertEqual(received, expected_response)
+        """
+        Send a message to the node's API and wait for the reply.
+        :raises OSError: if the node can't be reached within the connect / request timeouts
+        """
+        print(f"sending data to the server: {lb_fmt_msg.msg}")
+        received = self.api_client.call(lb_fmt_msg.msg)
+        print(f"received data from the server: {received}")
+        return received
 
     @total_ordering
     class State(Enum):
@@ -389,3 +478,53 @@ class Server:
                 return self.value < other.value
             return NotImplemented
 
+
+class StatusCheck(Enum):
+    """
+    Outcome of asking a node's Minecraft server for its status
+    """
+    ANSWERED = 0
+    DOWN = 1            # Timed out or refused
+    FAILED = 2          # Any other error
+    MALFORMED = 3       # Answered, but without a players / online section
+
+
+class PollResult(NamedTuple):
+    """
+    What Server.probe() found, for Server.apply_poll()
+    """
+    state: Server.State             # the server's state when the probe started
+    status: StatusCheck = None      # None if that state doesn't check the Minecraft server
+    online: int = 0                 # players online, if the status was ANSWERED
+    players: dict = None            # player uuid -> name, if the status was ANSWERED
+    api_up: bool = None             # the node API answered (True) or refused (False); None if unclear or not asked
+
+
+class TimedMinecraftServer(MinecraftServer):
+    """
+    MinecraftServer whose status() gives up on a silent server after our own socket timeout -
+    mcstatus 4.0 always opens its connection with a 3 second one.
+    """
+
+    def __init__(self, host, port, timeout):
+        MinecraftServer.__init__(self, host, port)
+        self.timeout = timeout
+
+    def status(self, tries=3, **kwargs):
+        """
+        MinecraftServer.status(), on a connection with self.timeout.
+        :param tries: attempts over the one connection
+        :return: the PingResponse
+        """
+        connection = TCPSocketConnection((self.host, self.port), timeout=self.timeout)
+        exception = None
+        for attempt in range(tries):
+            try:
+                pinger = ServerPinger(connection, host=self.host, port=self.port, **kwargs)
+                pinger.handshake()
+                result = pinger.read_status()
+                result.latency = pinger.test_ping()
+                return result
+            except Exception as e:
+                exception = e
+        raise exception
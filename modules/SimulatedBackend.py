@@ -0,0 +1,219 @@
+import collections
+import configparser
+import random
+import threading
+import time
+from modules.ComputeBackend import ComputeBackend, BackendError, NodeState, AllocationState, Pool, Node, \
+    Endpoint, EndpointConfiguration
+from root import *
+
+"""
+In-memory compute backend: a pool that behaves like Azure Batch without any VMs or processes.
+Nodes take bootLatency (+/- bootJitter) seconds to boot after a resize, the allocation state stays 'resizing' for
+resizeLatency seconds after every resize or removal, and a start task makes an idle node 'running'; its MC server is
+considered up serverStartLatency seconds later (see server_up()).
+Failures can be injected: a fraction of booting nodes end up unusable (bootFailureRate), a fraction of calls fail like
+a throttled Azure API (apiErrorRate), and fail_node() breaks a node on demand.
+Time comes from the clock passed in, so a simulation can run the pool on a virtual clock.
+Nodes get endpoints on [SIMULATED] host, with ports counting up from mcPortStart / apiPortStart like Azure's NAT pools.
+"""
+
+
+class SimulatedNode:
+
+    def __init__(self, node_id, index, ready_at, fails):
+        self.id = node_id
+        self.index = index              # slot used for the endpoint ports
+        self.state = NodeState.starting
+        self.ready_at = ready_at
+        self.fails = fails              # boot failure decided up front, so runs are reproducible from the seed
+        self.task_started_at = None
+
+
+class SimulatedBackend(ComputeBackend):
+
+    def __init__(self, config=os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'), clock=time.monotonic, seed=None):
+        """
+        :param config: config file - reads [POOL] id / mincount and the [SIMULATED] section
+        :param clock: time source. Pass a virtual clock to simulate
+        :param seed: random seed for boot times and injected failures (default: [SIMULATED] seed)
+        """
+        self.config = configparser.ConfigParser()
+        self.config.read(config)
+        self.clock = clock
+        self.pool_id = self.config.get('POOL', 'id', fallback='simulated')
+        self.boot_latency = float(self.config.get('SIMULATED', 'bootLatency', fallback=240))
+        self.boot_jitter = float(self.config.get('SIMULATED', 'bootJitter', fallback=60))
+        self.server_start_latency = float(self.config.get('SIMULATED', 'serverStartLatency', fallback=90))
+        self.resize_latency = float(self.config.get('SIMULATED', 'resizeLatency', fallback=30))
+        self.boot_failure_rate = float(self.config.get('SIMULATED', 'bootFailureRate', fallback=0))
+        self.api_error_rate = float(self.config.get('SIMULATED', 'apiErrorRate', fallback=0))
+        self.host = self.config.get('SIMULATED', 'host', fallback='127.0.0.1')
+        self.mc_port_start = int(self.config.get('SIMULATED', 'mcPortStart', fallback=44000))
+        self.api_port_start = int(self.config.get('SIMULATED', 'apiPortStart', fallback=44500))
+        if seed is None:
+            seed = int(self.config.get('SIMULATED', 'seed', fallback=0))
+        self.random = random.Random(seed)
+
+        self.created = False
+        self.nodes = collections.OrderedDict()      # node id -> SimulatedNode
+        self.target = 0
+        self.resizing_until = None
+        self.pending_tasks = 0
+        self.calls = collections.Counter()          # backend calls by name, for benchmarks
+        self._node_counter = 0
+        self._version = 0                           # bumped on every change - the pool's ETag
+        self._lock = threading.RLock()
+
+    def check_or_create_pool(self, id=None):
+        with self._lock:
+            self._call('check_or_create_pool')
+            if id is not None:
+                self.pool_id = id
+            if self.created:
+                return self.get_pool()
+            self.created = True
+            count = int(self.config.get('POOL', 'mincount', fallback=1))
+            self._resize_to(count)
+            self.pending_tasks += count
+            return None
+
+    def get_pool(self, max_age=None):
+        with self._lock:
+            self._call('get_pool')
+            self._advance()
+            allocation = AllocationState.resizing if self.resizing_until is not None else AllocationState.steady
+            current = len([node for node in self.nodes.values() if node.state != NodeState.leaving_pool])
+            return Pool(id=self.pool_id, allocation_state=allocation, target_dedicated_nodes=self.target,
+                        current_dedicated_nodes=current, e_tag=str(self._version))
+
+    def list_nodes(self, max_age=None):
+        with self._lock:
+            self._call('list_nodes')
+            self._advance()
+            return [self._as_node(node) for node in self.nodes.values()]
+
+    def expand_pool(self, size):
+        with self._lock:
+            self._call('expand_pool')
+            self._advance()
+            if self.resizing_until is not None:
+                print("Simulated pool: resize rejected - the pool is already resizing")
+                return False
+            self._resize_to(size)
+            return True
+
+    def remove_nodes_from_pool(self, node_ids):
+        with self._lock:
+            self._call('remove_nodes_from_pool')
+            self._advance()
+            if self.resizing_until is not None:
+                print("Simulated pool: remove rejected - the pool is already resizing")
+                return False
+            removing = [self.nodes[node_id] for node_id in node_ids if node_id in self.nodes]
+            for node in removing:
+                node.state = NodeState.leaving_pool
+            self.target = max(self.target - len(removing), 0)
+            self._start_resize()
+            return True
+
+    def add_tasks_to_start_servers(self, count):
+        with self._lock:
+            self._call('add_tasks_to_start_servers')
+            self.pending_tasks += count
+            self._advance()
+
+    def fail_node(self, node_id, state=NodeState.unusable):
+        """
+        Failure injection: the node stops working (its MC server goes down with it).
+        """
+        with self._lock:
+            node = self.nodes.get(node_id)
+            if node is not None:
+                node.state = state
+                node.task_started_at = None
+                self._version += 1
+
+    def server_up(self, node_id):
+        """
+        :return: True if the node's MC server would answer a status request now
+        """
+        with self._lock:
+            self._advance()
+            node = self.nodes.get(node_id)
+            return node is not None and node.state == NodeState.running and \
+                self.clock() >= node.task_started_at + self.server_start_latency
+
+    def endpoints(self, node_id):
+        """
+        :return: (ip, minecraft port, API port) of a node
+        """
+        node = self.nodes[node_id]
+        return self.host, self.mc_port_start + node.index, self.api_port_start + node.index
+
+    def _call(self, name):
+        self.calls[name] += 1
+        if self.api_error_rate > 0 and self.random.random() < self.api_error_rate:
+            raise BackendError(f"Simulated pool: {name} failed (injected)")
+
+    def _resize_to(self, size):
+        active = [node for node in self.nodes.values() if node.state != NodeState.leaving_pool]
+        now = self.clock()
+        for i in range(len(active), size):
+            self._node_counter += 1
+            ready_at = now + max(self.random.gauss(self.boot_latency, self.boot_jitter / 2), 0)
+            fails = self.random.random() < self.boot_failure_rate
+            node = SimulatedNode(f"sim-node-{self._node_counter}", self._free_index(), ready_at, fails)
+            self.nodes[node.id] = node
+        # Shrinking by target (not by node id): like Azure, prefer nodes that aren't running anything
+        surplus = len(active) - size
+        for node in sorted(active, key=lambda n: n.state == NodeState.running):
+            if surplus <= 0:
+                break
+            node.state = NodeState.leaving_pool
+            surplus -= 1
+        self.target = size
+        self._start_resize()
+
+    def _start_resize(self):
+        self.resizing_until = self.clock() + self.resize_latency
+        self._version += 1
+
+    def _free_index(self):
+        used = {node.index for node in self.nodes.values()}
+        index = 0
+        while index in used:
+            index += 1
+        return index
+
+    def _advance(self):
+        """
+        Bring the pool up to the current time: finish resizes, boot nodes and hand queued tasks to idle nodes.
+        """
+        now = self.clock()
+        changed = False
+        if self.resizing_until is not None and now >= self.resizing_until:
+            self.resizing_until = None
+            for node_id in [node.id for node in self.nodes.values() if node.state == NodeState.leaving_pool]:
+                del self.nodes[node_id]
+            changed = True
+        for node in self.nodes.values():
+            idle_since = now
+            if node.state == NodeState.starting and now >= node.ready_at:
+                node.state = NodeState.unusable if node.fails else NodeState.idle
+                idle_since = node.ready_at      # A queued task starts as soon as the node is up, not when we look
+                changed = True
+            if node.state == NodeState.idle and self.pending_tasks > 0:
+                node.state = NodeState.running
+                node.task_started_at = idle_since
+                self.pending_tasks -= 1
+                changed = True
+        if changed:
+            self._version += 1
+
+    def _as_node(self, node):
+        ip, mc_port, api_port = self.endpoints(node.id)
+        return Node(id=node.id, state=node.state, endpoint_configuration=EndpointConfiguration([
+            Endpoint('minecraftServer', ip, mc_port, 25565),
+            Endpoint('api_port', ip, api_port, int(self.config.get('POOL', 'api_port', fallback=9007))),
+        ]))
@@ -0,0 +1,103 @@
+import time
+
+
+class TeamMap:
+    """
+    team -> Server assignments, maintained incrementally.
+
+    Each poll applies a per-server delta (teams that appeared on / disappeared from that server) instead of clearing and
+    rebuilding the whole map, so the map is never empty or partial while a poll cycle runs.
+
+    A team routed by the load balancer is a *pending* assignment until pendingTTL seconds have passed. A pending team
+    stays on its server even if a poll doesn't show it (its players simply haven't finished connecting yet), so the
+    next player of that team is sent to the same server instead of splitting the team.
+    """
+
+    def __init__(self, pending_ttl, clock=time.monotonic):
+        """
+        :param pending_ttl: seconds a routed team keeps its server without being seen in a poll
+        :param clock: time source, for tests and simulation
+        """
+        self.pending_ttl = pending_ttl
+        self.clock = clock
+        self.assignments = {}   # team -> Server. This dict is updated in place, never replaced.
+        self.reported = {}      # server id -> set of teams the server reported last time
+        self.pending = {}       # team -> monotonic deadline after which an unseen assignment is dropped
+        self.arrivals = 0       # running count of teams added to the map (moves between servers don't count)
+        self.departures = 0     # running count of teams dropped from the map
+
+    def __contains__(self, team):
+        return team in self.assignments
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def assign(self, team, server):
+        """
+        Record a routing decision. The team stays on this server for at least pending_ttl seconds.
+        """
+        if team not in self.assignments:
+            self.arrivals += 1
+        self.assignments[team] = server
+        self.pending[team] = self.clock() + self.pending_ttl
+
+    def update_server(self, server):
+        """
+        Apply the delta between the teams a server reports now and what it reported last time.
+        :return: (added, removed) sets of teams
+        """
+        now = set(server.teams)
+        before = self.reported.get(server.id, set())
+        self.reported[server.id] = now
+
+        for team in now:
+            if team not in self.assignments:
+                self.arrivals += 1
+            self.assignments[team] = server
+        removed = before - now
+        for team in removed:
+            self._drop_if_unused(team, server)
+        return now - before, removed
+
+    def remove_server(self, server):
+        """
+        Forget a server that left the pool, and every team assigned to it.
+        """
+        self.reported.pop(server.id, None)
+        for team in [team for team, srv in self.assignments.items() if srv.id == server.id]:
+            del self.assignments[team]
+            self.pending.pop(team, None)
+            self.departures += 1
+
+    def retain(self, servers):
+        """
+        Forget every server (and its teams) that isn't in servers.
+        """
+        keep = {server.id for server in servers}
+        for server in [srv for srv in self.assignments.values() if srv.id not in keep]:
+            self.remove_server(server)
+        for server_id in [server_id for server_id in self.reported if server_id not in keep]:
+            del self.reported[server_id]
+
+    def expire(self):
+        """
+        Drop pending assignments whose TTL passed without the team ever showing up on its server.
+        """
+        now = self.clock()
+        for team in [team for team, deadline in self.pending.items() if deadline <= now]:
+            del self.pending[team]
+            server = self.assignments.get(team)
+            if server is not None:
+                self._drop_if_unused(team, server)
+
+    def _drop_if_unused(self, team, server):
+        current = self.assignments.get(team)
+        if current is None or current.id != server.id:
+            return      # The team has moved to another server since
+        if team in self.reported.get(server.id, ()):
+            return      # Still there
+        if team in self.pending and self.pending[team] > self.clock():
+            return      # Routed recently - its players may not have connected yet
+        del self.assignments[team]
+        self.pending.pop(team, None)
+        self.departures += 1
@@ -0,0 +1,192 @@
+import asyncio
+import itertools
+import threading
+from modules.comms.TCPServers import ENCODING
+
+PORT = 9008
+HOST = "0.0.0.0"
+REPLY_TIMEOUT = 30          # seconds a connection waits for the main thread before giving up on a request
+BACKLOG = 1024              # round-start bursts open many connections at once
+PIPELINE_DEPTH = 64         # max requests in flight on a single session connection
+
+SESSION_COMMAND = b'session'
+SESSION_ACK = 'SESSION OK'
+
+TIMEOUT_RESPONSE = '{"IP":"None", "PORT":0, "MSG": "Error! Request Timed Out"}'
+
+"""
+asyncio replacement for the socketserver based lobby listener (see TCPServers.py).
+Every line received from the lobby becomes a LobbyRequest with its own id and future. The request object is
+what gets passed to the main thread (instead of raw bytes), and the reply is handed back through the request itself,
+so a reply can only ever reach the connection that asked for it - even if an earlier request timed out.
+
+Two connection modes are supported:
+    one-shot:   (default) read one line, send the reply, close. This is what the lobby has always done.
+    session:    the first line is "session". The server answers SESSION_ACK and then keeps the connection open,
+                reading any number of newline-framed requests. Requests may be pipelined (sent without waiting for
+                the previous reply); every reply is terminated by exactly one '\n' and replies are written in the
+                same order the requests arrived.
+"""
+
+
+class LobbyRequest:
+    """
+    A single command received from the lobby.
+    The main thread answers it by calling #reply(); this is thread safe and may be called from any thread.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, command: bytes, client_address, loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        self.id = next(LobbyRequest._ids)
+        self.raw = command
+        self.command = str(command, ENCODING, 'ignore')
+        self.client_address = client_address
+        self._loop = loop
+        self._future = future
+
+    def __repr__(self):
+        return f"LobbyRequest({self.id}, {self.client_address}, {self.raw})"
+
+    def reply(self, response: str):
+        """
+        Resolve this request with its response. Replies to requests that have already timed out are dropped.
+        :param response: the string to send back to the lobby connection that made this request
+        """
+        self._loop.call_soon_threadsafe(self._resolve, response)
+
+    def _resolve(self, response):
+        if not self._future.done():
+            self._future.set_result(response)
+
+
+class AsyncLobbyServer(threading.Thread):
+
+    def __init__(self, in_queue, host=HOST, port=PORT, reply_timeout=REPLY_TIMEOUT, backlog=BACKLOG,
+                 pipeline_depth=PIPELINE_DEPTH, timeout_response=TIMEOUT_RESPONSE):
+        """
+        Runs an asyncio TCP server on its own thread. Each received command is put on in_queue as a LobbyRequest.
+        :param in_queue: queue the main thread reads LobbyRequests from
+        :param host: interface to bind
+        :param port: port to bind
+        :param reply_timeout: seconds to wait for the main thread to reply before answering with TIMEOUT_RESPONSE
+        :param backlog: listen() backlog
+        :param pipeline_depth: max unanswered requests per session connection before we stop reading from it
+        :param timeout_response: what a request that timed out is answered with
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.recv_queue = in_queue
+        self.HOST = host
+        self.PORT = port
+        self.reply_timeout = reply_timeout
+        self.backlog = backlog
+        self.pipeline_depth = pipeline_depth
+        self.timeout_response = timeout_response
+        self.loop = None
+        self.server = None
+        self._serve_task = None
+        self.ready = threading.Event()
+
+    def kill(self):
+        if self.loop is not None and self._serve_task is not None:
+            self.loop.call_soon_threadsafe(self._serve_task.cancel)
+
+    def run(self):
+        print(f"Initializing AsyncLobbyServer on: {self.HOST}:{self.PORT}")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._serve_task = self.loop.create_task(self._serve())
+            self.loop.run_until_complete(self._serve_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Close any connections that are still open before the loop goes away.
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+    async def _serve(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.HOST, self.PORT,
+                                                 backlog=self.backlog, reuse_address=True)
+        self.ready.set()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        NOTE: inbound message MUST INCLUDE THE '\n' as the msg terminator, as we use #readline() to process messages.
+        """
+        peer = writer.get_extra_info('peername')
+        try:
+            command_from_lobby = (await reader.readline()).strip()
+            if not command_from_lobby:
+                return
+            if command_from_lobby.lower() == SESSION_COMMAND:
+                writer.write(bytes(SESSION_ACK + "\n", ENCODING))
+                await self._run_session(reader, writer, peer)
+                return
+            response = await self._dispatch(command_from_lobby, peer)
+            writer.write(bytes(response, ENCODING))
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"Lobby connection {peer} dropped: {e}")
+        finally:
+            writer.close()
+
+    async def _run_session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, peer):
+        """
+        Persistent connection: keep reading requests until the lobby closes its end.
+        Each request is dispatched as soon as it is read; a separate writer task sends the replies back in order.
+        """
+        in_flight = asyncio.Queue(maxsize=self.pipeline_depth)
+        replier = self.loop.create_task(self._write_replies(in_flight, writer, peer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command_from_lobby = line.strip()
+                if not command_from_lobby:
+                    continue
+                await in_flight.put(self.loop.create_task(self._dispatch(command_from_lobby, peer)))
+        finally:
+            await in_flight.put(None)
+            await replier
+
+    async def _write_replies(self, in_flight: asyncio.Queue, writer: asyncio.StreamWriter, peer):
+        """
+        Send replies for a session connection in request order. Stops at the None sentinel.
+        If the connection breaks, keep draining in_flight (without writing) so the reader never blocks on a full queue.
+        """
+        connected = True
+        while True:
+            pending = await in_flight.get()
+            if pending is None:
+                return
+            response = await pending
+            if not connected:
+                continue
+            try:
+                writer.write(bytes(response.rstrip("\n") + "\n", ENCODING))
+                await writer.drain()
+            except ConnectionError as e:
+                print(f"Lobby session {peer} dropped: {e}")
+                connected = False
+
+    async def _dispatch(self, command: bytes, peer):
+        """
+        Hand a command to the main thread and wait for the reply to this specific request.
+        :return: the response string for this request, or self.timeout_response
+        """
+        future = self.loop.create_future()
+        request = LobbyRequest(command, peer, self.loop, future)
+        print(f"msg {request.id} received from {peer}: {command}")
+        self.recv_queue.put(request)
+        try:
+            return await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            print(f"Err: request {request.id} timed out waiting for a reply")
+            return self.timeout_response
@@ -0,0 +1,130 @@
+import json
+import socket
+import threading
+import time
+import uuid
+from modules.comms.TCPServers import ENCODING
+
+PORT = 9010
+HOST = "0.0.0.0"
+CHECK_INTERVAL = 2          # seconds between status checks on the node
+KEEPALIVE = 15              # seconds between heartbeats when nothing changed
+MAX_DATAGRAM = 65507
+
+"""
+Push-based node status.
+MCServerMain runs a HeartbeatSender: once the load balancer has subscribed (MC command heartbeat_to), the node sends a
+small JSON datagram whenever its status changes, and at least every KEEPALIVE seconds otherwise.
+The load balancer runs a HeartbeatListener and hands every datagram to the PoolManager, which only falls back to
+pull polling for nodes that have gone quiet.
+
+Heartbeat format:
+    {"id": <Server.id the LB subscribed with>, "boot": <random id of this node process>, "seq": <n>,
+     "state": <MCServer.State name>, "mc_up": <bool>, "online": <players online>, "players": {uuid: name}}
+"""
+
+
+class HeartbeatSender(threading.Thread):
+
+    def __init__(self, status_fn, check_interval=CHECK_INTERVAL, keepalive=KEEPALIVE):
+        """
+        :param status_fn: returns the node status as a dict (state, mc_up, online, players)
+        :param check_interval: seconds between calls to status_fn
+        :param keepalive: max seconds between two heartbeats
+        """
+        threading.Thread.__init__(self, daemon=True, name='HeartbeatSender')
+        self.status_fn = status_fn
+        self.check_interval = check_interval
+        self.keepalive = keepalive
+        self.boot = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.target = None          # (host, port, server id) - set by subscribe()
+        self.running = True
+        self._wake = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def subscribe(self, host, port, server_id):
+        """
+        Start (or redirect) heartbeats. Sends one straight away.
+        """
+        self.target = (host, int(port), server_id)
+        self._wake.set()
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+    def run(self):
+        last_status = None
+        last_sent = 0
+        while self.running:
+            self._wake.wait(self.check_interval)
+            forced = self._wake.is_set()
+            self._wake.clear()
+            if self.target is None or not self.running:
+                continue
+            try:
+                status = self.status_fn()
+            except Exception as e:
+                print(f"Err: unable to read node status for the heartbeat: {e}")
+                continue
+            now = time.monotonic()
+            if forced or status != last_status or now - last_sent >= self.keepalive:
+                self._send(status)
+                last_status = status
+                last_sent = now
+
+    def _send(self, status):
+        host, port, server_id = self.target
+        self.seq += 1
+        payload = dict(status, id=server_id, boot=self.boot, seq=self.seq)
+        try:
+            self._sock.sendto(bytes(json.dumps(payload), ENCODING), (host, port))
+        except OSError as e:
+            print(f"Err: heartbeat to {host}:{port} failed: {e}")
+
+
+class HeartbeatListener(threading.Thread):
+
+    def __init__(self, out_queue, host=HOST, port=PORT):
+        """
+        Receives heartbeats and puts each one, as a dict, on out_queue.
+        :param out_queue: queue the PoolManager drains (see PoolManager.apply_heartbeats)
+        """
+        threading.Thread.__init__(self, daemon=True, name='HeartbeatListener')
+        self.out_queue = out_queue
+        self.HOST = host
+        self.PORT = port
+        self.running = True
+        self.ready = threading.Event()
+        self._sock = None
+
+    def kill(self):
+        self.running = False
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)     # wakes the blocked recvfrom - close() alone doesn't
+            except OSError:
+                pass        # Linux wakes the reader, then reports the (unconnected) socket as not connected
+            self._sock.close()
+
+    def run(self):
+        print(f"Initializing HeartbeatListener on: {self.HOST}:{self.PORT}")
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((self.HOST, self.PORT))
+        self.PORT = self._sock.getsockname()[1]
+        self.ready.set()
+        while self.running:
+            try:
+                data, addr = self._sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                break       # socket closed by kill()
+            if not self.running:
+                break       # woken by kill()
+            try:
+                heartbeat = json.loads(str(data, ENCODING))
+            except ValueError:
+                print(f"Err: bad heartbeat from {addr}")
+                continue
+            if isinstance(heartbeat, dict) and 'id' in heartbeat:
+                self.out_queue.put(heartbeat)
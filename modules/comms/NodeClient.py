@@ -0,0 +1,169 @@
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from modules.comms.TCPServers import ENCODING
+from modules.comms.AsyncLobbyServer import SESSION_COMMAND, SESSION_ACK
+
+CONNECT_TIMEOUT = 3         # seconds to establish a TCP connection to a node
+REQUEST_TIMEOUT = 10        # seconds to wait for a node's reply
+MAX_IDLE_CONNECTIONS = 2    # persistent connections kept open per node
+WORKERS = 16                # threads shared by every NodeClient for request()
+
+"""
+Load balancer -> node API client.
+Replaces a thread + a new TCP connection per message with persistent session connections (see the session mode of
+AsyncLobbyServer, which MCServerMain listens with) and a bounded worker pool shared by every node.
+Nodes that don't speak the session protocol are detected on the first connection and get one connection per request,
+exactly as before.
+"""
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def shared_executor(workers=WORKERS) -> ThreadPoolExecutor:
+    """
+    :param workers: pool size, used only by the first call
+    :return: the worker pool every NodeClient runs its requests on
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='NodeClient')
+        return _executor
+
+
+class NodeClient:
+
+    def __init__(self, host, port, connect_timeout=CONNECT_TIMEOUT, request_timeout=REQUEST_TIMEOUT,
+                 max_idle=MAX_IDLE_CONNECTIONS, executor: ThreadPoolExecutor = None):
+        """
+        :param host: node ip
+        :param port: node API port
+        :param connect_timeout: seconds allowed for connect() - a dead node fails fast instead of hanging
+        :param request_timeout: seconds allowed for each reply
+        :param max_idle: persistent connections kept for reuse
+        :param executor: worker pool for request(). Defaults to shared_executor()
+        """
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.max_idle = max_idle
+        self.executor = executor
+        self.sessions_supported = None      # None until the node has been asked
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def request(self, msg: str) -> Future:
+        """
+        Send msg on a worker thread.
+        :return: Future resolved with the node's reply (str), or with the socket error
+        """
+        executor = self.executor if self.executor is not None else shared_executor()
+        return executor.submit(self.call, msg)
+
+    def call(self, msg: str) -> str:
+        """
+        Send msg and wait for the reply on the calling thread.
+        :return: the node's reply
+        :raises OSError: connect / request timeouts, refused or dropped connections
+        """
+        if self.sessions_supported is False:
+            return self._one_shot(msg)
+
+        conn, reused = self._checkout()
+        if conn is None:
+            return self._one_shot(msg)
+        try:
+            reply = self._exchange(conn, msg)
+        except OSError as e:
+            conn.close()
+            # The node closed an idle connection (reset, EOF or broken pipe) - retry once on a fresh one. A timeout
+            # isn't retried: a slow or hung node would hold the worker for twice request_timeout.
+            if not reused or not isinstance(e, ConnectionError):
+                raise
+            conn, reused = self._open_session(), False
+            if conn is None:
+                return self._one_shot(msg)
+            try:
+                reply = self._exchange(conn, msg)
+            except OSError:
+                conn.close()
+                raise
+        self._checkin(conn)
+        return reply
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.popleft().close()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.request_timeout)
+        return sock
+
+    def _checkout(self):
+        """
+        :return: (connection, True if it was reused), or (None, False) if the node doesn't support sessions
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._open_session(), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _open_session(self):
+        """
+        :return: a connection upgraded to session mode, or None if the node answered like an old one-shot listener
+        """
+        conn = _Connection(self._connect())
+        try:
+            reply = self._exchange(conn, str(SESSION_COMMAND, ENCODING))
+        except OSError:
+            conn.close()
+            raise
+        if reply.strip() != SESSION_ACK:
+            conn.close()
+            if self.sessions_supported is None:
+                print(f"Node {self.host}:{self.port} doesn't support sessions - using one connection per request")
+            self.sessions_supported = False
+            return None
+        self.sessions_supported = True
+        return conn
+
+    @staticmethod
+    def _exchange(conn, msg):
+        conn.file.write(bytes(msg.rstrip("\n") + "\n", ENCODING))
+        conn.file.flush()
+        line = conn.file.readline()
+        if not line:
+            raise ConnectionResetError("node closed the connection")
+        return str(line, ENCODING).rstrip("\n")
+
+    def _one_shot(self, msg):
+        with self._connect() as sock:
+            sock.sendall(bytes(msg.rstrip("\n") + "\n", ENCODING))
+            return str(sock.recv(1024), ENCODING)
+
+
+class _Connection:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile('rwb')
+
+    def close(self):
+        try:
+            self.file.close()
+        finally:
+            self.sock.close()
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import re
+import socket
+import threading
+import time
+import uuid
+from enum import Enum
+from modules.comms.TCPServers import ENCODING
+from modules.comms.AsyncLobbyServer import SESSION_COMMAND, SESSION_ACK
+from modules.comms.Heartbeat import CHECK_INTERVAL, KEEPALIVE
+from modules.comms.StubSLP import handle_slp, status_response
+from main.MCServerMain import CommandSet, MCServer
+
+"""
+Many stub pool nodes in one process, on one asyncio loop: each StubEndpoint answers Minecraft status pings (SLP) on its
+Minecraft port and the MCServerMain commands on its API port (one-shot and session connections, like NodeClient uses),
+and pushes heartbeats once the load balancer subscribes. No Minecraft, no threads per node - thousands of endpoints fit
+in one process (each needs two listening sockets: raise the open file limit accordingly).
+
+Every endpoint is scriptable, from code or from a timed script (see StubFleet.run_script):
+    players     set the roster (the status sample still shows at most SAMPLE_SIZE of them)
+    latency     delay every status and API reply by this many seconds
+    hang        accept connections but never answer (polls time out)
+    api_down    Minecraft is up, the node API port refuses connections (STABLE_BUT_TASK_FAILED)
+    crash       both ports refuse connections and heartbeats stop
+    recover     back up - with a new boot id, like a restarted node
+"""
+
+
+class StubMode(Enum):
+    UP = 'up'
+    HANG = 'hang'
+    API_DOWN = 'api_down'
+    DOWN = 'down'
+
+
+class StubEndpoint:
+
+    def __init__(self, node_id, mc_port, api_port, players=0, latency=0.0, dealloc_delay=5.0):
+        """
+        :param node_id: name of the node (used in player names and scripts)
+        :param mc_port: port the fake Minecraft server listens on
+        :param api_port: port the node API listens on
+        :param players: fake players online from the start
+        :param latency: seconds added to every reply
+        :param dealloc_delay: seconds between a deallocate command and the Minecraft port going away
+        """
+        self.node_id = node_id
+        self.mc_port = mc_port
+        self.api_port = api_port
+        self.latency = latency
+        self.dealloc_delay = dealloc_delay
+        self.players = {}                       # uuid -> name
+        self.set_players(players)
+        self.mode = StubMode.UP
+        self.state = MCServer.State.ACTIVE
+        self.boot = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.subscription = None                # (host, port, server id) from the load balancer's heartbeat_to
+        self.last_heartbeat = None              # (monotonic time, status) of the last heartbeat sent
+        self.requests = 0                       # status + API requests answered
+        self._mc_server = None
+        self._api_server = None
+        self._connections = set()               # open writers, closed on crash
+
+    def set_players(self, count):
+        """
+        Grow or shrink the roster to count fake players.
+        """
+        players = list(self.players.items())[:count]
+        for i in range(len(players), count):
+            players.append((str(uuid.uuid4()), f"{self.node_id}-player{i}"))
+        self.players = dict(players)
+
+    @property
+    def mc_up(self):
+        return self.mode in [StubMode.UP, StubMode.API_DOWN] and \
+            self.state in [MCServer.State.ACTIVE, MCServer.State.REQUESTED_DEACTIVATION]
+
+    def status(self):
+        return status_response(dict(self.players), motd=f"Stub {self.node_id}")
+
+    def heartbeat_status(self):
+        up = self.mc_up
+        return {"state": self.state.name, "mc_up": up, "online": len(self.players) if up else 0,
+                "players": dict(self.players) if up else {}}
+
+    def handle_command(self, command, peer):
+        """
+        :return: the reply to one API command - the same replies MCServerMain gives
+        """
+        line = command.lower()
+        up = self.mc_up
+
+        if CommandSet.SUBSCRIBE.value in line:
+            data = json.loads(command[command.find('{'):command.rfind('}') + 1])
+            self.subscription = (peer[0], int(data['PORT']), data['ID'])
+            self.last_heartbeat = None      # Send one straight away
+            return "Heartbeats On"
+        if line.strip() == CommandSet.PLAYERS.value:
+            return json.dumps({"online": len(self.players), "players": self.players}) if up \
+                else "Err: Server is not alive"
+        if CommandSet.HELLO.value in line:
+            return "I am awake"
+        if CommandSet.LAUNCH.value in line:
+            self.state = MCServer.State.ACTIVE
+            return "Re-launching MC Server"
+        if CommandSet.MCALIVE.value in line or CommandSet.MCSTATUS.value in line:
+            return "Server is Up!" if up else "Err: Server is not alive"
+        if CommandSet.DEALLOCATE.value in line:
+            if not up:
+                return "Err: Server is not active"
+            self.state = MCServer.State.REQUESTED_DEACTIVATION
+            asyncio.get_running_loop().call_later(self.dealloc_delay, self._deallocated)
+            target = re.search(r'\{.*\}', command)
+            return f"Deallocating Server. Sending Players to {target.group(0)}" if target else "Deallocating Server"
+        if CommandSet.PASSMSG.value in line:
+            return "Sent message to server" if up else "Error: Server is not active!"
+        if CommandSet.REQUESTSTATE.value in line:
+            return f'{{"State":{self.state.value}}}'
+        if CommandSet.ABORT.value in line:
+            return "Aborting..."
+        return "Err: Unknown Command"
+
+    def _deallocated(self):
+        self.players.clear()
+        self.state = MCServer.State.DEACTIVATED
+        if self._mc_server is not None:
+            self._mc_server.close()         # Minecraft has shut down - the port refuses connections
+            self._mc_server = None
+
+
+class StubFleet(threading.Thread):
+
+    def __init__(self, endpoints, host="0.0.0.0", check_interval=CHECK_INTERVAL, keepalive=KEEPALIVE):
+        """
+        Serves every endpoint on one event loop, on its own thread. Wait for .ready before connecting.
+        :param endpoints: list of StubEndpoint
+        :param check_interval: seconds between heartbeat checks
+        :param keepalive: max seconds between two heartbeats of a subscribed endpoint
+        """
+        threading.Thread.__init__(self, daemon=True, name='StubFleet')
+        self.endpoints = {endpoint.node_id: endpoint for endpoint in endpoints}
+        self.HOST = host
+        self.check_interval = check_interval
+        self.keepalive = keepalive
+        self.loop = None
+        self.ready = threading.Event()
+        self._stop_event = None
+        self._heartbeat_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._heartbeat_sock.setblocking(False)
+
+    @staticmethod
+    def on_ports(count, mc_port_start, api_port_start, prefix="stub", **kwargs):
+        """
+        :return: count StubEndpoints on consecutive ports - the same layout SimulatedBackend and LocalBackend give
+                 their nodes, so a fleet can stand in for a simulated pool
+        """
+        return [StubEndpoint(f"{prefix}-{i}", mc_port_start + i, api_port_start + i, **kwargs) for i in range(count)]
+
+    def kill(self):
+        if self.loop is not None and self._stop_event is not None:
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+
+    def call(self, fn, *args):
+        """
+        Run fn(*args) on the fleet's loop (every change to an endpoint must go through here once the fleet runs).
+        :return: concurrent Future with fn's result
+        """
+        async def run():
+            return fn(*args)
+        return asyncio.run_coroutine_threadsafe(run(), self.loop)
+
+    def apply(self, node, action, **args):
+        """
+        Script one change, thread safe. See the module docstring for the actions.
+        :param node: node id, or '*' for every endpoint
+        :return: concurrent Future, done once the change is in place
+        """
+        return asyncio.run_coroutine_threadsafe(self._apply(node, action, args), self.loop)
+
+    def run_script(self, events):
+        """
+        Schedule timed changes, relative to now.
+        :param events: list of dicts: {"at": seconds, "node": id or "*", "action": name, ...action arguments}
+                       e.g. {"at": 60, "node": "stub-3", "action": "crash"} or
+                            {"at": 0, "node": "*", "action": "players", "count": 20}
+        """
+        for event in events:
+            args = {key: value for key, value in event.items() if key not in ['at', 'node', 'action']}
+            self.loop.call_soon_threadsafe(self.loop.call_later, float(event.get('at', 0)),
+                                           lambda e=event, a=args: self.loop.create_task(
+                                               self._apply(e.get('node', '*'), e['action'], a)))
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+            self._heartbeat_sock.close()
+
+    async def _serve(self):
+        self._stop_event = asyncio.Event()
+        for endpoint in self.endpoints.values():
+            await self._open(endpoint, mc=True, api=True)
+        print(f"StubFleet: {len(self.endpoints)} nodes up")
+        self.ready.set()
+        heartbeats = self.loop.create_task(self._send_heartbeats())
+        await self._stop_event.wait()
+        heartbeats.cancel()
+        for endpoint in self.endpoints.values():
+            self._close(endpoint, mc=True, api=True)
+
+    async def _apply(self, node, action, args):
+        endpoints = list(self.endpoints.values()) if node == '*' else [self.endpoints[node]]
+        for endpoint in endpoints:
+            if action == 'players':
+                endpoint.set_players(int(args['count']))
+            elif action == 'latency':
+                endpoint.latency = float(args['seconds'])
+            elif action == 'hang':
+                endpoint.mode = StubMode.HANG
+            elif action == 'api_down':
+                endpoint.mode = StubMode.API_DOWN
+                self._close(endpoint, mc=False, api=True)
+            elif action == 'crash':
+                endpoint.mode = StubMode.DOWN
+                self._close(endpoint, mc=True, api=True)
+            elif action == 'recover':
+                endpoint.mode = StubMode.UP
+                endpoint.state = MCServer.State.ACTIVE
+                endpoint.boot = uuid.uuid4().hex[:12]
+                endpoint.seq = 0
+                await self._open(endpoint, mc=True, api=True)
+            else:
+                raise ValueError(f"Unknown stub action: {action}")
+
+    async def _open(self, endpoint, mc, api):
+        if mc and endpoint._mc_server is None:
+            endpoint._mc_server = await asyncio.start_server(
+                lambda r, w: self._handle_mc(endpoint, r, w), self.HOST, endpoint.mc_port, reuse_address=True)
+        if api and endpoint._api_server is None:
+            endpoint._api_server = await asyncio.start_server(
+                lambda r, w: self._handle_api(endpoint, r, w), self.HOST, endpoint.api_port, reuse_address=True)
+
+    @staticmethod
+    def _close(endpoint, mc, api):
+        if mc and endpoint._mc_server is not None:
+            endpoint._mc_server.close()
+            endpoint._mc_server = None
+        if api and endpoint._api_server is not None:
+            endpoint._api_server.close()
+            endpoint._api_server = None
+        if mc and api:
+            for writer in list(endpoint._connections):
+                writer.transport.abort()        # A crashed node drops its open connections too
+
+    async def _handle_mc(self, endpoint, reader, writer):
+        if endpoint.mode == StubMode.HANG:
+            await self._hang(endpoint, reader, writer)
+            return
+
+        def status():
+            endpoint.requests += 1
+            return endpoint.status()
+
+        endpoint._connections.add(writer)
+        try:
+            if endpoint.latency > 0:
+                await asyncio.sleep(endpoint.latency)
+            await handle_slp(reader, writer, status)
+        finally:
+            endpoint._connections.discard(writer)
+
+    async def _handle_api(self, endpoint, reader, writer):
+        if endpoint.mode == StubMode.HANG:
+            await self._hang(endpoint, reader, writer)
+            return
+        endpoint._connections.add(writer)
+        peer = writer.get_extra_info('peername')
+        try:
+            line = (await reader.readline()).strip()
+            if line.lower() == SESSION_COMMAND:
+                writer.write(bytes(SESSION_ACK + "\n", ENCODING))
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        writer.write(bytes(await self._reply(endpoint, line, peer) + "\n", ENCODING))
+                        await writer.drain()
+            elif line:
+                writer.write(bytes(await self._reply(endpoint, line, peer), ENCODING))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            endpoint._connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _reply(endpoint, line, peer):
+        if endpoint.latency > 0:
+            await asyncio.sleep(endpoint.latency)
+        endpoint.requests += 1
+        return endpoint.handle_command(str(line, ENCODING, 'ignore').strip(), peer)
+
+    @staticmethod
+    async def _hang(endpoint, reader, writer):
+        """
+        Read and ignore everything until the client gives up.
+        """
+        endpoint._connections.add(writer)
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            endpoint._connections.discard(writer)
+            writer.close()
+
+    async def _send_heartbeats(self):
+        """
+        HeartbeatSender for every subscribed endpoint, on one socket: send on every status change, and at least
+        every keepalive seconds. Endpoints that are hung, crashed or whose API is down send nothing.
+        """
+        while True:
+            now = time.monotonic()
+            for endpoint in self.endpoints.values():
+                if endpoint.subscription is None or endpoint.mode != StubMode.UP:
+                    continue
+                status = endpoint.heartbeat_status()
+                last = endpoint.last_heartbeat
+                if last is not None and last[1] == status and now - last[0] < self.keepalive:
+                    continue
+                host, port, server_id = endpoint.subscription
+                endpoint.seq += 1
+                payload = dict(status, id=server_id, boot=endpoint.boot, seq=endpoint.seq)
+                try:
+                    self._heartbeat_sock.sendto(bytes(json.dumps(payload), ENCODING), (host, port))
+                except OSError as e:
+                    print(f"Err: heartbeat from {endpoint.node_id} to {host}:{port} failed: {e}")
+                endpoint.last_heartbeat = (now, status)
+            await asyncio.sleep(self.check_interval)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+from modules.comms.TCPServers import ENCODING
+
+SAMPLE_SIZE = 12            # players listed in a status sample - same cap as a vanilla server
+PROTOCOL_VERSION = 47       # what mcstatus sends in its handshake
+
+"""
+Stand-in for the Minecraft Server List Ping (SLP) protocol that mcstatus speaks - just enough for status() and ping:
+    handshake       -> (nothing)
+    status request  -> status response (JSON: version, players online / max / sample, description)
+    ping(token)     -> pong(token), and the connection is closed
+Every packet is <varint length><varint packet id><payload>, strings are <varint length><utf-8>.
+Used by the stub nodes (modules/comms/StubFleet.py) so Server.poll can run against localhost without a Minecraft JVM.
+"""
+
+
+def status_response(players, max_players=48, motd="Stub server"):
+    """
+    :param players: uuid -> name of everyone online
+    :return: the status JSON a Minecraft server would send - the sample holds at most SAMPLE_SIZE players
+    """
+    sample = [{"id": uuid, "name": name} for uuid, name in list(players.items())[:SAMPLE_SIZE]]
+    return {"version": {"name": "1.8.9", "protocol": PROTOCOL_VERSION},
+            "players": {"max": max_players, "online": len(players), "sample": sample},
+            "description": {"text": motd}}
+
+
+def _varint(value):
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _unpack_varint(data, offset):
+    result = 0
+    for i in range(5):
+        byte = data[offset + i]
+        result |= (byte & 0x7F) << 7 * i
+        if not byte & 0x80:
+            return result, offset + i + 1
+    raise ValueError("varint is too long")
+
+
+async def _read_varint(reader: asyncio.StreamReader):
+    result = 0
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        result |= (byte & 0x7F) << 7 * i
+        if not byte & 0x80:
+            return result
+    raise ValueError("varint is too long")
+
+
+def _packet(packet_id, payload=b''):
+    data = _varint(packet_id) + payload
+    return _varint(len(data)) + data
+
+
+def _string(text):
+    data = bytes(text, ENCODING)
+    return _varint(len(data)) + data
+
+
+async def handle_slp(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, status_fn):
+    """
+    Serve one SLP connection.
+    :param status_fn: returns the status JSON (see status_response) - called once per status request
+    """
+    try:
+        while True:
+            data = await reader.readexactly(await _read_varint(reader))
+            packet_id, offset = _unpack_varint(data, 0)
+            if packet_id == 0 and len(data) > offset:
+                continue        # Handshake - nothing to answer
+            if packet_id == 0:
+                writer.write(_packet(0, _string(json.dumps(status_fn()))))
+                await writer.drain()
+            elif packet_id == 1:
+                writer.write(_packet(1, data[offset:offset + 8]))
+                await writer.drain()
+                return
+            else:
+                return
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError, IndexError):
+        pass
+    finally:
+        writer.close()
+
@@ -0,0 +1,169 @@
+import unittest
+from types import SimpleNamespace
+from azure.batch.models import BatchErrorException, TaskAddStatus
+from modules.BatchPool import BatchPool
+from testutil import FakeClock
+
+TTL = 10
+
+
+def batch_error(status_code, code=None):
+    # Built without BatchErrorException.__init__, which wants a real HTTP response to deserialize
+    error = BatchErrorException.__new__(BatchErrorException)
+    error.response = SimpleNamespace(status_code=status_code)
+    error.error = SimpleNamespace(code=code) if code is not None else None
+    return error
+
+
+class FakePoolOperations:
+
+    def __init__(self):
+        self.e_tag = "etag-1"
+        self.gets = []          # If-None-Match of every get
+        self.error = None       # raised by the next get instead of answering
+
+    def get(self, pool_id, pool_get_options=None):
+        self.gets.append(pool_get_options.if_none_match)
+        if self.error is not None:
+            raise self.error
+        if pool_get_options.if_none_match == self.e_tag:
+            raise batch_error(304)
+        return SimpleNamespace(id=pool_id, e_tag=self.e_tag)
+
+    def resize(self, pool_id, pool_resize_parameter):
+        self.e_tag = "etag-resized"
+
+    def remove_nodes(self, pool_id, node_remove_parameter):
+        self.e_tag = "etag-removed"
+
+
+class FakeComputeNodeOperations:
+
+    def __init__(self):
+        self.lists = 0
+
+    def list(self, pool_id, compute_node_list_options=None):
+        self.lists += 1
+        return iter([SimpleNamespace(id="node-1"), SimpleNamespace(id="node-2")])
+
+
+class FakeTaskOperations:
+
+    def __init__(self):
+        self.calls = []         # (job id, task ids) of every add_collection
+        self.errors = []        # raised by the next add_collection calls instead of answering
+        self.statuses = []      # per call: task index -> TaskAddStatus; missing tasks succeed
+
+    def add_collection(self, job_id, value):
+        self.calls.append((job_id, [task.id for task in value]))
+        if self.errors:
+            raise self.errors.pop(0)
+        statuses = self.statuses.pop(0) if self.statuses else {}
+        return SimpleNamespace(value=[SimpleNamespace(task_id=task.id, error=None,
+                                                      status=statuses.get(i, TaskAddStatus.success))
+                                      for i, task in enumerate(value)])
+
+
+class FakeJobOperations:
+
+    def __init__(self):
+        self.added = []
+
+    def add(self, job):
+        self.added.append(job.id)
+
+
+class FakeBatchPool(BatchPool):
+
+    def _login_to_batch(self):
+        return SimpleNamespace(pool=FakePoolOperations(), compute_node=FakeComputeNodeOperations(),
+                               task=FakeTaskOperations(), job=FakeJobOperations())
+
+    def get_start_task_commands(self):
+        return ["true"]
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.batch = FakeBatchPool(clock=self.clock)
+        self.batch.read_ttl = TTL
+        self.pools = self.batch.client.pool
+        self.nodes = self.batch.client.compute_node
+
+    def test_reads_within_ttl_share_one_call(self):
+        pool = self.batch.get_pool()
+        self.clock.now += TTL / 2
+        self.assertIs(self.batch.get_pool(), pool)
+        self.batch.list_nodes()
+        self.batch.list_nodes()
+        self.assertEqual(self.pools.gets, [None])
+        self.assertEqual(self.nodes.lists, 1)
+
+    def test_not_modified_reuses_the_cached_pool(self):
+        pool = self.batch.get_pool()
+        self.clock.now += TTL
+        self.assertIs(self.batch.get_pool(), pool)
+        self.assertEqual(self.pools.gets, [None, "etag-1"])
+
+        # Still fresh after the 304
+        self.clock.now += TTL / 2
+        self.batch.get_pool()
+        self.assertEqual(len(self.pools.gets), 2)
+
+    def test_changed_pool_is_downloaded_again(self):
+        first = self.batch.get_pool()
+        self.pools.e_tag = "etag-2"
+        second = self.batch.get_pool(max_age=0)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.e_tag, "etag-2")
+        self.assertEqual(self.pools.gets, [None, "etag-1"])
+
+    def test_other_errors_are_raised(self):
+        self.batch.get_pool()
+        self.clock.now += TTL
+        self.pools.error = batch_error(500)
+        with self.assertRaises(BatchErrorException):
+            self.batch.get_pool()
+
+    def test_expand_invalidates_reads(self):
+        self.batch.get_pool()
+        self.batch.list_nodes()
+        self.assertTrue(self.batch.expand_pool(3))
+        self.assertEqual(self.batch.get_pool().e_tag, "etag-resized")
+        self.batch.list_nodes()
+        self.assertEqual(self.pools.gets, [None, "etag-1"])     # Still a conditional read
+        self.assertEqual(self.nodes.lists, 2)
+
+    def test_remove_invalidates_reads(self):
+        self.batch.get_pool()
+        self.batch.list_nodes()
+        self.assertTrue(self.batch.remove_nodes_from_pool(["node-1"]))
+        self.assertEqual(self.batch.get_pool().e_tag, "etag-removed")
+        self.batch.list_nodes()
+        self.assertEqual(self.nodes.lists, 2)
+
+
+    def test_tasks_with_server_errors_are_resubmitted(self):
+        tasks = self.batch.client.task
+        tasks.statuses = [{1: TaskAddStatus.server_error, 2: TaskAddStatus.client_error}]
+        self.batch.add_tasks_to_start_servers(3)
+        self.assertEqual(len(tasks.calls), 2)
+        self.assertEqual(tasks.calls[1][1], [tasks.calls[0][1][1]])
+
+    def test_new_job_only_when_the_job_is_gone(self):
+        tasks = self.batch.client.task
+        tasks.errors = [batch_error(409, 'JobCompleted')]
+        self.batch.add_tasks_to_start_servers(2)
+        self.assertEqual(len(self.batch.client.job.added), 1)
+        self.assertEqual(tasks.calls[1][0], self.batch.client.job.added[0])
+
+        tasks.errors = [batch_error(400, 'InvalidPropertyValue')]
+        with self.assertRaises(BatchErrorException):
+            self.batch.add_tasks_to_start_servers(1)
+        self.assertEqual(len(self.batch.client.job.added), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from modules.Consolidation import plan_consolidation
+
+
+class FakeServer:
+
+    def __init__(self, server_id, teams, players):
+        self.id = server_id
+        self.teams = [f"{server_id}-team{i}" for i in range(0, teams)]
+        self.playercount = players
+
+
+def plan(servers, max_removals):
+    return [(m.source.id, m.target.id if m.target is not None else None)
+            for m in plan_consolidation(servers, max_teams=2, max_players=20, max_removals=max_removals)]
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_retires_several_servers_in_one_round(self):
+        servers = [FakeServer('a', 0, 0), FakeServer('b', 1, 4), FakeServer('c', 1, 5), FakeServer('d', 1, 10),
+                   FakeServer('e', 1, 12)]
+        # best fit: b goes where it leaves the least room (e: 16/20), then c into d (15/20)
+        self.assertEqual(plan(servers, 3), [('a', None), ('b', 'e'), ('c', 'd')])
+        self.assertEqual(plan(servers, 5), [('a', None), ('b', 'e'), ('c', 'd')])
+
+    def test_never_overfills_a_target(self):
+        servers = [FakeServer('a', 1, 15), FakeServer('b', 1, 15)]
+        self.assertEqual(plan(servers, 1), [])
+        servers = [FakeServer('a', 2, 4), FakeServer('b', 1, 4)]
+        self.assertEqual(plan(servers, 1), [])      # a would end up with 3 teams
+
+    def test_target_is_not_retired(self):
+        servers = [FakeServer('a', 1, 2), FakeServer('b', 1, 3)]
+        self.assertEqual(plan(servers, 2), [('a', 'b')])
+
+    def test_respects_max_removals(self):
+        servers = [FakeServer(name, 0, 0) for name in 'abcd']
+        self.assertEqual(len(plan(servers, 2)), 2)
+        self.assertEqual(plan(servers, 0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from modules.ControlPlane import ControlPlane
+from modules.Scheduler import Scheduler
+from testutil import FakeClock
+
+
+class FakePool:
+
+    def __init__(self):
+        self.published = 0
+        self.log = []
+
+    def publish_snapshot(self):
+        self.published += 1
+        self.log.append('publish')
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.pool = FakePool()
+        self.control = ControlPlane(self.pool, Scheduler(clock=self.clock))
+
+    def test_one_snapshot_per_batch_of_commands(self):
+        futures = [self.control.submit(self.pool.log.append, f"assign {i}") for i in range(5)]
+        self.control.step(self.control.drain())
+        self.assertEqual(self.pool.published, 1)
+        self.assertEqual(self.pool.log, [f"assign {i}" for i in range(5)] + ['publish'])
+        self.assertTrue(all(future.done() for future in futures))
+
+    def test_failed_command_does_not_stop_the_batch(self):
+        def fail():
+            raise ValueError("boom")
+        failed = self.control.submit(fail)
+        ok = self.control.submit(lambda: 42)
+        self.control.step(self.control.drain())
+        self.assertIsInstance(failed.exception(), ValueError)
+        self.assertEqual(ok.result(), 42)
+        self.assertEqual(self.pool.published, 1)
+
+    def test_nothing_to_do_publishes_nothing(self):
+        self.control.step()
+        self.assertEqual(self.pool.published, 0)
+        self.control.scheduler.add_job('poll', 10, lambda: None)
+        self.clock.now = 10
+        self.control.step()
+        self.assertEqual(self.pool.published, 1)
+
+    def test_drain_limit(self):
+        for i in range(5):
+            self.control.submit(lambda: None)
+        self.assertEqual(len(self.control.drain(limit=3)), 3)
+        self.assertEqual(len(self.control.drain()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
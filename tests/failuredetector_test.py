@@ -0,0 +1,57 @@
+import unittest
+from modules.FailureDetector import PhiAccrualDetector
+from testutil import FakeClock
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def arrive_every(self, detector, interval, count):
+        for _ in range(count):
+            self.clock.now += interval
+            detector.heartbeat()
+
+    def test_phi_grows_with_silence(self):
+        detector = PhiAccrualDetector(35, clock=self.clock)
+        self.arrive_every(detector, 35, 20)
+        levels = []
+        for _ in range(4):
+            self.clock.now += 35
+            levels.append(detector.phi())
+        self.assertLess(levels[0], 1)
+        self.assertEqual(levels, sorted(levels))
+        self.assertGreaterEqual(levels[2], 8)
+
+    def test_regular_node_suspected_within_three_polls(self):
+        detector = PhiAccrualDetector(35, clock=self.clock)
+        self.arrive_every(detector, 35, 20)
+        self.clock.now += 3 * 35
+        self.assertTrue(detector.suspect(8))
+
+    def test_irregular_node_gets_more_time(self):
+        regular = PhiAccrualDetector(35, clock=self.clock)
+        self.arrive_every(regular, 35, 20)
+        self.clock.now = 0
+        irregular = PhiAccrualDetector(35, clock=self.clock)
+        for i in range(20):
+            self.clock.now += 15 if i % 2 else 55
+            irregular.heartbeat()
+        self.clock.now += 90
+        self.assertGreater(regular.phi(), irregular.phi())
+        self.assertFalse(irregular.suspect(8))
+
+    def test_reset_uses_first_interval(self):
+        detector = PhiAccrualDetector(300, clock=self.clock)
+        self.clock.now = 300
+        self.assertLess(detector.phi(), 1)
+        self.clock.now = 900
+        self.assertTrue(detector.suspect(6))
+        detector.reset(35)
+        self.assertEqual(detector.since_last(), 0)
+        self.assertLess(detector.phi(), 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from queue import Queue, Empty
+from modules.comms.Heartbeat import HeartbeatSender, HeartbeatListener
+from testutil import HOST
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.received = Queue()
+        self.listener = HeartbeatListener(self.received, host=HOST, port=0)
+        self.listener.start()
+        self.assertTrue(self.listener.ready.wait(5))
+        self.status = {"state": "ACTIVE", "mc_up": True, "online": 0, "players": {}}
+        self.sender = HeartbeatSender(lambda: dict(self.status), check_interval=0.01, keepalive=60)
+        self.sender.start()
+
+    def tearDown(self):
+        self.sender.stop()
+        self.listener.kill()
+        self.listener.join(5)
+        self.assertFalse(self.listener.is_alive())
+
+    def test_nothing_sent_before_subscribe(self):
+        with self.assertRaises(Empty):
+            self.received.get(timeout=0.1)
+
+    def test_sends_on_subscribe_and_on_change(self):
+        self.sender.subscribe(HOST, self.listener.PORT, "10.0.0.1:25565")
+        first = self.received.get(timeout=5)
+        self.assertEqual(first['id'], "10.0.0.1:25565")
+        self.assertEqual(first['seq'], 1)
+        self.assertTrue(first['mc_up'])
+
+        with self.assertRaises(Empty):
+            self.received.get(timeout=0.1)     # unchanged - nothing until the keepalive
+
+        self.status = {"state": "ACTIVE", "mc_up": True, "online": 1, "players": {"uuid-1": "steve"}}
+        second = self.received.get(timeout=5)
+        self.assertEqual(second['seq'], 2)
+        self.assertEqual(second['boot'], first['boot'])
+        self.assertEqual(second['players'], {"uuid-1": "steve"})
+
+    def test_keepalive(self):
+        self.sender.keepalive = 0.05
+        self.sender.subscribe(HOST, self.listener.PORT, "srv")
+        beats = [self.received.get(timeout=5) for _ in range(3)]
+        self.assertEqual([beat['seq'] for beat in beats], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import asyncio
+import threading
+from queue import Queue, Empty
+from modules.LobbyLoad import TraceShape, make_trace, percentile, run_trace, find_regressions
+from modules.comms.AsyncLobbyServer import AsyncLobbyServer
+from testutil import HOST, free_port
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_traces(self):
+        steady = make_trace(TraceShape.STEADY, 100, 10, seed=1)
+        self.assertEqual(steady, make_trace(TraceShape.STEADY, 100, 10, seed=1))
+        self.assertTrue(800 < len(steady) < 1200)
+        self.assertEqual([call.at for call in steady], sorted(call.at for call in steady))
+        self.assertEqual({call.kind for call in steady}, {'get_server_for_team', 'list_all', 'status'})
+
+        bursts = make_trace(TraceShape.BURSTS, 120, 2, burst_every=60, burst_length=5, burst_factor=20)
+        in_burst = len([call for call in bursts if call.at % 60 < 5])
+        self.assertGreater(in_burst, len(bursts) - in_burst)     # 200 req/burst against 110 between
+
+        diurnal = make_trace(TraceShape.DIURNAL, 400, 5)
+        night = len([call for call in diurnal if call.at < 100 or call.at >= 300])
+        self.assertGreater(len(diurnal) - night, 2 * night)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_replay_against_lobby(self):
+        requests = Queue()
+        port = free_port()
+        lobby = AsyncLobbyServer(in_queue=requests, host=HOST, port=port, reply_timeout=2)
+        lobby.start()
+        self.assertTrue(lobby.ready.wait(5))
+        running = threading.Event()
+        running.set()
+
+        def answer():
+            while running.is_set():
+                try:
+                    request = requests.get(timeout=0.1)
+                except Empty:
+                    continue
+                if 'list_all' in request.command:
+                    request.reply('{"IP":"None", "PORT":0, "MSG": "Error! Unknown Command"}')
+                else:
+                    request.reply('{"IP":"10.0.0.1", "PORT":25565, "MSG": ""}')
+
+        answerer = threading.Thread(target=answer)
+        answerer.start()
+        try:
+            trace = make_trace(TraceShape.STEADY, 1, 200, list_ratio=0.1)
+            for session in [True, False]:
+                summary = asyncio.run(run_trace(trace, HOST, port, connections=8, session=session)).summary()
+                self.assertEqual(sum(row['requests'] for row in summary.values()), len(trace))
+                self.assertEqual(sum(row['failures'] for row in summary.values()), 0)
+                self.assertEqual(summary['list_all']['errors'], summary['list_all']['requests'])
+                self.assertEqual(summary['get_server_for_team']['errors'], 0)
+                self.assertIsNotNone(summary['get_server_for_team']['p99'])
+        finally:
+            running.clear()
+            answerer.join(5)
+            lobby.kill()
+            lobby.join(5)
+
+        slower = {'status': dict(summary['status'], p99=summary['status']['p99'] * 2 + 1)}
+        self.assertEqual(len(find_regressions(slower, summary)), 1)
+        self.assertEqual(find_regressions(summary, summary), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from modules.comms.AsyncLobbyServer import AsyncLobbyServer, TIMEOUT_RESPONSE, SESSION_ACK
+from queue import Queue
+import threading
+import socket
+from testutil import HOST, free_port
+
+
+def _send(port, data):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.connect((HOST, port))
+        sock.sendall(bytes(data + "\n", "utf-8"))
+        return str(sock.recv(1024), "utf-8")
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.in_queue = Queue()
+        self.port = free_port()
+        self.lobby = AsyncLobbyServer(in_queue=self.in_queue, host=HOST, port=self.port, reply_timeout=2)
+        self.lobby.start()
+        self.assertTrue(self.lobby.ready.wait(5))
+
+    def tearDown(self):
+        self.lobby.kill()
+        self.lobby.join(5)
+
+    def test_reply_goes_to_sender(self):
+        count = 20
+        results = {}
+
+        def client(i):
+            results[i] = _send(self.port, f"msg {i}")
+
+        clients = [threading.Thread(target=client, args=(i,)) for i in range(count)]
+        for c in clients:
+            c.start()
+
+        # Answer in reverse arrival order - every connection must still get its own reply.
+        requests = [self.in_queue.get(timeout=5) for _ in range(count)]
+        for request in reversed(requests):
+            request.reply(f"reply to {request.command}")
+        for c in clients:
+            c.join(5)
+
+        for i in range(count):
+            self.assertEqual(results[i], f"reply to msg {i}")
+
+    def test_timeout_does_not_shift_replies(self):
+        self.assertEqual(_send(self.port, "first"), TIMEOUT_RESPONSE)
+        late = self.in_queue.get(timeout=5)
+
+        result = {}
+        second = threading.Thread(target=lambda: result.update(val=_send(self.port, "second")))
+        second.start()
+        request = self.in_queue.get(timeout=5)
+        late.reply("stale reply")
+        request.reply("fresh reply")
+        second.join(5)
+
+        self.assertEqual(result['val'], "fresh reply")
+
+    def test_pipelined_session(self):
+        count = 10
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect((HOST, self.port))
+            stream = sock.makefile('rwb')
+            stream.write(b"session\n")
+            stream.flush()
+            self.assertEqual(str(stream.readline(), "utf-8").strip(), SESSION_ACK)
+
+            # Send every request before reading any reply.
+            stream.write(b"".join(bytes(f"msg {i}\n", "utf-8") for i in range(count)))
+            stream.flush()
+
+            requests = [self.in_queue.get(timeout=5) for _ in range(count)]
+            for request in reversed(requests):
+                request.reply(f"reply to {request.command}")
+
+            for i in range(count):
+                self.assertEqual(str(stream.readline(), "utf-8"), f"reply to msg {i}\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from modules.LocalBackend import LocalBackend
+
+CONFIG = """
+[POOL]
+id=localtest
+mincount=2
+
+[LOCAL]
+mcPortStart=45000
+apiPortStart=45500
+nodeCommand={python} -c "import time; time.sleep(60)" {mc_port} {api_port}
+"""
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.folder.name, 'local.cfg')
+        with open(self.config, 'w') as f:
+            f.write(CONFIG)
+        self.pool = LocalBackend(config=self.config)
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.folder.cleanup()
+
+    def test_nodes_are_processes(self):
+        self.assertIsNone(self.pool.check_or_create_pool())
+        nodes = self.pool.list_nodes()
+        self.assertEqual([node.state.value for node in nodes], ['running', 'running'])
+        self.assertEqual(self.pool.get_pool().allocation_state.value, 'steady')
+        ports = sorted(endpoint.frontend_port for node in nodes
+                       for endpoint in node.endpoint_configuration.inbound_endpoints)
+        self.assertEqual(ports, [45000, 45001, 45500, 45501])
+
+    def test_resize_and_remove(self):
+        self.pool.check_or_create_pool()
+        self.pool.expand_pool(3)
+        self.assertEqual([node.state.value for node in self.pool.list_nodes()], ['running', 'running', 'idle'])
+        self.pool.add_tasks_to_start_servers(1)
+        self.assertEqual([node.state.value for node in self.pool.list_nodes()], ['running'] * 3)
+
+        first = self.pool.list_nodes()[0]
+        process = self.pool.nodes[first.id].process
+        self.pool.remove_node_from_pool(first.id)
+        self.assertIsNotNone(process.poll())
+        self.assertEqual(len(self.pool.list_nodes()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import socketserver
+import threading
+import time
+from queue import Queue
+from modules.comms.AsyncLobbyServer import AsyncLobbyServer, SESSION_ACK
+from modules.comms.NodeClient import NodeClient
+from testutil import HOST, free_port
+
+
+class OneShotHandler(socketserver.StreamRequestHandler):
+    """ Behaves like the old MCServerMain listener: one line in, one reply, close. """
+
+    def handle(self):
+        line = str(self.rfile.readline().strip(), "utf-8")
+        self.server.connections += 1
+        if line == "session":
+            self.request.sendall(b"Err: Unknown Command")
+        else:
+            self.request.sendall(bytes(f"echo {line}", "utf-8"))
+
+
+class SessionHandler(socketserver.StreamRequestHandler):
+    """ A session node that never answers "hang" and closes the connection after answering "bye". """
+
+    def handle(self):
+        for raw in self.rfile:
+            line = str(raw.strip(), "utf-8")
+            self.server.received.append(line)
+            if line == "session":
+                self.wfile.write(bytes(SESSION_ACK + "\n", "utf-8"))
+            elif line != "hang":
+                self.wfile.write(bytes(f"echo {line}\n", "utf-8"))
+            if line == "bye":
+                return
+
+
+class MyTestCase(unittest.TestCase):
+
+    def start_node(self):
+        in_queue = Queue()
+        node = AsyncLobbyServer(in_queue=in_queue, host=HOST, port=free_port(), reply_timeout=2)
+        node.start()
+        self.assertTrue(node.ready.wait(5))
+        self.addCleanup(lambda: (node.kill(), node.join(5)))
+
+        def answer():
+            while True:
+                request = in_queue.get()
+                if request is None:
+                    return
+                request.reply(f"echo {request.command}")
+        responder = threading.Thread(target=answer, daemon=True)
+        responder.start()
+        self.addCleanup(lambda: in_queue.put(None))
+        return node
+
+    def test_reuses_session_connection(self):
+        node = self.start_node()
+        client = NodeClient(HOST, node.PORT, connect_timeout=2, request_timeout=2)
+        self.addCleanup(client.close)
+        self.assertEqual(client.call("hello"), "echo hello")
+        self.assertTrue(client.sessions_supported)
+        conn = client._idle[0]
+        self.assertEqual(client.call("again"), "echo again")
+        self.assertIs(client._idle[0], conn)
+
+    def test_futures_and_bounded_pool(self):
+        node = self.start_node()
+        client = NodeClient(HOST, node.PORT, connect_timeout=2, request_timeout=2, max_idle=2)
+        self.addCleanup(client.close)
+        futures = [client.request(f"msg {i}") for i in range(20)]
+        self.assertEqual([f.result(5) for f in futures], [f"echo msg {i}" for i in range(20)])
+        self.assertLessEqual(len(client._idle), 2)
+
+    def test_falls_back_for_one_shot_nodes(self):
+        server = socketserver.TCPServer((HOST, 0), OneShotHandler)
+        server.connections = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(lambda: (server.shutdown(), server.server_close()))
+
+        client = NodeClient(HOST, server.server_address[1], connect_timeout=2, request_timeout=2)
+        self.assertEqual(client.call("hello"), "echo hello")
+        self.assertFalse(client.sessions_supported)
+        self.assertEqual(client.call("again"), "echo again")
+        self.assertEqual(server.connections, 3)     # the session probe, then one connection per request
+
+    def start_session_node(self):
+        server = socketserver.ThreadingTCPServer((HOST, 0), SessionHandler)
+        server.daemon_threads = True
+        server.received = []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(lambda: (server.shutdown(), server.server_close()))
+        return server
+
+    def test_closed_idle_connection_is_retried(self):
+        server = self.start_session_node()
+        client = NodeClient(HOST, server.server_address[1], connect_timeout=2, request_timeout=2)
+        self.addCleanup(client.close)
+        self.assertEqual(client.call("bye"), "echo bye")        # The node drops the connection we keep idle
+        self.assertEqual(client.call("hello"), "echo hello")
+        self.assertEqual(server.received.count("session"), 2)
+
+    def test_timeout_is_not_retried(self):
+        server = self.start_session_node()
+        client = NodeClient(HOST, server.server_address[1], connect_timeout=2, request_timeout=0.5)
+        self.addCleanup(client.close)
+        self.assertEqual(client.call("hello"), "echo hello")
+        began = time.monotonic()
+        with self.assertRaises(OSError):
+            client.call("hang")
+        self.assertLess(time.monotonic() - began, 0.9)
+        self.assertEqual(server.received.count("hang"), 1)
+
+    def test_dead_node_fails_fast(self):
+        client = NodeClient(HOST, free_port(), connect_timeout=1, request_timeout=1)
+        with self.assertRaises(OSError):
+            client.call("hello")
+        with self.assertRaises(OSError):
+            client.request("hello").result(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from modules.Reservations import ReservationTable
+from testutil import FakeClock
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.leases = ReservationTable(60, clock=self.clock)
+
+    def test_lease_holds_until_expiry(self):
+        self.leases.reserve('p1', 'red')
+        self.clock.now = 59
+        self.assertEqual(self.leases.active(), {'p1': 'red'})
+        self.clock.now = 60
+        self.assertEqual(self.leases.active(), {})
+        self.assertEqual(len(self.leases), 0)
+
+    def test_poll_confirms_lease(self):
+        self.leases.reserve('p1', 'red')
+        self.leases.reserve('p2', 'blue')
+        self.assertEqual(self.leases.confirm(['p1', 'p3']), 1)
+        self.assertEqual(self.leases.active(), {'p2': 'blue'})
+
+    def test_reserve_renews(self):
+        self.leases.reserve('p1', 'red')
+        self.clock.now = 50
+        self.leases.reserve('p1', 'red')
+        self.clock.now = 100
+        self.assertIn('p1', self.leases.active())
+        self.leases.release('p1')
+        self.assertNotIn('p1', self.leases)
+
+
+if __name__ == '__main__':
+    unittest.main()
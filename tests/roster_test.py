@@ -0,0 +1,38 @@
+import json
+import os
+import tempfile
+import unittest
+from modules.Roster import UserCache, merge_roster
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_merge_fills_in_players_missing_from_the_sample(self):
+        sample = {'uuid-a': 'Alice', 'uuid-b': 'Bob'}
+        names = ['Alice', 'Bob', 'carol', 'Dave']
+        uuids = {'alice': 'uuid-a', 'carol': 'uuid-c'}
+        self.assertEqual(merge_roster(sample, names, uuids),
+                         {'uuid-a': 'Alice', 'uuid-b': 'Bob', 'uuid-c': 'carol', 'Dave': 'Dave'})
+
+    def test_merge_without_query(self):
+        sample = {'uuid-a': 'Alice'}
+        self.assertEqual(merge_roster(sample, [], {}), sample)
+
+    def test_user_cache_reloads_on_change(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'usercache.json')
+            cache = UserCache(path)
+            self.assertEqual(cache.lookup(), {})
+
+            with open(path, 'w') as f:
+                json.dump([{"name": "Alice", "uuid": "uuid-a", "expiresOn": "2030-01-01 00:00:00 +0000"}], f)
+            self.assertEqual(cache.lookup(), {'alice': 'uuid-a'})
+
+            with open(path, 'w') as f:
+                json.dump([{"name": "Alice", "uuid": "uuid-a"}, {"name": "Bob", "uuid": "uuid-b"}], f)
+            os.utime(path, (cache._mtime + 1, cache._mtime + 1))
+            self.assertEqual(cache.lookup(), {'alice': 'uuid-a', 'bob': 'uuid-b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
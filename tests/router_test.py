@@ -0,0 +1,164 @@
+import unittest
+from enum import Enum
+from modules.PoolSnapshot import PoolSnapshot
+from modules.Router import Router
+from modules.Placement import PlacementIndex, PlacementStrategy, parse_anti_affinity
+
+
+class State(Enum):
+    INITIALIZING = -1
+    STABLE = 0
+    CRASHED = 99
+
+
+class FakeServer:
+    """Just the attributes a PoolSnapshot reads from a modules.Server.Server"""
+
+    def __init__(self, port, players=0, teams=(), state=State.STABLE):
+        self.ip = "10.0.0.1"
+        self.port = port
+        self.api = port + 500
+        self.node_id = f"node-{port}"
+        self.id = f"{self.ip}:{self.port}"
+        self.state = state
+        self.teams = list(teams)
+        self.players = [f"p{port}-{i}" for i in range(players)]
+        self.playercount = players
+
+
+class FakePool:
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.teams_to_servers = {team: srv for srv in servers for team in srv.teams}
+        self.snapshot = PoolSnapshot.empty()
+        self.publish()
+
+    def publish(self):
+        self.snapshot = PoolSnapshot.build(self.snapshot.version + 1, None, self.servers, self.teams_to_servers)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_snapshot_is_immutable(self):
+        server = FakeServer(44000, players=2, teams=['a'])
+        pool = FakePool([server])
+        snapshot = pool.snapshot
+        server.teams.append('b')
+        server.playercount = 9
+        self.assertEqual(snapshot.servers[0].teams, frozenset(['a']))
+        self.assertEqual(snapshot.servers[0].playercount, 2)
+        with self.assertRaises(TypeError):
+            snapshot.teams_to_servers['c'] = snapshot.servers[0]
+
+    def test_new_teams_spread_before_snapshot_catches_up(self):
+        pool = FakePool([FakeServer(44000), FakeServer(44001), FakeServer(44002, state=State.INITIALIZING)])
+        router = Router(pool, max_teams_per_server=2, max_players_per_server=20)
+
+        first = router.route_player('u1', 'red')
+        self.assertEqual(router.route_player('u2', 'red'), first)    # same team, same server
+        second = router.route_player('u3', 'blue')
+        self.assertNotEqual(first, second)                           # least loaded, and never the INITIALIZING one
+        router.route_player('u4', 'green')
+        router.route_player('u5', 'yellow')
+        self.assertIsNone(router.route_player('u6', 'purple'))      # every STABLE server holds 2 teams
+
+    def test_pending_cleared_once_published(self):
+        server = FakeServer(44000)
+        pool = FakePool([server])
+        router = Router(pool, max_teams_per_server=2, max_players_per_server=20)
+        router.route_player('u1', 'red')
+
+        server.teams.append('red')
+        server.players.append('u1')
+        server.playercount = 1
+        pool.teams_to_servers['red'] = server
+        pool.publish()
+
+        router.current_snapshot()
+        self.assertEqual(router.pending_teams, {})
+        self.assertEqual(router.pending_players, {})
+
+    def test_index_follows_poll_results(self):
+        busy = FakeServer(44000, players=8, teams=['a'])
+        quiet = FakeServer(44001, players=2, teams=['b'])
+        pool = FakePool([busy, quiet])
+        router = Router(pool, max_teams_per_server=3, max_players_per_server=20)
+        self.assertEqual(router.get_server_for_team('c').id, quiet.id)
+
+        # A poll shows the quiet server filled up and the busy one emptied out.
+        quiet.playercount = 12
+        busy.playercount = 1
+        pool.publish()
+        self.assertEqual(router.get_server_for_team('d').id, busy.id)
+        self.assertEqual([srv.id for srv in pool.servers], [busy.id, quiet.id])    # server list is never reordered
+
+    def test_placement_index(self):
+        index = PlacementIndex(max_teams_per_server=2, max_players_per_server=20)
+        index.update('a', True, 0, 5)
+        index.update('b', True, 0, 3)
+        index.update('c', False, 0, 0)
+        self.assertEqual(index.peek(), 'b')
+        index.update('b', True, 2, 3)       # b is out of team slots
+        self.assertEqual(index.peek(), 'a')
+        index.remove('a')
+        self.assertIsNone(index.peek())
+        for i in range(1000):
+            index.update('d', True, 1, i % 20)
+        self.assertEqual(index.peek(), 'd')
+        self.assertLess(len(index._heap), 100)
+
+    def test_server_for_player(self):
+        server = FakeServer(44000)
+        other = FakeServer(44001)
+        pool = FakePool([server, other])
+        router = Router(pool, max_teams_per_server=2, max_players_per_server=20)
+        self.assertIsNone(router.get_server_for_player('u1'))
+
+        routed = router.route_player('u1', 'red')
+        self.assertEqual(router.get_server_for_player('u1'), routed)    # known before the control plane catches up
+
+        pool.snapshot = PoolSnapshot.build(pool.snapshot.version + 1, None, pool.servers, pool.teams_to_servers,
+                                           {'u2': other}, {'u2': 'blue'})
+        self.assertEqual(router.get_server_for_player('u2').id, other.id)
+        self.assertEqual(pool.snapshot.players_to_teams['u2'], 'blue')
+
+        other.state = State.CRASHED
+        pool.snapshot = PoolSnapshot.build(pool.snapshot.version + 1, None, pool.servers, pool.teams_to_servers,
+                                           {'u2': other}, {'u2': 'blue'})
+        self.assertIsNone(router.get_server_for_player('u2'))
+
+    def test_best_fit_packs(self):
+        index = PlacementIndex(max_teams_per_server=3, max_players_per_server=20, strategy=PlacementStrategy.BEST_FIT,
+                               team_size=5)
+        index.update('a', True, 1, 5)
+        index.update('b', True, 1, 12)
+        index.update('c', True, 1, 16)      # only 4 player slots left - can't take a team of 5
+        self.assertEqual(index.peek(), 'b')
+        self.assertNotIn('c', index)
+
+    def test_player_capacity(self):
+        big = FakeServer(44000, players=15, teams=['a'])
+        small = FakeServer(44001, players=4, teams=['b'])
+        pool = FakePool([big, small])
+        router = Router(pool, max_teams_per_server=2, max_players_per_server=20, team_size=10)
+        self.assertEqual(router.get_server_for_team('c').id, small.id)
+        self.assertIsNone(router.get_server_for_team('d'))     # big has a team slot but not 10 player slots
+
+    def test_anti_affinity(self):
+        rules = parse_anti_affinity("1, 2; 3,4, 5")
+        self.assertEqual(rules['1'], frozenset(['2']))
+        self.assertEqual(rules['4'], frozenset(['3', '5']))
+
+        busy = FakeServer(44000, players=8, teams=[1])
+        quiet = FakeServer(44001, players=9, teams=[7])
+        pool = FakePool([busy, quiet])
+        router = Router(pool, max_teams_per_server=3, max_players_per_server=20, anti_affinity=rules)
+        self.assertEqual(router.get_server_for_team(2).id, quiet.id)     # busy has more room but holds team 1
+        self.assertEqual(router.get_server_for_team(3).id, busy.id)
+        self.assertEqual(router.get_server_for_team(4).id, quiet.id)     # pending team 3 is on busy
+        self.assertEqual(router.get_server_for_team(5).id, busy.id)      # no rule-abiding server left: soft rule
+
+
+if __name__ == '__main__':
+    unittest.main()
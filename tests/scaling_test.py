@@ -0,0 +1,144 @@
+import configparser
+import unittest
+from modules.Scaling import scale_out_deficit, CapacitySettings, DemandTracker, ThresholdPolicy, EWMAPolicy, \
+    HoltPolicy, ScalingController, make_policy
+from testutil import FakeClock
+
+
+def deficit(servers, teams, players=0):
+    return scale_out_deficit(servers=servers, teams=teams, players=players, max_teams_per_server=2,
+                             max_players_per_server=20, threshold_teams=5, min_nodes=4, max_nodes=16)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_enough_capacity(self):
+        self.assertEqual(deficit(servers=4, teams=3), 0)    # 8 slots, 5 free
+
+    def test_burst_of_teams_sized_in_one_step(self):
+        # 4 servers full (8 teams) + 10 arriving = 18 teams, + 5 headroom = 23 slots -> 12 servers
+        self.assertEqual(deficit(servers=4, teams=18), 8)
+
+    def test_player_demand(self):
+        self.assertEqual(deficit(servers=4, teams=3, players=100), 1)
+
+    def test_bounds(self):
+        self.assertEqual(deficit(servers=2, teams=0), 2)    # below mincount
+        self.assertEqual(deficit(servers=10, teams=40), 6)  # capped at maxcount
+        self.assertEqual(deficit(servers=16, teams=40), 0)
+
+
+class PolicyTestCase(unittest.TestCase):
+
+    SETTINGS = CapacitySettings(max_teams_per_server=2, max_players_per_server=20, threshold_teams=5, min_nodes=4,
+                                max_nodes=16)
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.demand = DemandTracker(alpha=0.5, beta=0.5, clock=self.clock)
+
+    def ramp(self, teams_per_minute, minutes):
+        """ Teams keep arriving and none leave """
+        teams = 0
+        for minute in range(0, minutes + 1):
+            self.clock.now = minute * 60
+            self.demand.observe(teams, teams * 5, teams, 0)
+            teams += teams_per_minute
+
+    def test_tracker_rates(self):
+        self.ramp(teams_per_minute=2, minutes=10)
+        self.assertAlmostEqual(self.demand.arrival_rate, 2 / 60, places=3)
+        self.assertEqual(self.demand.departure_rate, 0)
+        self.assertAlmostEqual(self.demand.forecast_ewma(300), 20 + 10, places=0)
+        self.assertGreater(self.demand.forecast_holt(300), 20)
+
+    def test_threshold_is_reactive(self):
+        self.ramp(teams_per_minute=1, minutes=2)     # 2 teams on 4 servers: 6 free slots
+        self.assertEqual(ThresholdPolicy(self.SETTINGS, lead_time=300).decide(self.demand, 4), 0)
+
+    def test_predictive_policies_scale_ahead(self):
+        self.ramp(teams_per_minute=1, minutes=2)
+        self.assertGreater(EWMAPolicy(self.SETTINGS, lead_time=300).decide(self.demand, 4), 0)
+        self.assertGreater(HoltPolicy(self.SETTINGS, lead_time=300).decide(self.demand, 4), 0)
+
+    def test_scale_in(self):
+        self.demand.observe(0, 0, 0, 0)
+        self.assertEqual(ThresholdPolicy(self.SETTINGS).decide(self.demand, 8), -4)
+        self.assertEqual(ThresholdPolicy(self.SETTINGS).decide(self.demand, 6), -2)
+        self.assertEqual(ThresholdPolicy(self.SETTINGS).decide(self.demand, 4), 0)
+
+    def test_make_policy(self):
+        config = configparser.ConfigParser()
+        config.read_string("[POOL]\nmincount=4\nmaxcount=16\n[SERVER]\nmaxTeamsPerServer=2\nmaxPlayersOverall=20\n"
+                           "[LOAD]\nthresholdTeamsAvailable=5\nscalingPolicy=Holt\nnodeBootLeadTime=120\n")
+        policy = make_policy(config)
+        self.assertIsInstance(policy, HoltPolicy)
+        self.assertEqual(policy.lead_time, 120)
+        self.assertEqual(policy.settings, self.SETTINGS)
+
+
+class FixedPolicy:
+    """ Recommends whatever the test sets """
+    name = 'fixed'
+
+    def __init__(self):
+        self.recommendation = 0
+
+    def forecast_teams(self, demand):
+        return demand.teams
+
+    def decide(self, demand, servers):
+        return self.recommendation
+
+
+class ControllerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.policy = FixedPolicy()
+        self.demand = DemandTracker(clock=self.clock)
+        self.controller = ScalingController(self.policy, up_window=0, down_window=300, up_cooldown=60,
+                                            down_cooldown=600, log_size=5, clock=self.clock)
+
+    def check(self, at, recommendation):
+        self.clock.now = at
+        self.policy.recommendation = recommendation
+        return self.controller.evaluate(self.demand, 4)
+
+    def test_scale_out_is_immediate_then_cools_down(self):
+        self.assertEqual(self.check(0, 3), 3)
+        self.controller.record_action(3)
+        self.assertEqual(self.check(30, 1), 0)
+        self.assertEqual(self.check(60, 1), 1)
+
+    def test_scale_in_needs_a_stable_window(self):
+        self.assertEqual(self.check(0, -1), 0)
+        self.assertEqual(self.check(200, -1), 0)
+        self.assertEqual(self.check(300, -1), -1)
+
+    def test_flapping_resets_the_window(self):
+        self.assertEqual(self.check(0, -1), 0)
+        self.assertEqual(self.check(200, 0), 0)
+        self.assertEqual(self.check(300, -1), 0)
+        self.assertEqual(self.check(599, -1), 0)
+        self.assertEqual(self.check(600, -1), -1)
+
+    def test_no_scale_in_right_after_scale_out(self):
+        self.check(0, 2)
+        self.controller.record_action(2)
+        for at in range(35, 600, 35):
+            self.assertEqual(self.check(at, -1), 0)
+        self.assertEqual(self.check(640, -1), -1)
+
+    def test_decision_log_is_bounded(self):
+        for at in range(0, 10):
+            self.check(at, -1)
+        log = self.controller.decisions()
+        self.assertEqual(len(log), 5)
+        self.assertEqual(log[-1].recommended, -1)
+        self.assertEqual(log[-1].delta, 0)
+        self.assertIn('stabilizing', log[-1].reason)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import unittest
+from modules.LobbyLoad import TraceShape
+from modules.ScalingSimulation import ScalingSimulation
+
+
+def simulate(seed, teams_per_hour=30):
+    report = ScalingSimulation(hours=2, shape=TraceShape.STEADY, teams_per_hour=teams_per_hour, seed=seed).run()
+    report.pop('wall_seconds')
+    return report
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_same_seed_same_report(self):
+        first = simulate(seed=0)
+        self.assertEqual(simulate(seed=0), first)
+        self.assertGreater(first['teams'], 0)
+        self.assertGreater(first['scale_outs'], 0)
+        self.assertGreater(first['no_capacity_replies'], 0)     # The minimum pool can't hold 30 teams an hour
+        self.assertEqual(first['simulated_hours'], 2)
+
+    def test_seed_changes_the_traffic(self):
+        self.assertNotEqual(simulate(seed=0)['lobby_requests'], simulate(seed=1)['lobby_requests'])
+
+    def test_quiet_pool_does_not_scale_out(self):
+        report = simulate(seed=0, teams_per_hour=1)
+        self.assertEqual(report['scale_outs'], 0)
+        self.assertEqual(report['no_capacity_replies'], 0)
+
+
+    def test_failed_run_cleans_up(self):
+        simulation = ScalingSimulation(hours=1, shape=TraceShape.STEADY)
+        simulation.lb.initialize = lambda sleep: False      # The pool never becomes steady
+        with self.assertRaises(RuntimeError):
+            simulation.run()
+        self.assertFalse(os.path.exists(simulation.config_file))
+        self.assertTrue(simulation.log.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
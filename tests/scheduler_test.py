@@ -0,0 +1,67 @@
+import unittest
+from modules.Scheduler import Scheduler
+from testutil import FakeClock
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = Scheduler(clock=self.clock)
+        self.runs = []
+
+    def test_runs_once_per_interval(self):
+        self.scheduler.add_job('poll', 35, lambda: self.runs.append(self.clock.now))
+        self.assertEqual(self.scheduler.time_until_next(), 35)
+
+        for step in range(0, 100 * 20):     # 100 seconds of a 50 ms loop
+            self.clock.now = step * 0.05
+            self.scheduler.run_pending()
+
+        self.assertEqual(len(self.runs), 2)
+
+    def test_missed_ticks_are_coalesced(self):
+        job = self.scheduler.add_job('poll', 10, lambda: self.runs.append(self.clock.now))
+        self.clock.now = 55     # five deadlines passed while we were busy
+        self.scheduler.run_pending()
+        self.assertEqual(self.runs, [55])
+        self.assertEqual(job.missed, 4)
+        self.assertEqual(self.scheduler.time_until_next(), 5)
+        self.assertEqual(self.scheduler.run_pending(), [])
+
+    def test_jitter_stays_around_base_schedule(self):
+        job = self.scheduler.add_job('poll', 10, lambda: None, jitter=0.2)
+        for i in range(1, 50):
+            self.assertLessEqual(abs(job.deadline - i * 10), 2)
+            self.clock.now = job.deadline
+            self.scheduler.run_pending()
+
+    def test_delay_and_run_now(self):
+        self.scheduler.add_job('scale', 10, lambda: self.runs.append(self.clock.now))
+        self.scheduler.delay('scale', 20)
+        self.assertEqual(self.scheduler.time_until_next(), 30)
+        self.scheduler.run_now('scale')
+        self.assertEqual(self.scheduler.run_pending(), ['scale'])
+        self.assertEqual(self.scheduler.time_until_next(), 10)
+
+    def test_failing_job_does_not_stop_others(self):
+        def fail():
+            raise ValueError("boom")
+        self.scheduler.add_job('bad', 10, fail)
+        self.scheduler.add_job('good', 10, lambda: self.runs.append(self.clock.now))
+        self.clock.now = 10
+        self.assertEqual(self.scheduler.run_pending(), ['bad', 'good'])
+
+    def test_jump_to_next_deadline(self):
+        # A simulation moves its clock straight to the next deadline - the job must be due exactly then
+        self.assertIsNone(self.scheduler.next_deadline())
+        self.scheduler.add_job('poll', 35, lambda: self.runs.append(self.clock.now), jitter=0.1)
+        self.scheduler.add_job('scale', 60, lambda: None)
+        for _ in range(10):
+            self.clock.now = self.scheduler.next_deadline()
+            self.assertNotEqual(self.scheduler.run_pending(), [])
+        self.assertGreaterEqual(len(self.runs), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import socket
+import time
+import unittest
+from modules.Server import Server, StatusCheck
+from testutil import FakeClock, HOST
+
+POLL_INTERVAL = 35
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.server = Server(ip="127.0.0.1", port=25565, api_port=9007, node_id="node-1", reattach=True,
+                             clock=self.clock)
+
+    def heartbeat(self, mc_up=True, players=None, online=None):
+        self.clock.now += POLL_INTERVAL
+        players = players or {}
+        return self.server.apply_heartbeat({"state": "ACTIVE", "mc_up": mc_up, "online": len(players)
+                                            if online is None else online, "players": players})
+
+    def test_one_down_heartbeat_does_not_crash(self):
+        for _ in range(20):
+            self.heartbeat()
+        self.assertTrue(self.heartbeat(mc_up=False))
+        self.assertEqual(self.server.state, Server.State.STABLE)
+        self.assertEqual(self.server.countfailures, 1)
+
+        self.heartbeat()
+        self.assertEqual(self.server.countfailures, 0)
+
+    def test_node_that_stays_down_crashes(self):
+        for _ in range(20):
+            self.heartbeat()
+        for _ in range(5):
+            self.heartbeat(mc_up=False)
+        self.assertEqual(self.server.state, Server.State.CRASHED)
+
+    def test_routed_player_keeps_players_the_sample_hid(self):
+        # 30 online, but the status sample only lists 12
+        sample = {f"uuid-{i}": f"player{i}" for i in range(12)}
+        self.heartbeat(players=sample, online=30)
+        self.assertEqual(self.server.playercount, 30)
+
+        self.server.add_player("uuid-new", "team1")
+        self.assertEqual(self.server.playercount, 31)
+
+
+    def test_silent_server_times_out_after_poll_timeout(self):
+        # Accepts the connection, never answers
+        listener = socket.socket()
+        listener.bind((HOST, 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        self.server.mcServer.port = listener.getsockname()[1]
+        self.server.mcServer.timeout = 0.2
+
+        start = time.monotonic()
+        status, _ = self.server._check_status(tries=1)
+        self.assertEqual(status, StatusCheck.DOWN)
+        self.assertLess(time.monotonic() - start, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
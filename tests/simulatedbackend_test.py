@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from modules.ComputeBackend import ComputeBackend, NodeState, AllocationState, BackendError
+from modules.SimulatedBackend import SimulatedBackend
+from testutil import FakeClock
+
+CONFIG = """
+[POOL]
+id=simtest
+mincount=2
+api_port=9007
+
+[SIMULATED]
+bootLatency=100
+bootJitter=0
+resizeLatency=10
+serverStartLatency=20
+bootFailureRate=0
+apiErrorRate=0
+"""
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.folder.name, 'sim.cfg')
+        with open(self.config, 'w') as f:
+            f.write(CONFIG)
+        self.clock = FakeClock()
+        self.pool = SimulatedBackend(config=self.config, clock=self.clock)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def states(self):
+        return sorted(node.state.value for node in self.pool.list_nodes())
+
+    def test_create_boot_and_start_servers(self):
+        self.assertIsNone(self.pool.check_or_create_pool())
+        self.assertEqual(self.pool.get_pool().allocation_state, AllocationState.resizing)
+        self.assertEqual(self.states(), ['starting', 'starting'])
+
+        self.clock.now = 10
+        self.assertEqual(self.pool.get_pool().allocation_state.value, 'steady')
+        self.clock.now = 100
+        self.assertEqual(self.states(), ['running', 'running'])
+        node = self.pool.list_nodes()[0]
+        self.assertFalse(self.pool.server_up(node.id))
+        self.clock.now = 120
+        self.assertTrue(self.pool.server_up(node.id))
+        self.assertIsNotNone(self.pool.check_or_create_pool())
+
+    def test_resize_rejected_while_resizing(self):
+        self.pool.check_or_create_pool()
+        self.assertFalse(self.pool.expand_pool(4))
+        self.clock.now = 10
+        self.assertTrue(self.pool.expand_pool(4))
+        self.assertEqual(self.pool.get_pool().target_dedicated_nodes, 4)
+
+    def test_remove_nodes_and_reuse_ports(self):
+        self.pool.check_or_create_pool()
+        self.clock.now = 200
+        first, second = self.pool.list_nodes()
+        ports = self.pool.endpoints(first.id)
+        self.assertTrue(self.pool.remove_nodes_from_pool([first.id]))
+        self.assertEqual(self.states(), ['leavingpool', 'running'])
+        self.clock.now = 210
+        self.assertEqual([node.id for node in self.pool.list_nodes()], [second.id])
+
+        self.pool.expand_pool(2)
+        self.pool.add_task_to_start_server()
+        new = [node for node in self.pool.list_nodes() if node.id != second.id][0]
+        self.assertEqual(self.pool.endpoints(new.id), ports)
+        self.assertEqual(new.endpoint_configuration.inbound_endpoints[0].frontend_port, ports[1])
+
+    def test_failure_injection(self):
+        self.pool.boot_failure_rate = 1
+        self.pool.check_or_create_pool()
+        self.clock.now = 200
+        self.assertEqual(self.states(), ['unusable', 'unusable'])
+
+        self.pool.api_error_rate = 1
+        with self.assertRaises(BackendError):
+            self.pool.get_pool()
+
+    def test_fail_node(self):
+        self.pool.check_or_create_pool()
+        self.clock.now = 200
+        node = self.pool.list_nodes()[0]
+        self.pool.fail_node(node.id)
+        self.assertFalse(self.pool.server_up(node.id))
+        self.assertIn(NodeState.unusable, [n.state for n in self.pool.list_nodes()])
+
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class NoRemoval(SimulatedBackend):
+            remove_nodes_from_pool = ComputeBackend.remove_nodes_from_pool
+
+        with self.assertRaises(TypeError):
+            NoRemoval(config=self.config, clock=self.clock)
+
+
+if __name__ == '__main__':
+    unittest.main()
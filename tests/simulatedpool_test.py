@@ -0,0 +1,203 @@
+import configparser
+import os
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import requests
+from modules.ComputeBackend import NodeState
+from modules.PoolManager import PoolManager
+from modules.Server import Server
+from root import ROOT_DIR
+from testutil import FakeClock
+
+OVERRIDES = {
+    'POOL': {'backend': 'simulated', 'heartbeat_port': '0', 'mincount': '2'},
+    'SIMULATED': {'bootLatency': '100', 'bootJitter': '0', 'resizeLatency': '10', 'serverStartLatency': '0'},
+    'LOAD': {'pollCycleDeadline': '0.5', 'pollTimeoutPerServer': '2'},
+}
+
+
+class FakeMinecraft:
+    """ Status of a node's Minecraft server. Clear .answer to make status() hang until it is set again. """
+
+    def __init__(self):
+        self.players = {}
+        self.answer = threading.Event()
+        self.answer.set()
+        self.calls = 0
+
+    def status(self, tries=1):
+        self.calls += 1
+        self.answer.wait(10)
+        sample = [SimpleNamespace(id=uuid, name=name) for uuid, name in self.players.items()]
+        return SimpleNamespace(raw={"players": {}}, players=SimpleNamespace(online=len(sample), sample=sample))
+
+
+class FakeNodeApi:
+
+    def call(self, msg):
+        return "hello"
+
+    def close(self):
+        pass
+
+
+class FakeNodesPoolManager(PoolManager):
+    """ Servers of the simulated nodes answer through FakeMinecraft / FakeNodeApi; no teams API. """
+
+    def refresh_teams(self):
+        pass
+
+    def _new_server(self, node):
+        server = PoolManager._new_server(self, node)
+        server.mcServer = FakeMinecraft()
+        server.api_client.close()
+        server.api_client = FakeNodeApi()
+        return server
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config.read(os.path.join(ROOT_DIR, 'configs/azurebatch.cfg'))
+        config.read_dict(OVERRIDES)
+        with tempfile.NamedTemporaryFile('w', suffix='.cfg', delete=False) as f:
+            config.write(f)
+        self.config_file = f.name
+        self.addCleanup(os.remove, self.config_file)
+        self.clock = FakeClock()
+        self.pool = FakeNodesPoolManager(config=self.config_file, clock=self.clock)
+        self.backend = self.pool.batchclient
+
+    def add_server(self, index):
+        server = Server(ip="127.0.0.1", port=44000 + index, api_port=44500 + index, node_id=f"node-{index}",
+                        reattach=True, config=self.config_file, clock=self.clock)
+        server.mcServer = FakeMinecraft()
+        server.api_client = FakeNodeApi()
+        self.pool.add_logical_server(server)
+        return server
+
+    def settle(self):
+        """ Let the simulated pool finish booting / resizing, then reconcile the server list with it. """
+        self.clock.now += 200
+        self.assertTrue(self.pool.poll_pool_state())
+        self.assertTrue(self.pool.update_server_list())
+
+    def server_for(self, node_id):
+        return next(server for server in self.pool.servers if server.node_id == node_id)
+
+    def test_hung_server_does_not_stall_the_cycle(self):
+        fast, hung = self.add_server(0), self.add_server(1)
+        fast.mcServer.players = {"uuid-a": "alice"}
+        hung.mcServer.players = {"uuid-b": "bob"}
+        hung.mcServer.answer.clear()
+
+        began = time.monotonic()
+        self.assertEqual(self.pool.poll_servers(), [hung])
+        self.assertLess(time.monotonic() - began, 5)
+        self.assertEqual(fast.players, ["uuid-a"])
+        self.assertEqual(hung.players, [])
+
+        # Not polled again while its first poll is still running
+        self.assertEqual(self.pool.poll_servers(), [hung])
+        self.assertEqual(hung.mcServer.calls, 1)
+
+        hung.mcServer.answer.set()
+        self.pool.polls_in_flight[hung.node_id].result(5)
+        self.assertEqual(hung.players, [])          # A finished probe changes nothing by itself...
+        self.assertEqual(self.pool.poll_servers(), [])
+        self.assertEqual(hung.players, ["uuid-b"])  # ...the next cycle applies it
+
+    def test_poll_results_are_applied_on_the_control_thread(self):
+        server = self.add_server(0)
+        server.mcServer.answer.clear()
+        self.assertEqual(self.pool.poll_servers(), [server])
+
+        # While the probe runs, the control thread routes a player and starts a merge onto the server
+        server.add_player("uuid-new", "team1")
+        server.state = Server.State.WAITING_FOR_MERGE
+        server.mcServer.players = {"uuid-a": "alice"}
+        server.mcServer.answer.set()
+        self.pool.polls_in_flight[server.node_id].result(5)
+        self.assertEqual(server.players, ["uuid-new"])
+
+        # The probe saw a STABLE server - its result is dropped, not written over the merge
+        self.pool.apply_polls()
+        self.assertNotIn(server.node_id, self.pool.polls_in_flight)
+        self.assertEqual(server.state, Server.State.WAITING_FOR_MERGE)
+        self.assertEqual(server.players, ["uuid-new"])
+
+        self.pool.poll_servers()
+        self.assertEqual(sorted(server.players), ["uuid-a", "uuid-new"])
+
+    def test_new_nodes_are_added_and_known_servers_kept(self):
+        self.backend.check_or_create_pool()
+        self.settle()
+        self.assertEqual(sorted(server.node_id for server in self.pool.servers), sorted(self.backend.nodes))
+        kept = self.pool.servers[0]
+        self.assertEqual(kept.pollTimeout, 2)          # Built with the pool's config file
+        self.assertEqual(kept.state, Server.State.STABLE)
+        kept.add_player("uuid-a", "team1")
+
+        self.assertTrue(self.backend.expand_pool(3))
+        self.settle()
+        self.assertEqual(self.pool.servercount, 3)
+        self.assertIs(self.server_for(kept.node_id), kept)
+        self.assertEqual(kept.players, ["uuid-a"])
+        self.assertEqual([server.state for server in self.pool.servers], [Server.State.STABLE] * 3)
+
+    def test_servers_of_removed_nodes_are_retired(self):
+        self.backend.check_or_create_pool()
+        self.settle()
+        gone, kept = self.pool.servers
+        gone.add_player("uuid-a", "team1")
+        self.pool.apply_player_changes(gone)
+        self.assertIs(self.pool.player_to_server_lookup["uuid-a"], gone)
+
+        self.assertTrue(self.backend.remove_nodes_from_pool([gone.node_id]))
+        self.settle()
+        self.assertEqual([server.node_id for server in self.pool.servers], [kept.node_id])
+        self.assertEqual(self.pool.servercount, 1)
+        self.assertNotIn("uuid-a", self.pool.player_to_server_lookup)
+
+    def test_node_id_seen_again_gets_a_new_server(self):
+        self.backend.check_or_create_pool()
+        self.settle()
+        server = self.pool.servers[0]
+        server.add_player("uuid-a", "team1")
+
+        # The node drops out of the pool, then comes back under the same id
+        self.backend.fail_node(server.node_id, NodeState.offline)
+        self.settle()
+        self.assertNotIn(server.node_id, [other.node_id for other in self.pool.servers])
+        self.backend.nodes[server.node_id].state = NodeState.running
+        self.settle()
+        back = self.server_for(server.node_id)
+        self.assertIsNot(back, server)
+        self.assertEqual(back.players, [])
+
+        # Same id, new endpoints: the old server can't be reached there any more
+        self.backend.nodes[server.node_id].index = 7
+        self.settle()
+        moved = self.server_for(server.node_id)
+        self.assertIsNot(moved, back)
+        self.assertEqual(moved.port, self.backend.mc_port_start + 7)
+
+
+    def test_unreachable_teams_api_keeps_the_previous_teams(self):
+        server = self.add_server(0)
+        self.pool.player_to_team_lookup = {"alice": 1}
+        with mock.patch('modules.PoolManager.requests.get', side_effect=requests.Timeout("timed out")) as get:
+            PoolManager.refresh_teams(self.pool)
+        self.assertEqual(get.call_args.kwargs['timeout'], self.pool.teams_api_timeout)
+        self.assertEqual(self.pool.player_to_team_lookup, {"alice": 1})
+        self.assertEqual(server.master_player_team_map, {"alice": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from modules.TeamMap import TeamMap
+from testutil import FakeClock
+
+
+class FakeServer:
+
+    def __init__(self, server_id, teams=()):
+        self.id = server_id
+        self.teams = set(teams)
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.map = TeamMap(120, clock=self.clock)
+
+    def test_applies_deltas(self):
+        a = FakeServer('a', ['red', 'blue'])
+        b = FakeServer('b', ['green'])
+        self.map.update_server(a)
+        self.map.update_server(b)
+        self.assertEqual(self.map.assignments, {'red': a, 'blue': a, 'green': b})
+
+        a.teams = {'red'}
+        added, removed = self.map.update_server(a)
+        self.assertEqual((added, removed), (set(), {'blue'}))
+        self.assertEqual(self.map.assignments, {'red': a, 'green': b})
+
+    def test_pending_team_survives_until_ttl(self):
+        a = FakeServer('a')
+        self.map.assign('red', a)
+        self.map.update_server(a)           # Players haven't connected yet
+        self.map.expire()
+        self.assertIn('red', self.map)
+
+        self.clock.now = 121
+        self.map.expire()
+        self.assertNotIn('red', self.map)
+
+    def test_confirmed_team_outlives_ttl(self):
+        a = FakeServer('a')
+        self.map.assign('red', a)
+        a.teams = {'red'}
+        self.map.update_server(a)
+        self.clock.now = 500
+        self.map.expire()
+        self.assertIs(self.map.assignments['red'], a)
+
+    def test_team_moved_to_another_server(self):
+        a = FakeServer('a', ['red'])
+        b = FakeServer('b')
+        self.map.update_server(a)
+        b.teams = {'red'}
+        self.map.update_server(b)
+        a.teams = set()
+        self.map.update_server(a)           # Leaving a must not drop the team from b
+        self.assertIs(self.map.assignments['red'], b)
+
+    def test_remove_and_retain(self):
+        a = FakeServer('a', ['red'])
+        b = FakeServer('b', ['green'])
+        self.map.update_server(a)
+        self.map.update_server(b)
+        self.map.remove_server(a)
+        self.assertEqual(self.map.assignments, {'green': b})
+        self.map.retain([])
+        self.assertEqual(len(self.map), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import socket
+
+"""
+Helpers shared by the unit tests.
+"""
+
+HOST = "127.0.0.1"
+
+
+class FakeClock:
+    """ A clock the test moves by hand: set .now, and anything given clock=FakeClock() sees it. """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def free_port():
+    """
+    :return: a TCP port on HOST nothing is listening on
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]